@@ -1,16 +1,59 @@
+import asyncio
 import os
+from typing import Any
+from weakref import WeakKeyDictionary
 
 import redis
+import redis.asyncio
 import sentry_sdk
 
-if "REDIS_TLS_URL" in os.environ:
-    db = redis.Redis.from_url(
-        os.environ["REDIS_TLS_URL"], ssl_cert_reqs=None, decode_responses=True
-    )
-elif "REDIS_URL" in os.environ:
-    db = redis.Redis.from_url(os.environ["REDIS_URL"], decode_responses=True)
-else:
-    db = redis.Redis(host="redis", decode_responses=True)
+
+def _make_redis(redis_module: Any, decode_responses: bool = True):
+    if "REDIS_TLS_URL" in os.environ:
+        return redis_module.Redis.from_url(
+            os.environ["REDIS_TLS_URL"],
+            ssl_cert_reqs=None,
+            decode_responses=decode_responses,
+        )
+    if "REDIS_URL" in os.environ:
+        return redis_module.Redis.from_url(
+            os.environ["REDIS_URL"], decode_responses=decode_responses
+        )
+    return redis_module.Redis(host="redis", decode_responses=decode_responses)
+
+
+class LoopLocalRedis:
+    """Proxies an asyncio Redis client of the running event loop
+
+    Asyncio connections can't be shared across loops, and Celery tasks run
+    each coroutine on a fresh one.
+    """
+
+    def __init__(self, decode_responses: bool = True):
+        self.decode_responses = decode_responses
+        self._clients: WeakKeyDictionary = WeakKeyDictionary()
+
+    def __getattr__(self, name: str) -> Any:
+        loop = asyncio.get_running_loop()
+        if loop not in self._clients:
+            self._clients[loop] = _make_redis(redis.asyncio, self.decode_responses)
+        return getattr(self._clients[loop], name)
+
+    async def close(self):
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    def reset(self):
+        "Forgets clients inherited from a parent process, without closing them"
+        self._clients.clear()
+
+
+db = _make_redis(redis)
+# Asyncio client for the request path; `db` blocks the event loop.
+adb = LoopLocalRedis()
+# Asyncio client returning bytes, for binary encoded caches
+adb_bytes = LoopLocalRedis(decode_responses=False)
 
 if "SENTRY_DSN" in os.environ:
     sentry_sdk.init(
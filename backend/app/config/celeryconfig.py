@@ -1,12 +1,19 @@
 # pylint: disable=invalid-name
 import os
+import ssl
 
 if "REDIS_TLS_URL" in os.environ:
     broker_url = os.environ["REDIS_TLS_URL"]
+    # Like the app's own Redis clients, which don't check certificates either
+    broker_use_ssl = {"ssl_cert_reqs": ssl.CERT_NONE}
+    redis_backend_use_ssl = {"ssl_cert_reqs": ssl.CERT_NONE}
 elif "REDIS_URL" in os.environ:
     broker_url = os.environ["REDIS_URL"]
 else:
     broker_url = "redis://redis"
+# Needed by the error callbacks of the nightly stats chains
+result_backend = broker_url
+result_expires = 24 * 60 * 60
 
 task_serializer = "json"
 result_serializer = "json"
@@ -1,132 +1,57 @@
-import datetime
-from dataclasses import asdict, dataclass
-from json import loads
-from typing import Iterable, Literal, TypeVar, Union
+from typing import Optional
 
-import dateutil
-from fastapi import APIRouter, FastAPI, Path
-from numpy import NaN
-from pytz import UTC
+from fastapi import APIRouter, FastAPI, Header, Path, Query
+from fastapi.responses import StreamingResponse
 
+from . import adb, adb_bytes
+from .libs.compression import compress_chunks, negotiate_encoding
+from .libs.http_client import close_clients, open_clients
+from .portfolio import Portfolio, get_portfolio_end
 from .spread import build_spread_treasury_with_assets
-from .treasury import (
-    Balances,
-    Prices,
-    TotalBalance,
-    Treasury,
-    build_treasury_with_assets,
-)
-
-
-@dataclass
-class PortfolioAsset:
-    allocation: float
-    volatility: float
-    metrics: dict[str, float]
-    risk_contribution: float
-
-
-@dataclass
-class PortfolioKpis:
-    total_value: float
-    volatility: float
-    return_vs_market: Union[float, Literal["Infinity"]]
-
-
-@dataclass
-class Portfolio:
-    assets: dict[str, PortfolioAsset]
-    kpis: PortfolioKpis
-    data: dict[str, float]
-
-    @classmethod
-    def from_treasury_with_assets(
-        cls,
-        treasury: Treasury,
-        prices: Prices,
-        balances: Balances,  # pylint: disable=unused-argument
-        total_balance: TotalBalance,
-        start: str,
-        end: str,
-    ):
-        histprices = {
-            symbol: athp.loc[start:end] for symbol, athp in prices.prices.items()
-        }
-        totalbalance = total_balance.balance.loc[start:end]
-
-        assets = {
-            a.token_symbol: PortfolioAsset(
-                allocation=a.balance_usd / treasury.usd_total,
-                metrics={}
-                if histprices[a.token_symbol][["std_dev", "returns"]].empty
-                else loads(
-                    histprices[a.token_symbol][["std_dev", "returns"]].to_json(
-                        orient="index", date_format="iso"
-                    )
-                ),
-                risk_contribution=a.risk_contribution
-                if hasattr(a, "risk_contribution")
-                else None,
-                volatility=None
-                if histprices[a.token_symbol]["std_dev"].mean() is NaN
-                else histprices[a.token_symbol]["std_dev"].mean(),
-            )
-            for a in treasury.assets
-        }
-
-        if (start not in totalbalance.index) or (totalbalance.loc[start].balance == 0):
-            market_return = "Infinity"
-        else:
-            eth_series = histprices["ETH"]
-            market_return = (
-                totalbalance.loc[end].balance - totalbalance.loc[start].balance
-            ) / totalbalance.loc[start].balance - (
-                eth_series.loc[end].price - eth_series.loc[start].price
-            ) / eth_series.loc[
-                start
-            ].price
-
-        kpis = PortfolioKpis(
-            total_value=treasury.usd_total,
-            volatility=totalbalance.std_dev.mean(),
-            return_vs_market=market_return,
-        )
-
-        data = {
-            timestamp.to_pydatetime().strftime("%Y-%m-%d"): balance
-            for timestamp, balance in totalbalance.to_dict()["balance"].items()
-        }
-        return cls(assets=assets, kpis=kpis, data=data)
-
+from .treasury import build_treasury_with_assets, retrieve_portfolio_snapshot
 
 router = APIRouter(prefix="/api")
 
-T = TypeVar("T")
-
 
-def snake_to_camel_dict_factory(items: Iterable[tuple[str, T]]) -> dict[str, T]:
-    def camel(snake_str):
-        components = snake_str.split("_")
-        return components[0] + "".join(x.title() for x in components[1:])
-
-    return {camel(k): v for k, v in items}
+def make_portfolio_response(
+    portfolio: Portfolio, response_format: str, accept_encoding: Optional[str]
+) -> StreamingResponse:
+    chunks = (
+        portfolio.iter_columnar_json()
+        if response_format == "columnar"
+        else portfolio.iter_json()
+    )
+    headers = {"Vary": "Accept-Encoding"}
+    encoding = negotiate_encoding(accept_encoding)
+    if encoding is not None:
+        chunks = compress_chunks(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(chunks, media_type="application/json", headers=headers)
 
 
 @router.get("/portfolio/{address}/{start}")
-async def get_portfolio(address: str, start=str):
-    end_date = dateutil.utils.today(UTC) - datetime.timedelta(days=1)
-    end = end_date.strftime("%Y-%m-%d")
-
-    portfolio = Portfolio.from_treasury_with_assets(
-        *(await build_treasury_with_assets(((address, 1), start, end))),
-        start,
-        end,
-    )
+async def get_portfolio(
+    address: str,
+    start=str,
+    response_format: str = Query(
+        "default", alias="format", regex="(?:(^default$)|(^columnar$))"
+    ),
+    accept_encoding: Optional[str] = Header(None),
+):
+    end = get_portfolio_end()
+
+    # Tracked treasuries are precomputed nightly for the default start.
+    snapshot = await retrieve_portfolio_snapshot(address, start, end, adb)
+    if snapshot is not None:
+        portfolio = Portfolio.from_snapshot(snapshot)
+    else:
+        portfolio = Portfolio.from_treasury_with_assets(
+            *(await build_treasury_with_assets(((address, 1), start, end))),
+            start,
+            end,
+        )
 
-    return asdict(
-        portfolio,
-        dict_factory=snake_to_camel_dict_factory,
-    )
+    return make_portfolio_response(portfolio, response_format, accept_encoding)
 
 
 @router.get(
@@ -138,6 +63,10 @@ async def backtest_spread(
     token_to_divest_from: str,
     spread_token: str = Path("USDC", regex="(?:(^USDC$)|(^ETH$))"),
     percentage: int = Path(0, ge=0, le=100),
+    response_format: str = Query(
+        "default", alias="format", regex="(?:(^default$)|(^columnar$))"
+    ),
+    accept_encoding: Optional[str] = Header(None),
 ):
     spread_tokens_metadatas = {
         "USDC": {
@@ -151,8 +80,7 @@ async def backtest_spread(
     }
 
     spread_token_metadata = spread_tokens_metadatas[spread_token]
-    end_date = dateutil.utils.today(UTC) - datetime.timedelta(days=1)
-    end = end_date.strftime("%Y-%m-%d")
+    end = get_portfolio_end()
 
     portfolio = Portfolio.from_treasury_with_assets(
         *(
@@ -172,11 +100,12 @@ async def backtest_spread(
         end,
     )
 
-    return asdict(
-        portfolio,
-        dict_factory=snake_to_camel_dict_factory,
-    )
+    return make_portfolio_response(portfolio, response_format, accept_encoding)
 
 
 app = FastAPI()
 app.include_router(router)
+app.add_event_handler("startup", open_clients)
+app.add_event_handler("shutdown", close_clients)
+app.add_event_handler("shutdown", adb.close)
+app.add_event_handler("shutdown", adb_bytes.close)
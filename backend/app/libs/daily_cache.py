@@ -0,0 +1,65 @@
+"""In-process LRU cache of data valid until the next UTC midnight"""
+from collections import OrderedDict
+from datetime import date
+from typing import Generic, Hashable, Optional, TypeVar
+
+from dateutil.tz import UTC
+from dateutil.utils import today
+
+T = TypeVar("T")
+
+
+class DailyLRUCache(Generic[T]):
+    """Keeps the `maxsize` most recently used values of the current UTC day
+
+    Upstream data is synced once a day, so all values are evicted at the UTC
+    midnight rollover, like the daily Redis caches. Values are shared: they
+    must not be mutated.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._values: OrderedDict[Hashable, T] = OrderedDict()
+        self._day: Optional[date] = None
+
+    def _rollover(self):
+        day = today(UTC).date()
+        if day != self._day:
+            self._values.clear()
+            self._day = day
+
+    def get(self, key: Hashable) -> Optional[T]:
+        self._rollover()
+        try:
+            value = self._values[key]
+        except KeyError:
+            self.misses += 1
+            return None
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[T]:
+        "Returns the value of `key` without counting nor refreshing it"
+        self._rollover()
+        return self._values.get(key)
+
+    def put(self, key: Hashable, value: T):
+        self._rollover()
+        self._values[key] = value
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self):
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._values)}
+
+    def __len__(self) -> int:
+        return len(self._values)
@@ -0,0 +1,154 @@
+"""Process-wide pooled HTTP clients for upstream data providers
+
+Clients are keyed by upstream name and by event loop: httpx connections can't
+be shared across loops, and Celery tasks run each coroutine on a fresh one.
+"""
+import asyncio
+import os
+from functools import wraps
+from typing import Any, Awaitable, Callable, TypeVar
+from weakref import WeakKeyDictionary
+
+from celery.utils.log import get_logger
+from httpx import (
+    URL,
+    AsyncBaseTransport,
+    AsyncClient,
+    AsyncHTTPTransport,
+    Limits,
+    Request,
+    Response,
+    Timeout,
+)
+
+from .. import adb, adb_bytes
+from .rate_limit import RetryTransport, TokenBucket
+from .swr_cache import wait_background_refreshes
+
+T = TypeVar("T")
+
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("HTTP_MAX_KEEPALIVE_CONNECTIONS", "20"))
+HTTP_KEEPALIVE_EXPIRY = float(os.getenv("HTTP_KEEPALIVE_EXPIRY", "30"))
+HTTP2_ENABLED = os.getenv("HTTP2_ENABLED", "false").lower() in ("1", "true", "yes")
+# Sends all upstream requests to `scripts.upstream_simulator` when set.
+UPSTREAM_SIMULATOR_URL = os.getenv("UPSTREAM_SIMULATOR_URL")
+
+UPSTREAM_TIMEOUTS: dict[str, Timeout] = {
+    "covalent": Timeout(10.0, read=90.0, connect=120.0),
+    "bitquery": Timeout(10.0, read=15.0, connect=30.0),
+    "tokenlists": Timeout(10.0, read=30.0, connect=15.0),
+}
+
+# Requests per second, before adapting to the upstream 429 responses.
+UPSTREAM_RATE_LIMITS: dict[str, float] = {
+    "covalent": float(os.getenv("COVALENT_RATE_LIMIT", "5")),
+    "bitquery": float(os.getenv("BITQUERY_RATE_LIMIT", "5")),
+    "tokenlists": float(os.getenv("TOKENLISTS_RATE_LIMIT", "10")),
+}
+_buckets: dict[str, TokenBucket] = {
+    upstream: TokenBucket(rate) for upstream, rate in UPSTREAM_RATE_LIMITS.items()
+}
+
+_clients: "WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, AsyncClient]]" = (
+    WeakKeyDictionary()
+)
+
+
+def _http2_available() -> bool:
+    if not HTTP2_ENABLED:
+        return False
+    try:
+        import h2  # pylint: disable=import-outside-toplevel,unused-import
+    except ImportError:
+        get_logger(__name__).warning(
+            "HTTP2_ENABLED is set but the `h2` package is missing, using HTTP/1.1"
+        )
+        return False
+    return True
+
+
+class SimulatorTransport(AsyncBaseTransport):
+    "Transport rewriting `https://<host>/<path>` to `<simulator>/<host>/<path>`"
+
+    def __init__(self, transport: AsyncBaseTransport, simulator_url: str):
+        self.transport = transport
+        self.simulator_url = URL(simulator_url)
+
+    async def handle_async_request(self, request: Request) -> Response:
+        url = self.simulator_url.copy_with(
+            raw_path=b"/" + request.url.raw_host + request.url.raw_path
+        )
+        headers = request.headers.copy()
+        headers["host"] = url.netloc.decode("ascii")
+        request = Request(
+            request.method,
+            url,
+            headers=headers,
+            stream=request.stream,
+            extensions=request.extensions,
+        )
+        return await self.transport.handle_async_request(request)
+
+    async def aclose(self):
+        await self.transport.aclose()
+
+
+def _make_client(upstream: str) -> AsyncClient:
+    transport: AsyncBaseTransport = AsyncHTTPTransport(
+        limits=Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        http2=_http2_available(),
+    )
+    if UPSTREAM_SIMULATOR_URL:
+        transport = SimulatorTransport(transport, UPSTREAM_SIMULATOR_URL)
+    return AsyncClient(
+        timeout=UPSTREAM_TIMEOUTS[upstream],
+        transport=RetryTransport(transport, _buckets[upstream]),
+    )
+
+
+def get_client(upstream: str) -> AsyncClient:
+    "Returns the pooled client of `upstream` for the running event loop"
+    clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(upstream)
+    if client is None or client.is_closed:
+        client = clients[upstream] = _make_client(upstream)
+    return client
+
+
+async def open_clients():
+    for upstream in UPSTREAM_TIMEOUTS:
+        get_client(upstream)
+
+
+async def close_clients():
+    clients = _clients.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+
+def reset_clients():
+    "Forgets clients inherited from a parent process, without closing them"
+    _clients.clear()
+
+
+def with_clients(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    """Closes the HTTP and Redis clients opened by `func` once it returns
+
+    Cache refreshes left running in the background by `func` are awaited first.
+    """
+
+    @wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            await wait_background_refreshes()
+            await close_clients()
+            await adb.close()
+            await adb_bytes.close()
+
+    return wrapper
@@ -0,0 +1,45 @@
+"""JSON encoding of responses straight from their underlying arrays
+
+NaN and infinite floats are encoded as `null`.
+"""
+from typing import Any, Optional
+
+import numpy as np
+import orjson
+import pandas as pd
+
+JSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+
+def dumps(obj: Any) -> bytes:
+    return orjson.dumps(obj, option=JSON_OPTIONS)
+
+
+def dump_floats(values: np.ndarray, decimals: Optional[int] = None) -> list[bytes]:
+    "Returns the JSON encoding of each float of `values`"
+    if len(values) == 0:
+        return []
+    values = np.ascontiguousarray(values, dtype="float64")
+    if decimals is not None:
+        values = values.round(decimals)
+    return dumps(values)[1:-1].split(b",")
+
+
+def dump_dates(index: pd.DatetimeIndex, unit: str = "D") -> list[bytes]:
+    """Returns the JSON strings of the UTC dates of `index`
+
+    Dates are ISO formatted up to `unit`, and times get a `Z` suffix.
+    """
+    suffix = "" if unit == "D" else "Z"
+    # Formatted dates don't need escaping.
+    return [
+        f'"{date}{suffix}"'.encode()
+        for date in np.datetime_as_string(index.asi8.view("datetime64[ns]"), unit)
+    ]
+
+
+def dump_mapping(keys: list[bytes], values: list[bytes]) -> bytes:
+    "Returns the JSON object of already encoded `keys` and `values`"
+    return (
+        b"{" + b",".join(key + b":" + value for key, value in zip(keys, values)) + b"}"
+    )
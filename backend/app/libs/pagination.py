@@ -0,0 +1,42 @@
+import asyncio
+import os
+from collections import deque
+from typing import Any, AsyncGenerator, Awaitable, Callable
+
+PAGE_WINDOW = int(os.getenv("COVALENT_PAGE_WINDOW", "4"))
+
+
+async def paginate(
+    fetch_page: Callable[[int], Awaitable[dict[str, Any]]],
+    window: int = PAGE_WINDOW,
+) -> AsyncGenerator[Any, None]:
+    """Yields the items of Covalent-style paginated `data` payloads, in order
+
+    The first page is fetched alone. After it, `window` following pages are
+    kept in flight speculatively, so that long histories are fetched in
+    parallel. Iteration stops at the first page which is empty or has no more
+    pages after it, and pages fetched past it are discarded.
+    """
+    data = await fetch_page(0)
+    for item in data["items"]:
+        yield item
+    if not data["pagination"]["has_more"] or not data["items"]:
+        return
+
+    pending: deque[asyncio.Future] = deque()
+    next_page_number = 1
+    try:
+        while True:
+            while len(pending) < window:
+                pending.append(asyncio.ensure_future(fetch_page(next_page_number)))
+                next_page_number += 1
+            data = await pending.popleft()
+            for item in data["items"]:
+                yield item
+            if not data["pagination"]["has_more"] or not data["items"]:
+                return
+    finally:
+        for future in pending:
+            future.cancel()
+        # Speculative pages past the last one may fail: their errors are moot.
+        await asyncio.gather(*pending, return_exceptions=True)
@@ -1,5 +1,3 @@
-import datetime
-
 import pandas as pd
 from dateutil.tz import UTC
 from dateutil.utils import today
@@ -8,65 +6,34 @@ from dateutil.utils import today
 def make_daily_hist_balance(
     token_symbol: str, hist_transfer_balance: pd.Series, hist_price: pd.Series
 ) -> pd.Series:
-    def find_closest_quote(date: datetime.datetime) -> float:
-        # For now, quote rates are not going as far back in time than portfolio
-        # balances, so just return 0 if no quote
-        if date < hist_price.sort_index().index[0]:
-            return 0
-
-        earlier_date = date
-        while True:
-            try:
-                return hist_price.loc[earlier_date.strftime("%Y-%m-%d")]
-            except KeyError:
-                earlier_date -= datetime.timedelta(days=1)
-                continue
-
-    _today = today(UTC)
-    filled_rows = []
-    filled_datetimes = []
-    current_balance: float
-    current_date: datetime.datetime
-    next_date: datetime.datetime
-
-    def fill_until(
-        end_date: datetime.datetime,
-        start_date: datetime.datetime,
-    ):
-        _current_date = start_date
-        while _current_date < end_date:
-            _current_quote = find_closest_quote(_current_date)
-            filled_rows.append(current_balance * _current_quote)
-            filled_datetimes.append(_current_date)
-
-            _current_date += datetime.timedelta(days=1)
-        return _current_date
-
-    rows = list(hist_transfer_balance.to_dict().items())
-
-    for index, row in enumerate(rows):
-        current_date = row[0].replace(hour=0, minute=0, second=0, microsecond=0)
-        current_balance = row[1]
-        if index < len(rows) - 1:
-            next_date = rows[index + 1][0].replace(
-                hour=0, minute=0, second=0, microsecond=0
-            )
-        else:
-            next_date = current_date + datetime.timedelta(days=1)
-            if next_date > _today:
-                break
-
-        current_date = fill_until(next_date, current_date)
+    """Returns the daily USD balance from the first transfer day until today
+
+    Each day takes the balance after the last transfer of that day or before,
+    valued at the price of that day or else of the closest day before.
+    """
+    transfer_days = hist_transfer_balance.index.floor("D")
+    days = pd.date_range(
+        transfer_days[0],
+        pd.Timestamp(today(UTC)).tz_convert(transfer_days.tz),
+        freq="D",
+        name="timestamp",
+    )
 
-    # Forward fill last dates from last balance change until today with
-    # last balance:
-    current_date = fill_until(_today + datetime.timedelta(days=1), current_date)
+    balances = hist_transfer_balance.to_numpy(dtype="float64")[
+        transfer_days.searchsorted(days, side="right") - 1
+    ]
 
-    assert current_date == _today + datetime.timedelta(days=1)
+    hist_price = hist_price.sort_index()
+    quotes = hist_price.to_numpy(dtype="float64")[
+        hist_price.index.floor("D").searchsorted(days, side="right") - 1
+    ]
+    # For now, quote rates are not going as far back in time than portfolio
+    # balances, so just return 0 if no quote
+    quotes[days < hist_price.index[0]] = 0
 
     return pd.Series(
-        filled_rows,
-        index=pd.Index(filled_datetimes, name="timestamp"),
+        balances * quotes,
+        index=pd.DatetimeIndex(days, freq=None),
         name=f"{token_symbol} daily historical balance",
         dtype="float64",
     )
@@ -1,4 +1,3 @@
-from functools import reduce
 from math import isclose
 
 import numpy as np
@@ -23,65 +22,17 @@ def make_returns_df(hist_values: pd.Series, column_name: str) -> pd.DataFrame:
     return dataframe
 
 
-def _make_returns_matrix(
-    token_returns_dfs: dict[str, pd.DataFrame],
-    start: str,
-    end: str,
-):
-    """Create a matrix containing the returns for each asset"""
-    hist_prices_items = [
-        # sorting index before querying by daterange to suppress PD Future Warning
-        # ; non-monotonic timeseries issue suppressed
-        (
-            symbol,
-            hist_prices.sort_index().loc[start:end].reset_index(),
-        )
-        for symbol, hist_prices in token_returns_dfs.items()
-        if not hist_prices.sort_index().loc[start:end].empty
-    ]
-
-    def reducer_on_symbol_and_hist_prices(
-        matrix: pd.DataFrame, symbol_and_hist_prices: tuple[str, pd.DataFrame]
-    ) -> pd.DataFrame:
-        symbol, hist_prices = symbol_and_hist_prices
-        return matrix.merge(
-            hist_prices[["timestamp", "returns"]].rename(columns={"returns": symbol}),
-            on="timestamp",
-        )
-
-    returns_matrix = (
-        reduce(
-            reducer_on_symbol_and_hist_prices,
-            hist_prices_items,
-            hist_prices_items[0][1][["timestamp", "returns"]].rename(
-                columns={"return": hist_prices_items[0][0]}
-            ),
-        )
-        .drop("returns", axis=1)
-        .set_index("timestamp")
-    )
-
-    return returns_matrix
-
-
 # pylint: disable=too-many-locals
 def calculate_risk_contributions(
-    returns_and_balances: dict[str, tuple[pd.DataFrame, float]],
-    start: str,
-    end: str,
+    returns_matrix: pd.DataFrame,
+    balances: dict[str, float],
 ) -> dict[str, float]:
-    returns_matrix = _make_returns_matrix(
-        {symbol: rb[0] for symbol, rb in returns_and_balances.items()},
-        start,
-        end,
-    )
-
-    total_balance = sum(rb[1] for rb in returns_and_balances.values())
+    total_balance = sum(balances.values())
 
     weights = np.array(
         [
             np.fromiter(
-                (returns_and_balances[symbol][1] for symbol in returns_matrix.columns),
+                (balances[symbol] for symbol in returns_matrix.columns),
                 float,
             )
             / total_balance
@@ -109,11 +60,5 @@ def calculate_risk_contributions(
     return dict(zip(returns_matrix.columns, component_percentages[0]))
 
 
-def make_returns_correlations_matrix(
-    token_returns_dfs: dict[str, pd.DataFrame],
-    start: str,
-    end: str,
-):
-    returns_matrix = _make_returns_matrix(token_returns_dfs, start, end)
-
+def make_returns_correlations_matrix(returns_matrix: pd.DataFrame) -> pd.DataFrame:
     return returns_matrix.corr()
@@ -0,0 +1,147 @@
+"""Per-upstream rate limiting and retries of HTTP requests
+
+Requests to an upstream take a token from its bucket before being sent. A 429
+response halves the bucket rate, which then recovers additively on each
+success, so that throughput settles just below the provider's real limit.
+Rate limited, unavailable and timed out requests are retried with jittered
+exponential backoff, or after the delay asked by `Retry-After`.
+
+Buckets don't hold loop-bound primitives, so they are shared by all the event
+loops of a process. They are not shared across processes.
+"""
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Optional
+
+from celery.utils.log import get_logger
+from httpx import AsyncBaseTransport, NetworkError, Request, Response, TimeoutException
+
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "4"))
+HTTP_RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+HTTP_RETRY_MAX_DELAY = float(os.getenv("HTTP_RETRY_MAX_DELAY", "60"))
+RETRIED_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class TokenBucket:
+    "Token bucket whose rate adapts to the upstream rate limiting responses"
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.max_rate = rate
+        self.min_rate = rate / 32
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(rate, 1.0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(
+            self.capacity, self.tokens + (now - self.updated_at) * self.rate
+        )
+        self.updated_at = now
+
+    async def acquire(self):
+        while True:
+            now = time.monotonic()
+            self._refill(now)
+            if now >= self.blocked_until and self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(
+                max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            )
+
+    def throttle(self, delay: float = 0.0):
+        "Halves the rate, and blocks the bucket for `delay` seconds"
+        self._refill(time.monotonic())
+        self.rate = max(self.min_rate, self.rate / 2)
+        self.tokens = min(self.tokens, 0.0)
+        self.blocked_until = max(self.blocked_until, time.monotonic() + delay)
+
+    def recover(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate / 16)
+
+
+def retry_after(response: Response) -> Optional[float]:
+    "Returns the delay in seconds asked by the `Retry-After` header, if any"
+    value = response.headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        date = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if date.tzinfo is None:
+        date = date.replace(tzinfo=timezone.utc)
+    return max(0.0, (date - datetime.now(timezone.utc)).total_seconds())
+
+
+def backoff_delay(attempt: int, base: float = HTTP_RETRY_BACKOFF) -> float:
+    "Returns a full jitter exponential backoff delay"
+    return random.uniform(0, min(HTTP_RETRY_MAX_DELAY, base * 2**attempt))
+
+
+class RetryTransport(AsyncBaseTransport):
+    "Transport sending requests through a rate limiter, with retries"
+
+    def __init__(
+        self,
+        transport: AsyncBaseTransport,
+        bucket: TokenBucket,
+        max_retries: int = HTTP_MAX_RETRIES,
+    ):
+        self.transport = transport
+        self.bucket = bucket
+        self.max_retries = max_retries
+
+    async def handle_async_request(self, request: Request) -> Response:
+        logger = get_logger(__name__)
+        attempt = 0
+        while True:
+            await self.bucket.acquire()
+            try:
+                response = await self.transport.handle_async_request(request)
+            except (TimeoutException, NetworkError) as error:
+                if attempt >= self.max_retries:
+                    raise
+                delay = backoff_delay(attempt)
+                logger.warning(
+                    "%s on %s, retrying in %.1fs",
+                    type(error).__name__,
+                    request.url.host,
+                    delay,
+                )
+            else:
+                if (
+                    response.status_code not in RETRIED_STATUS_CODES
+                    or attempt >= self.max_retries
+                ):
+                    if response.status_code != 429:
+                        self.bucket.recover()
+                    return response
+                delay = retry_after(response)
+                if delay is None:
+                    delay = backoff_delay(attempt)
+                delay = min(delay, HTTP_RETRY_MAX_DELAY)
+                if response.status_code == 429:
+                    self.bucket.throttle(delay)
+                await response.aclose()
+                logger.warning(
+                    "%s on %s, retrying in %.1fs",
+                    response.status_code,
+                    request.url.host,
+                    delay,
+                )
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def aclose(self):
+        await self.transport.aclose()
@@ -0,0 +1,96 @@
+"""Compact binary encoding of cached time series
+
+An encoded series is a header, the dates as little-endian int32 epoch days or
+int64 epoch seconds, then each float64 column, the whole payload possibly
+zlib compressed.
+"""
+import struct
+import zlib
+from typing import Sequence
+
+import numpy as np
+import pandas as pd
+
+MAGIC = b"WTS"
+VERSION = 1
+# magic, version, flags, number of columns, number of dates
+_HEADER = struct.Struct("<3sBBBI")
+_COMPRESSED = 0b01
+_SECONDS = 0b10
+_NS_PER_SECOND = 10**9
+_SECONDS_PER_DAY = 86400
+
+
+class SeriesDecodeError(ValueError):
+    pass
+
+
+def encode_series(
+    index: pd.DatetimeIndex,
+    columns: Sequence[np.ndarray],
+    unit: str = "D",
+    compress: bool = True,
+) -> bytes:
+    """Encodes float64 `columns` by `index` dates
+
+    Dates are kept up to the day or the second, by `unit` "D" or "s".
+    The payload is only kept compressed when that makes it smaller.
+    """
+    if unit not in ("D", "s"):
+        raise ValueError(f"unsupported unit {unit}")
+    seconds = index.asi8 // _NS_PER_SECOND
+    dates = (
+        (seconds // _SECONDS_PER_DAY).astype("<i4")
+        if unit == "D"
+        else seconds.astype("<i8")
+    )
+    payload = dates.tobytes() + b"".join(
+        np.ascontiguousarray(column, dtype="<f8").tobytes() for column in columns
+    )
+
+    flags = _SECONDS if unit == "s" else 0
+    if compress:
+        compressed_payload = zlib.compress(payload, 1)
+        if len(compressed_payload) < len(payload):
+            payload = compressed_payload
+            flags |= _COMPRESSED
+
+    return _HEADER.pack(MAGIC, VERSION, flags, len(columns), len(index)) + payload
+
+
+def decode_series(data: bytes) -> tuple[pd.DatetimeIndex, list[np.ndarray]]:
+    "Returns the UTC dates and float64 columns of an encoded series"
+    try:
+        magic, version, flags, n_columns, length = _HEADER.unpack_from(data)
+    except struct.error as error:
+        raise SeriesDecodeError("truncated header") from error
+    if magic != MAGIC or version != VERSION:
+        raise SeriesDecodeError(f"unsupported series encoding {magic!r} {version}")
+
+    payload = memoryview(data)[_HEADER.size :]
+    if flags & _COMPRESSED:
+        try:
+            payload = zlib.decompress(payload)
+        except zlib.error as error:
+            raise SeriesDecodeError("corrupt compressed payload") from error
+    date_dtype, ns_per_date = (
+        ("<i8", _NS_PER_SECOND)
+        if flags & _SECONDS
+        else ("<i4", _SECONDS_PER_DAY * _NS_PER_SECOND)
+    )
+    dates_size = length * np.dtype(date_dtype).itemsize
+    if len(payload) != dates_size + n_columns * length * 8:
+        raise SeriesDecodeError("truncated payload")
+
+    dates = np.frombuffer(payload, dtype=date_dtype, count=length)
+    index = pd.DatetimeIndex(
+        (dates.astype("int64") * ns_per_date).view("datetime64[ns]"),
+        name="timestamp",
+    ).tz_localize("UTC")
+    columns = [
+        np.frombuffer(
+            payload, dtype="<f8", count=length, offset=dates_size + column * length * 8
+        ).astype("float64")
+        for column in range(n_columns)
+    ]
+    return index, columns
@@ -0,0 +1,82 @@
+"""In-process coalescing of identical concurrent computations
+
+Concurrent callers asking for the same key await one shared computation
+instead of each running their own. Results are shared, so callers must not
+mutate them.
+"""
+import asyncio
+from functools import wraps
+from typing import Any, Awaitable, Callable, Hashable, Iterable, TypeVar
+from weakref import WeakKeyDictionary
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    def __init__(self):
+        # Futures can't be awaited from another event loop than their own.
+        self._calls: WeakKeyDictionary = WeakKeyDictionary()
+
+    def _in_flight(self) -> dict[Hashable, asyncio.Future]:
+        return self._calls.setdefault(asyncio.get_running_loop(), {})
+
+    async def do_many(
+        self,
+        keys: Iterable[Hashable],
+        func: Callable[[list[Hashable]], Awaitable[dict[Hashable, T]]],
+    ) -> dict[Hashable, T]:
+        """Returns the result of each key
+
+        `func` is called once, with the keys which are not already in flight,
+        and must return a dict of results by key.
+        """
+        in_flight = self._in_flight()
+        keys = list(dict.fromkeys(keys))
+        futures = {key: in_flight[key] for key in keys if key in in_flight}
+        owned_keys = [key for key in keys if key not in futures]
+
+        if owned_keys:
+            loop = asyncio.get_running_loop()
+            for key in owned_keys:
+                futures[key] = in_flight[key] = loop.create_future()
+
+            def resolve(task: asyncio.Task):
+                for key in owned_keys:
+                    future = in_flight.pop(key)
+                    if task.cancelled():
+                        future.cancel()
+                    elif task.exception() is not None:
+                        future.set_exception(task.exception())
+                    else:
+                        future.set_result(task.result().get(key))
+
+            asyncio.ensure_future(func(owned_keys)).add_done_callback(resolve)
+
+        # Shielded, so that a cancelled caller doesn't cancel the others.
+        results = await asyncio.gather(*map(asyncio.shield, futures.values()))
+        return dict(zip(futures, results))
+
+    async def call(
+        self,
+        key: Hashable,
+        func: Callable[..., Awaitable[T]],
+        *args: Any,
+        **kwargs: Any
+    ) -> T:
+        async def run(_: list[Hashable]) -> dict[Hashable, T]:
+            return {key: await func(*args, **kwargs)}
+
+        return (await self.do_many([key], run))[key]
+
+
+def single_flight(func: Callable[..., Awaitable[T]]) -> Callable[..., Awaitable[T]]:
+    "Coalesces concurrent calls of `func` with the same (hashable) arguments"
+    flights = SingleFlight()
+
+    @wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        return await flights.call(
+            (args, tuple(sorted(kwargs.items()))), func, *args, **kwargs
+        )
+
+    return wrapper
@@ -0,0 +1,212 @@
+"""Stale-while-revalidate expiry of Redis caches
+
+An entry is fresh until its soft TTL, and kept until its hard TTL. Stale
+entries are still served while a background task refreshes them, and a lock
+shared by all processes lets only one of them refresh each entry at a time.
+TTLs are jittered per entry, so that entries cached together don't go stale
+together.
+"""
+import asyncio
+import random
+from contextvars import ContextVar
+from dataclasses import dataclass
+from datetime import timedelta
+from functools import wraps
+from typing import Any, Awaitable, Callable, Optional, TypeVar, Union
+from uuid import uuid4
+
+import redis.asyncio
+from celery.utils.log import get_logger
+
+T = TypeVar("T")
+Value = Union[str, bytes]
+
+FRESH_KEY_TEMPLATE = "{key}:fresh"
+LOCK_KEY_TEMPLATE = "{key}:lock"
+# Refreshes which take longer than that may run concurrently.
+LOCK_TTL = timedelta(minutes=5)
+
+# Stale entries are refreshed before being served in this context.
+_revalidate_inline: ContextVar[bool] = ContextVar("revalidate_inline", default=False)
+# Background refreshes, referenced until done so they aren't garbage collected
+_refreshes: set[asyncio.Task] = set()
+
+
+@dataclass(frozen=True)
+class CachePolicy:
+    soft_ttl: timedelta
+    hard_ttl: timedelta
+    jitter: float = 0.1  # maximum relative deviation of TTLs
+
+    def _jittered_ms(self, ttl: timedelta) -> int:
+        return int(
+            ttl.total_seconds()
+            * 1000
+            * random.uniform(1 - self.jitter, 1 + self.jitter)
+        )
+
+    def soft_ttl_ms(self) -> int:
+        return self._jittered_ms(self.soft_ttl)
+
+    def hard_ttl_ms(self) -> int:
+        return self._jittered_ms(self.hard_ttl)
+
+
+def revalidating_inline(
+    func: Callable[..., Awaitable[T]]
+) -> Callable[..., Awaitable[T]]:
+    "Makes `func` refresh stale entries before using them, as batch jobs should"
+
+    @wraps(func)
+    async def wrapper(*args: Any, **kwargs: Any) -> T:
+        token = _revalidate_inline.set(True)
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            _revalidate_inline.reset(token)
+
+    return wrapper
+
+
+def revalidates_inline() -> bool:
+    return _revalidate_inline.get()
+
+
+def mark_fresh(key: str, policy: CachePolicy, provider) -> int:
+    """Queues in pipeline `provider` the marking of `key` as fresh for a soft TTL
+
+    Returns the soft TTL, in milliseconds.
+    """
+    soft_ttl_ms = policy.soft_ttl_ms()
+    provider.set(FRESH_KEY_TEMPLATE.format(key=key), 1, px=soft_ttl_ms)
+    return soft_ttl_ms
+
+
+def store(key: str, value: Value, policy: CachePolicy, provider) -> int:
+    """Queues in pipeline `provider` the storing of a fresh entry
+
+    Returns the time it stays fresh for, in milliseconds.
+    """
+    provider.set(key, value, px=policy.hard_ttl_ms())
+    return mark_fresh(key, policy, provider)
+
+
+async def acquire_refresh_locks(
+    keys: list[str], provider: redis.asyncio.Redis
+) -> list[Optional[str]]:
+    "Returns a lock token for each of `keys` no other process is refreshing"
+    tokens = [uuid4().hex for _ in keys]
+    async with provider.pipeline(transaction=False) as pipe:
+        for key, token in zip(keys, tokens):
+            pipe.set(
+                LOCK_KEY_TEMPLATE.format(key=key),
+                token,
+                nx=True,
+                px=int(LOCK_TTL.total_seconds() * 1000),
+            )
+        acquired = await pipe.execute()
+    return [
+        token if key_acquired else None for token, key_acquired in zip(tokens, acquired)
+    ]
+
+
+async def acquire_refresh_lock(
+    key: str, provider: redis.asyncio.Redis
+) -> Optional[str]:
+    "Returns a lock token if no other process is refreshing `key`"
+    return (await acquire_refresh_locks([key], provider))[0]
+
+
+async def release_refresh_locks(
+    keys_and_tokens: list[tuple[str, str]], provider: redis.asyncio.Redis
+):
+    "Releases the locks of `keys_and_tokens` still held with their token"
+    lock_keys = [LOCK_KEY_TEMPLATE.format(key=key) for key, _ in keys_and_tokens]
+    if not lock_keys:
+        return
+    lock_tokens = await provider.mget(lock_keys)
+    held_lock_keys = [
+        lock_key
+        for lock_key, (_, token), lock_token in zip(
+            lock_keys, keys_and_tokens, lock_tokens
+        )
+        if lock_token is not None
+        and (lock_token.decode() if isinstance(lock_token, bytes) else lock_token)
+        == token
+    ]
+    if held_lock_keys:
+        await provider.delete(*held_lock_keys)
+
+
+async def release_refresh_lock(key: str, token: str, provider: redis.asyncio.Redis):
+    await release_refresh_locks([(key, token)], provider)
+
+
+def refresh_in_background(refresh: Callable[[], Awaitable[Any]]):
+    "Runs `refresh` in a task of the running event loop, logging its errors"
+
+    async def run():
+        try:
+            await refresh()
+        except Exception:  # pylint: disable=broad-except
+            get_logger(__name__).exception("error refreshing a stale cache entry")
+
+    task = asyncio.create_task(run())
+    _refreshes.add(task)
+    task.add_done_callback(_refreshes.discard)
+
+
+async def wait_background_refreshes():
+    "Waits for the background refreshes of the running event loop"
+    loop = asyncio.get_running_loop()
+    refreshes = [task for task in _refreshes if task.get_loop() is loop]
+    if refreshes:
+        await asyncio.gather(*refreshes, return_exceptions=True)
+
+
+async def get_or_refresh(
+    key: str,
+    fetch: Callable[[], Awaitable[Value]],
+    policy: CachePolicy,
+    provider: redis.asyncio.Redis,
+) -> Value:
+    """Returns the cached value of `key`, fetching it if missing
+
+    A stale value is returned as is, and refreshed in the background by the
+    process holding its lock, unless refreshes are inline.
+    """
+    async with provider.pipeline() as pipe:
+        pipe.get(key)
+        pipe.exists(FRESH_KEY_TEMPLATE.format(key=key))
+        value, fresh = await pipe.execute()
+
+    if value is not None and fresh:
+        return value
+
+    async def refresh() -> Optional[Value]:
+        token = await acquire_refresh_lock(key, provider)
+        if token is None:
+            return None
+        try:
+            new_value = await fetch()
+            async with provider.pipeline() as pipe:
+                store(key, new_value, policy, pipe)
+                await pipe.execute()
+            return new_value
+        finally:
+            await release_refresh_lock(key, token, provider)
+
+    if value is None:
+        # Nothing to serve meanwhile: fetch even if another process is.
+        new_value = await fetch()
+        async with provider.pipeline() as pipe:
+            store(key, new_value, policy, pipe)
+            await pipe.execute()
+        return new_value
+
+    if revalidates_inline():
+        new_value = await refresh()
+        return value if new_value is None else new_value
+
+    refresh_in_background(refresh)
+    return value
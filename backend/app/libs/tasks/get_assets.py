@@ -1,40 +1,78 @@
 from asyncio import gather, run
-from datetime import datetime, timedelta
-from json import dumps
-from typing import Optional
+from datetime import datetime
+from json import JSONDecodeError
+from os import getenv
+from typing import Any, Iterable, Optional
 
+import pandas as pd
 from asgiref.sync import async_to_sync
+from celery import chain, group
+from celery.exceptions import SoftTimeLimitExceeded
 from celery.schedules import crontab
+from celery.signals import worker_process_init
 from celery.utils.log import get_task_logger
-from dateutil.tz import UTC
-from dateutil.utils import today
 from dotenv import load_dotenv
-from httpx import HTTPStatusError, ReadTimeout
+from httpx import HTTPStatusError, ReadTimeout, RequestError
 
-from ... import db
+from ... import adb, adb_bytes, db
 from ...celery_main import app as celery_app
-from ...token_whitelists import (
-    store_and_get_covalent_pairs_whitelist,
-    store_and_get_tokenlist_whitelist,
-)
+from ...portfolio import Portfolio, get_default_portfolio_start, get_portfolio_end
+from ...token_whitelists import rebuild_whitelist
 from ...treasury import (
-    build_treasury_with_assets,
+    Balances,
+    BalancesAtTransfers,
+    Prices,
+    TotalBalance,
+    Treasury,
     get_treasury_list,
+    make_transfers_balances_for_treasury,
+    make_treasuries_token_prices,
+    make_treasury_from_address,
+    make_treasury_with_assets,
     remove_treasuries_metadata,
+    retrieve_balances_at_transfers,
+    retrieve_token_hist_performances,
     retrieve_treasuries_metadata,
+    retrieve_treasury_fingerprint,
     store_treasuries_metadata,
 )
+from ...treasury.adapters.covalent import get_latest_transaction_block
+from ...treasury.adapters.covalent_pricefeed import ETH_ADDRESS
 from .. import price_stats
+from ..http_client import reset_clients, with_clients
+from ..series_codec import SeriesDecodeError, decode_series, encode_series
+from ..swr_cache import revalidating_inline
 from .redis import (
+    ASSET_HIST_PERFORMANCE_COLUMNS,
+    remove_troublesome_treasury,
     retrieve_troublesome_treasuries,
     store_asset_correlations,
     store_asset_hist_balance,
     store_asset_hist_performance,
+    store_balances_at_transfers,
+    store_portfolio_snapshot,
+    store_token_hist_performance,
+    store_treasury_fingerprint,
     store_troublesome_treasuries,
 )
 
 load_dotenv()
 
+# Maximum number of treasuries whose stats are reloaded at once
+NIGHTLY_STATS_CONCURRENCY = int(getenv("NIGHTLY_STATS_CONCURRENCY", "4"))
+# Seconds after which the reload of a treasury's stats is given up, then killed
+TREASURY_STATS_SOFT_TIME_LIMIT = int(getenv("TREASURY_STATS_SOFT_TIME_LIMIT", "600"))
+TREASURY_STATS_TIME_LIMIT = TREASURY_STATS_SOFT_TIME_LIMIT + 60
+TOKENS_STATS_SOFT_TIME_LIMIT = int(getenv("TOKENS_STATS_SOFT_TIME_LIMIT", "1800"))
+TOKENS_STATS_TIME_LIMIT = TOKENS_STATS_SOFT_TIME_LIMIT + 60
+
+
+@worker_process_init.connect
+def setup_worker_clients(**_):
+    reset_clients()
+    adb.reset()
+    adb_bytes.reset()
+
 
 @celery_app.on_after_finalize.connect
 def setup_init_tasks(sender, **_):
@@ -69,15 +107,18 @@ def setup_init_tasks(sender, **_):
 
 @celery_app.task(name="tasks.reload_treasuries_stats")
 def reload_treasuries_stats(
-    troublesome_treasuries: Optional[set[tuple[str, int]]] = None
+    troublesome_treasuries: Optional[Iterable[tuple[str, int]]] = None
 ):
-    logger = get_task_logger(__name__)
-
-    end_date: datetime = today(UTC)
-    start_date: datetime = end_date - timedelta(days=365)
+    """Fans out the reload of each treasury's stats to parallel tasks
 
-    start = start_date.isoformat()[:10]
-    end = end_date.isoformat()[:10]
+    The stats of all tokens held by the treasuries are first reloaded once.
+    Treasuries are then split into `NIGHTLY_STATS_CONCURRENCY` chains of tasks,
+    so that at most that many of them run at once, whatever the number of
+    workers.
+    """
+    # Same window as the portfolio the frontend asks for by default
+    start = get_default_portfolio_start()
+    end = get_portfolio_end()
 
     treasuries = (
         troublesome_treasuries
@@ -88,89 +129,397 @@ def reload_treasuries_stats(
         store_treasuries_metadata(db, get_treasury_list())
         treasuries = retrieve_treasuries_metadata(db)
 
-    candidate_troublesome_treasuries: set[tuple[str, int]] = set()
+    treasuries = sorted(tuple(treasury_metadata) for treasury_metadata in treasuries)
+    chains = _make_treasury_stats_chains(treasuries, start, end)
+    if chains:
+        chain(reload_tokens_stats.si(treasuries), group(chains)).apply_async()
+
+
+def _make_treasury_stats_chains(
+    treasuries: list[tuple[str, int]], start: str, end: str
+) -> list[chain]:
+    """Deals `treasuries` into at most `NIGHTLY_STATS_CONCURRENCY` chains
+
+    Each task of a chain passes the treasuries to retry on to the next one, and
+    a final task stores them. If a task of a chain is killed, the rest of the
+    chain doesn't run: all the treasuries of the chain are stored instead.
+    """
+    chains_treasuries = [
+        treasuries[chain_start::NIGHTLY_STATS_CONCURRENCY]
+        for chain_start in range(min(NIGHTLY_STATS_CONCURRENCY, len(treasuries)))
+    ]
+    return [
+        chain(
+            [
+                reload_treasury_stats.si([], treasury_metadata, start, end)
+                if i == 0
+                else reload_treasury_stats.s(treasury_metadata, start, end)
+                for i, treasury_metadata in enumerate(chain_treasuries)
+            ]
+            + [store_treasuries_to_retry.s()]
+        ).on_error(store_treasuries_to_retry.si(chain_treasuries))
+        for chain_treasuries in chains_treasuries
+    ]
+
+
+@celery_app.task(
+    name="tasks.reload_tokens_stats",
+    soft_time_limit=TOKENS_STATS_SOFT_TIME_LIMIT,
+    time_limit=TOKENS_STATS_TIME_LIMIT,
+)
+def reload_tokens_stats(treasuries: list[tuple[str, int]]):
+    """Stores the hist performance of the tokens held by `treasuries`
+
+    Tokens held by several treasuries are computed once, then shared by the
+    tasks of each treasury. If it fails, those tasks compute their tokens
+    themselves: errors are logged rather than raised, so that they still run.
+    """
+    logger = get_task_logger(__name__)
+    try:
+        token_prices = async_to_sync(
+            with_clients(revalidating_inline(make_treasuries_token_prices))
+        )([tuple(treasury_metadata) for treasury_metadata in treasuries])
 
-    for treasury_metadata in treasuries:
         with db.pipeline() as pipe:
-            try:
+            for (chain_id, token_address), (symbol, prices) in token_prices.items():
+                token_hist_performance = _encode_hist_performance(prices)
+                store_token_hist_performance(
+                    chain_id, token_address, token_hist_performance, pipe
+                )
+                store_asset_hist_performance(symbol, token_hist_performance, pipe)
+            pipe.execute()
+    except SoftTimeLimitExceeded:
+        logger.error("reloading tokens stats timed out, continuing without them")
+    except Exception:  # pylint: disable=broad-except
+        logger.exception("error reloading tokens stats, continuing without them")
+
+
+@celery_app.task(
+    name="tasks.reload_treasury_stats",
+    soft_time_limit=TREASURY_STATS_SOFT_TIME_LIMIT,
+    time_limit=TREASURY_STATS_TIME_LIMIT,
+)
+def reload_treasury_stats(
+    treasuries_to_retry: list[tuple[str, int]],
+    treasury_metadata: tuple[str, int],
+    start: str,
+    end: str,
+) -> list[tuple[str, int]]:
+    """Reloads the stats of a treasury
+
+    Returns `treasuries_to_retry`, the treasuries to retry of the previous
+    tasks of its chain, with this one if it should be retried. Otherwise, it
+    is no longer to be retried. Errors are logged rather than raised, so that
+    the rest of the chain still runs.
+    """
+    treasury_metadata = tuple(treasury_metadata)
+    try:
+        if _reload_treasury_stats(treasury_metadata, start, end):
+            remove_troublesome_treasury(treasury_metadata, provider=db)
+            return treasuries_to_retry
+    except SoftTimeLimitExceeded:
+        get_task_logger(__name__).error(
+            "reloading stats of %s timed out, continuing", treasury_metadata[0]
+        )
+    except Exception:  # pylint: disable=broad-except
+        get_task_logger(__name__).exception(
+            "error reloading stats of %s, continuing", treasury_metadata[0]
+        )
+    return [*treasuries_to_retry, treasury_metadata]
+
+
+@celery_app.task(name="tasks.store_treasuries_to_retry")
+def store_treasuries_to_retry(treasuries_to_retry: list[tuple[str, int]]):
+    troublesome_treasuries = {
+        tuple(treasury_metadata) for treasury_metadata in treasuries_to_retry
+    }
+    if troublesome_treasuries:
+        store_troublesome_treasuries(troublesome_treasuries, provider=db)
+
+
+def _encode_hist_performance(hist_performance: pd.DataFrame) -> bytes:
+    return encode_series(
+        hist_performance.index,
+        [
+            hist_performance[column].to_numpy()
+            for column in ASSET_HIST_PERFORMANCE_COLUMNS
+        ],
+    )
+
+
+def _decode_hist_performance(data: bytes) -> pd.DataFrame:
+    index, columns = decode_series(data)
+    return pd.DataFrame(dict(zip(ASSET_HIST_PERFORMANCE_COLUMNS, columns)), index=index)
+
+
+def _encode_balances_at_transfers(
+    balances_at_transfers: BalancesAtTransfers,
+) -> dict[str, bytes]:
+    return {
+        symbol: encode_series(
+            pd.DatetimeIndex(balances.index), [balances.to_numpy()], unit="s"
+        )
+        for symbol, balances in balances_at_transfers.balances.items()
+    }
+
+
+def _decode_balances_at_transfers(
+    raw_balances_at_transfers: dict[str, bytes]
+) -> BalancesAtTransfers:
+    balances = {}
+    for symbol, raw_balances in raw_balances_at_transfers.items():
+        index, (values,) = decode_series(raw_balances)
+        balances[symbol] = pd.Series(
+            values, index=index, name=f"{symbol} balance at transfer times"
+        )
+    return BalancesAtTransfers(balances=balances)
+
+
+async def _make_treasury_fingerprint(
+    treasury_address: str, chain_id: int, treasury: Treasury
+) -> Optional[dict[str, Any]]:
+    "Returns what changes with the transfers of a treasury, if it can be received"
+    try:
+        block_height = await get_latest_transaction_block(treasury_address, chain_id)
+    except (HTTPStatusError, RequestError, JSONDecodeError, KeyError) as error:
+        get_task_logger(__name__).error(
+            "error receiving the latest transaction of %s, rebuilding it",
+            treasury_address,
+            exc_info=error,
+        )
+        return None
+    return {"block_height": block_height, "holdings_hash": treasury.holdings_hash}
+
+
+async def _retrieve_unchanged_balances_at_transfers(
+    treasury_address: str, chain_id: int, fingerprint: Optional[dict[str, Any]]
+) -> Optional[BalancesAtTransfers]:
+    "Returns the stored balances at transfers of a treasury, if it didn't change"
+    if fingerprint is None:
+        return None
+    stored_fingerprint, raw_balances_at_transfers = await gather(
+        retrieve_treasury_fingerprint(treasury_address, chain_id, adb),
+        retrieve_balances_at_transfers(treasury_address, chain_id, adb_bytes),
+    )
+    if (
+        stored_fingerprint is None
+        or any(
+            stored_fingerprint.get(name) != value for name, value in fingerprint.items()
+        )
+        or set(stored_fingerprint["symbols"]) != set(raw_balances_at_transfers)
+    ):
+        return None
+    try:
+        return _decode_balances_at_transfers(raw_balances_at_transfers)
+    except SeriesDecodeError:
+        get_task_logger(__name__).exception(
+            "error decoding the stored balances of %s, rebuilding it",
+            treasury_address,
+        )
+        return None
+
+
+async def _retrieve_shared_prices(
+    chain_id: int, token_addresses: list[str], end: str
+) -> dict[str, pd.DataFrame]:
+    """Returns the hist performances stored by `reload_tokens_stats`, by token
+
+    Performances which don't reach `end` were stored by a previous run, and are
+    left out so that they are recomputed.
+    """
+    raw_token_hist_performances = await retrieve_token_hist_performances(
+        chain_id, token_addresses, adb_bytes
+    )
+    shared_prices: dict[str, pd.DataFrame] = {}
+    for token_address, token_hist_performance in zip(
+        token_addresses, raw_token_hist_performances
+    ):
+        if token_hist_performance is None:
+            continue
+        try:
+            hist_performance = _decode_hist_performance(token_hist_performance)
+        except SeriesDecodeError:
+            get_task_logger(__name__).exception(
+                "error decoding the stored performance of %s, recomputing it",
+                token_address,
+            )
+            continue
+        if hist_performance.empty or hist_performance.index[-1] < pd.Timestamp(
+            end, tz="UTC"
+        ):
+            get_task_logger(__name__).info(
+                "stored performance of %s is stale, recomputing it", token_address
+            )
+            continue
+        shared_prices[token_address] = hist_performance
+    return shared_prices
+
+
+async def build_treasury_with_shared_prices(
+    request_params: tuple[tuple[str, int], str, str]
+) -> tuple[
+    tuple[Treasury, Prices, Balances, TotalBalance],
+    BalancesAtTransfers,
+    Optional[dict[str, Any]],
+]:
+    """Builds a treasury using the token prices stored by `reload_tokens_stats`
+
+    The transfers of the treasury are only fetched again if its latest
+    transaction or its holdings changed since the last build. Otherwise, its
+    stored balances at transfers are valued at the latest prices.
+    Returns the build, with the balances at transfers and fingerprint of the
+    treasury.
+    """
+    ((treasury_address, chain_id), _, end) = request_params
+    treasury = await make_treasury_from_address(treasury_address, chain_id)
+    fingerprint = await _make_treasury_fingerprint(treasury_address, chain_id, treasury)
+
+    shared_prices, balances_at_transfers = await gather(
+        _retrieve_shared_prices(
+            chain_id,
+            list({asset.token_address for asset in treasury.assets} | {ETH_ADDRESS}),
+            end,
+        ),
+        _retrieve_unchanged_balances_at_transfers(
+            treasury_address, chain_id, fingerprint
+        ),
+    )
+
+    if balances_at_transfers is None:
+        balances_at_transfers = await make_transfers_balances_for_treasury(treasury)
+    else:
+        get_task_logger(__name__).info(
+            "%s unchanged, reusing its balances at transfers", treasury_address
+        )
+
+    return (
+        await make_treasury_with_assets(
+            request_params, shared_prices, treasury, balances_at_transfers
+        ),
+        balances_at_transfers,
+        fingerprint,
+    )
+
+
+def _reload_treasury_stats(
+    treasury_metadata: tuple[str, int], start: str, end: str
+) -> bool:
+    "Returns whether the stats of the treasury were all stored"
+    logger = get_task_logger(__name__)
+
+    with db.pipeline() as pipe:
+        try:
+            (
                 (
                     treasury,
                     augmented_token_hist_prices,
                     asset_hist_balances,
-                    _,
-                ) = async_to_sync(build_treasury_with_assets)(
-                    (treasury_metadata, start, end)
-                )
-            except TypeError:
-                # This currently only raises when the given treasury has no balance
-                logger.error(  # [FIXME]
-                    "error reducing augemented treasury balance for %s",
-                    treasury_metadata[0],
+                    total_balance,
+                ),
+                balances_at_transfers,
+                fingerprint,
+            ) = async_to_sync(
+                with_clients(revalidating_inline(build_treasury_with_shared_prices))
+            )(
+                (treasury_metadata, start, end)
+            )
+        except TypeError:
+            # This currently only raises when the given treasury has no balance
+            logger.error(  # [FIXME]
+                "error reducing augemented treasury balance for %s",
+                treasury_metadata[0],
+            )
+            return True
+        except (ReadTimeout, HTTPStatusError):
+            error_msg = "error receiving a covalent response for %s, continuing"
+            logger.error(
+                error_msg,
+                treasury_metadata[0],
+            )
+            return False
+
+        if treasury.transfer_errors:
+            logger.error(
+                "error receiving transfers of %s for %s, storing partial stats",
+                ", ".join(treasury.transfer_errors),
+                treasury_metadata[0],
+            )
+
+        for symbol, asset_hist_balance in asset_hist_balances.usd_balances.items():
+            store_asset_hist_balance(
+                treasury.address,
+                symbol,
+                encode_series(
+                    asset_hist_balance.index, [asset_hist_balance.to_numpy()]
+                ),
+                provider=pipe,
+            )
+
+        store_asset_correlations(
+            treasury.address,
+            price_stats.make_returns_correlations_matrix(
+                augmented_token_hist_prices.get_returns_matrix(start, end)
+            ).to_json(orient="index"),
+            provider=pipe,
+        )
+
+        if not treasury.transfer_errors:
+            try:
+                store_portfolio_snapshot(
+                    treasury.address,
+                    start,
+                    end,
+                    Portfolio.from_treasury_with_assets(
+                        treasury,
+                        augmented_token_hist_prices,
+                        asset_hist_balances,
+                        total_balance,
+                        start,
+                        end,
+                    ).to_snapshot(),
+                    provider=pipe,
                 )
-                continue
-            except (ReadTimeout, HTTPStatusError):
-                error_msg = "error receiving a covalent response for %s, continuing"
+            except (KeyError, ZeroDivisionError):
                 logger.error(
-                    error_msg,
+                    "error making the portfolio of %s, not storing it",
                     treasury_metadata[0],
+                    exc_info=True,
                 )
-                candidate_troublesome_treasuries.add(treasury_metadata)
-                continue
 
-            for (
-                symbol,
-                asset_hist_performance,
-            ) in augmented_token_hist_prices.prices.items():
-                store_asset_hist_performance(
-                    symbol,
-                    dumps(
-                        {
-                            ts.isoformat(): value
-                            for ts, value in asset_hist_performance.to_dict(
-                                orient="index"
-                            ).items()
-                        }
-                    ),
-                    pipe,
+            if fingerprint is not None:
+                store_balances_at_transfers(
+                    treasury_metadata[0],
+                    treasury_metadata[1],
+                    _encode_balances_at_transfers(balances_at_transfers),
+                    provider=pipe,
                 )
-
-            for symbol, asset_hist_balance in asset_hist_balances.usd_balances.items():
-                store_asset_hist_balance(
-                    treasury.address,
-                    symbol,
-                    asset_hist_balance.to_json(orient="records"),
+                store_treasury_fingerprint(
+                    treasury_metadata[0],
+                    treasury_metadata[1],
+                    {
+                        **fingerprint,
+                        "symbols": sorted(balances_at_transfers.balances),
+                    },
                     provider=pipe,
                 )
 
-            store_asset_correlations(
-                treasury.address,
-                price_stats.make_returns_correlations_matrix(
-                    augmented_token_hist_prices.prices, start, end
-                ).to_json(orient="index"),
-                provider=pipe,
-            )
+        pipe.execute()
 
-            pipe.execute()
-
-    if candidate_troublesome_treasuries:
-        store_troublesome_treasuries(candidate_troublesome_treasuries, provider=db)
+    return not treasury.transfer_errors
 
 
-async def gather_all_whitelists() -> tuple[list[str]]:
-    return await gather(
-        store_and_get_tokenlist_whitelist(db),
-        store_and_get_covalent_pairs_whitelist(db),
-    )
+async def rebuild_stored_whitelist() -> tuple[int, int]:
+    return await rebuild_whitelist(adb)
 
 
 @celery_app.task(name="tasks.reload_whitelist")
 def reload_whitelist():
-    try:
-        whitelist = run(gather_all_whitelists())
-        assert whitelist
-    except AssertionError:
-        logger = get_task_logger(__name__)
-        logger.error("reload whitelist task failed: empty whitelist")
+    logger = get_task_logger(__name__)
+    added, removed = run(with_clients(rebuild_stored_whitelist)())
+    if not added and not removed:
+        logger.info("whitelist unchanged")
+    else:
+        logger.info("whitelist updated: %d addresses added, %d removed", added, removed)
 
 
 @celery_app.task(name="tasks.reload_treasuries_list")
@@ -1,11 +1,24 @@
 import json
-from datetime import datetime, timedelta
+import random
+from datetime import timedelta
 from typing import Any, Union
 
 import redis
-from dateutil.tz import UTC
+
+from ...treasury.adapters.redis import (
+    BALANCES_AT_TRANSFERS_KEY_TEMPLATE,
+    PORTFOLIO_KEY_TEMPLATE,
+    TOKEN_HIST_PERFORMANCE_KEY_TEMPLATE,
+    TREASURY_FINGERPRINT_KEY_TEMPLATE,
+)
 
 BALANCES_KEY_TEMPLATE = "{address}_{symbol}"
+# Nightly stats outlive a failed nightly run, rather than all expiring at midnight.
+NIGHTLY_STATS_TTL = timedelta(days=2)
+# Maximum relative deviation of portfolio snapshot TTLs
+NIGHTLY_STATS_TTL_JITTER = 0.1
+# Hist performances are stored as series of these columns.
+ASSET_HIST_PERFORMANCE_COLUMNS = ("price", "returns", "std_dev")
 
 
 def store_troublesome_treasuries(
@@ -20,6 +33,13 @@ def store_troublesome_treasuries(
     provider.sadd("treasuries_to_retry", *troublesome_treasury_payload)
 
 
+def remove_troublesome_treasury(
+    troublesome_treasury: tuple[str, int],
+    provider: Union[redis.Redis, redis.client.Pipeline],
+):
+    provider.srem("treasuries_to_retry", json.dumps(troublesome_treasury))
+
+
 def retrieve_troublesome_treasuries(
     provider: Union[redis.Redis, redis.client.Pipeline]
 ) -> set[tuple[str, int]]:
@@ -36,41 +56,103 @@ def store_hash_set(
     provider: Union[redis.Redis, redis.client.Pipeline],
 ):
     provider.hset(_hash, key, value)
-
-    time_to_evict = datetime.now(tz=UTC) + timedelta(days=1)
-    provider.expireat(
-        _hash,
-        time_to_evict.replace(hour=0, minute=0, second=0),
-    )
+    provider.expire(_hash, NIGHTLY_STATS_TTL)
 
 
 def store_asset_hist_balance(
     treasury_address: str,
     symbol: str,
-    asset_hist_balance_json: str,
+    asset_hist_balance_series: bytes,
     provider: Union[redis.Redis, redis.client.Pipeline],
 ):
     store_hash_set(
         "balances",
         BALANCES_KEY_TEMPLATE.format(address=treasury_address, symbol=symbol),
-        asset_hist_balance_json,
+        asset_hist_balance_series,
         provider,
     )
 
 
 def store_asset_hist_performance(
     symbol: str,
-    asset_hist_performance_json: str,
+    asset_hist_performance_series: bytes,
+    provider: Union[redis.Redis, redis.client.Pipeline],
+):
+    store_hash_set(
+        "asset_hist_performance", symbol, asset_hist_performance_series, provider
+    )
+
+
+def store_token_hist_performance(
+    chain_id: int,
+    token_address: str,
+    token_hist_performance_series: bytes,
+    provider: Union[redis.Redis, redis.client.Pipeline],
+):
+    store_hash_set(
+        "token_hist_performance",
+        TOKEN_HIST_PERFORMANCE_KEY_TEMPLATE.format(
+            chain_id=chain_id, address=token_address
+        ),
+        token_hist_performance_series,
+        provider,
+    )
+
+
+def store_treasury_fingerprint(
+    address: str,
+    chain_id: int,
+    fingerprint: dict[str, Any],
     provider: Union[redis.Redis, redis.client.Pipeline],
 ):
     store_hash_set(
-        "asset_hist_performance", symbol, asset_hist_performance_json, provider
+        "treasury_fingerprints",
+        TREASURY_FINGERPRINT_KEY_TEMPLATE.format(
+            chain_id=chain_id, address=address.lower()
+        ),
+        json.dumps(fingerprint),
+        provider,
     )
 
 
+def store_balances_at_transfers(
+    address: str,
+    chain_id: int,
+    balances_at_transfers: dict[str, bytes],
+    provider: Union[redis.Redis, redis.client.Pipeline],
+):
+    key = BALANCES_AT_TRANSFERS_KEY_TEMPLATE.format(
+        chain_id=chain_id, address=address.lower()
+    )
+    provider.delete(key)
+    if balances_at_transfers:
+        provider.hset(key, mapping=balances_at_transfers)
+        provider.expire(key, NIGHTLY_STATS_TTL)
+
+
 def store_asset_correlations(
     address: str,
     asset_correlations_json: str,
     provider: Union[redis.Redis, redis.client.Pipeline],
 ):
     store_hash_set("asset_correlations", address, asset_correlations_json, provider)
+
+
+def store_portfolio_snapshot(
+    address: str,
+    start: str,
+    end: str,
+    portfolio_snapshot: bytes,
+    provider: Union[redis.Redis, redis.client.Pipeline],
+):
+    # One key per window, so that past windows expire on their own. TTLs are
+    # jittered, so that the snapshots of a nightly run don't expire together.
+    provider.set(
+        PORTFOLIO_KEY_TEMPLATE.format(address=address.lower(), start=start, end=end),
+        portfolio_snapshot,
+        px=int(
+            NIGHTLY_STATS_TTL.total_seconds()
+            * 1000
+            * random.uniform(1 - NIGHTLY_STATS_TTL_JITTER, 1 + NIGHTLY_STATS_TTL_JITTER)
+        ),
+    )
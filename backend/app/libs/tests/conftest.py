@@ -1,16 +1,20 @@
 # pylint: disable=unused-argument
 # pylint: disable=redefined-outer-name
 import asyncio
+import datetime
 
 import pytest
 import pytest_asyncio
 from _pytest import monkeypatch
-from fakeredis import FakeRedis
+from dateutil.tz import UTC
+from fakeredis.aioredis import FakeRedis
 
 from ...treasury import actions
 from ...treasury.adapters import covalent_pricefeed
 from ...treasury.models import Transfer
 from .. import pd_inter_calc
+from ..daily_cache import DailyLRUCache
+from ..ttl_cache import TTLLRUCache
 
 covalent_hist_prices_v2_transfers = [
     {
@@ -120,10 +124,13 @@ async def patch_covalent_pricefeed(monkeymodule):
     fake_provider = FakeRedis()
     monkeymodule.setattr(
         covalent_pricefeed,
-        "db",
+        "adb_bytes",
         fake_provider,
         raising=True,
     )
+    monkeymodule.setattr(
+        covalent_pricefeed, "price_series_cache", TTLLRUCache(8), raising=True
+    )
 
     monkeymodule.setattr(
         covalent_pricefeed.AsyncClient,
@@ -135,13 +142,11 @@ async def patch_covalent_pricefeed(monkeymodule):
 
 @pytest.fixture(scope="module")
 def patch_today(monkeymodule):
-    monkeymodule.setattr(
-        pd_inter_calc,
-        "today",
-        lambda _: pd_inter_calc.datetime.datetime(
-            2022, 7, 12, 0, 0, 0, tzinfo=pd_inter_calc.UTC
-        ),
-    )
+    def _today(_):
+        return datetime.datetime(2022, 7, 12, 0, 0, 0, tzinfo=UTC)
+
+    monkeymodule.setattr(pd_inter_calc, "today", _today)
+    monkeymodule.setattr(covalent_pricefeed, "today", _today)
 
 
 @pytest_asyncio.fixture(scope="module")
@@ -149,19 +154,20 @@ async def patch_get_token_transfers(monkeymodule):
     async def _implem(*_):
         return [
             Transfer(
-                timestamp=pd_inter_calc.datetime.datetime(
+                timestamp=datetime.datetime(
                     year=2022,
                     month=7,
                     day=12,
                     hour=22,
                     minute=59,
-                    tzinfo=pd_inter_calc.UTC,
+                    tzinfo=UTC,
                 ),
                 amount=1,
             ),
         ]
 
     monkeymodule.setattr(actions, "get_token_transfers", _implem)
+    monkeymodule.setattr(actions, "balance_series_cache", DailyLRUCache(8))
 
 
 @pytest_asyncio.fixture(scope="module")
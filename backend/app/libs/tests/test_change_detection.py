@@ -0,0 +1,77 @@
+# pylint: disable=protected-access
+# pylint: disable=redefined-outer-name
+import fakeredis
+import pandas as pd
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from ...treasury.models import BalancesAtTransfers
+from ..tasks import get_assets
+from ..tasks.redis import store_balances_at_transfers, store_treasury_fingerprint
+
+FINGERPRINT = {"block_height": 15000000, "holdings_hash": "mocked_hash"}
+
+
+@pytest.fixture
+def stored_treasury(monkeypatch: pytest.MonkeyPatch):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(
+        get_assets, "adb", FakeRedis(server=server, decode_responses=True)
+    )
+    monkeypatch.setattr(get_assets, "adb_bytes", FakeRedis(server=server))
+
+    balances_at_transfers = BalancesAtTransfers(
+        balances={
+            "ABC": pd.Series(
+                [1.0, 3.0],
+                index=pd.DatetimeIndex(
+                    ["2022-07-01 12:00:01", "2022-07-03 08:30:00"], tz="UTC"
+                ),
+            )
+        }
+    )
+    provider = fakeredis.FakeRedis(server=server, decode_responses=True)
+    store_balances_at_transfers(
+        "0xTreasury",
+        1,
+        get_assets._encode_balances_at_transfers(balances_at_transfers),
+        provider,
+    )
+    store_treasury_fingerprint(
+        "0xTreasury", 1, {**FINGERPRINT, "symbols": ["ABC"]}, provider
+    )
+    return balances_at_transfers
+
+
+@pytest.mark.asyncio
+async def test_unchanged_treasury_reuses_stored_balances(stored_treasury):
+    balances_at_transfers = await get_assets._retrieve_unchanged_balances_at_transfers(
+        "0xtreasury", 1, FINGERPRINT
+    )
+
+    assert list(balances_at_transfers.balances) == ["ABC"]
+    pd.testing.assert_series_equal(
+        balances_at_transfers.balances["ABC"],
+        stored_treasury.balances["ABC"],
+        check_names=False,
+        check_index_type=False,
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("stored_treasury")
+@pytest.mark.parametrize(
+    "fingerprint",
+    [
+        {**FINGERPRINT, "block_height": 15000001},
+        {**FINGERPRINT, "holdings_hash": "other_hash"},
+        None,
+    ],
+)
+async def test_changed_treasury_is_rebuilt(fingerprint):
+    assert (
+        await get_assets._retrieve_unchanged_balances_at_transfers(
+            "0xtreasury", 1, fingerprint
+        )
+        is None
+    )
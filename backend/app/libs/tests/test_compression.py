@@ -0,0 +1,34 @@
+import gzip
+
+import brotli
+import pytest
+
+from ..compression import compress_chunks, negotiate_encoding
+
+
+@pytest.mark.parametrize(
+    "accept_encoding,encoding",
+    [
+        (None, None),
+        ("identity", None),
+        ("gzip, deflate", "gzip"),
+        ("gzip, deflate, br", "br"),
+        ("br;q=0.5, gzip", "gzip"),
+        ("br;q=0, gzip;q=0.1", "gzip"),
+        ("*", "br"),
+        ("*;q=0", None),
+    ],
+)
+def test_negotiate_encoding(accept_encoding, encoding):
+    assert negotiate_encoding(accept_encoding) == encoding
+
+
+def test_compress_chunks():
+    chunks = [b'{"assets":{', b'"ABC":[1.0,2.0]' * 100, b"}}"]
+
+    assert gzip.decompress(b"".join(compress_chunks(chunks, "gzip"))) == b"".join(
+        chunks
+    )
+    assert brotli.decompress(b"".join(compress_chunks(chunks, "br"))) == b"".join(
+        chunks
+    )
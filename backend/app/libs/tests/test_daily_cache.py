@@ -0,0 +1,41 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+import datetime
+
+import pytest
+from dateutil.tz import UTC
+
+from .. import daily_cache
+from ..daily_cache import DailyLRUCache
+
+
+@pytest.fixture
+def patch_today(monkeypatch: pytest.MonkeyPatch):
+    day = [datetime.datetime(2022, 7, 12, tzinfo=UTC)]
+    monkeypatch.setattr(daily_cache, "today", lambda _: day[0])
+    return day
+
+
+@pytest.mark.usefixtures("patch_today")
+def test_daily_lru_cache_evicts_least_recently_used():
+    cache = DailyLRUCache(2)
+    cache.put("ETH", 1)
+    cache.put("USDC", 2)
+    assert cache.get("ETH") == 1
+
+    cache.put("WETH", 3)
+
+    assert cache.get("USDC") is None
+    assert cache.get("ETH") == 1
+    assert cache.get("WETH") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+
+def test_daily_lru_cache_evicts_all_at_midnight(patch_today):
+    cache = DailyLRUCache(2)
+    cache.put("ETH", 1)
+    patch_today[0] += datetime.timedelta(days=1)
+
+    assert cache.peek("ETH") is None
+    assert cache.get("ETH") is None
+    assert len(cache) == 0
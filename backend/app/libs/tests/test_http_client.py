@@ -0,0 +1,52 @@
+import httpx
+import pytest
+
+from .. import http_client
+
+
+@pytest.mark.asyncio
+async def test_get_client_is_shared_per_upstream():
+    covalent_client = http_client.get_client("covalent")
+
+    assert http_client.get_client("covalent") is covalent_client
+    assert http_client.get_client("bitquery") is not covalent_client
+
+    await http_client.close_clients()
+
+    assert covalent_client.is_closed
+    assert http_client.get_client("covalent") is not covalent_client
+    await http_client.close_clients()
+
+
+@pytest.mark.asyncio
+async def test_with_clients_closes_clients():
+    async def _use_client():
+        return http_client.get_client("tokenlists")
+
+    client = await http_client.with_clients(_use_client)()
+
+    assert client.is_closed
+
+
+@pytest.mark.asyncio
+async def test_simulator_transport_prefixes_upstream_host():
+    urls = []
+
+    def handler(request: httpx.Request):
+        urls.append(str(request.url))
+        return httpx.Response(200, json={"data": []})
+
+    client = httpx.AsyncClient(
+        transport=http_client.SimulatorTransport(
+            httpx.MockTransport(handler), "http://localhost:8010"
+        )
+    )
+    await client.get(
+        "https://api.covalenthq.com/v1/1/address/0xabc/transfers_v2/",
+        params={"page-number": 1},
+    )
+
+    assert urls == [
+        "http://localhost:8010/api.covalenthq.com/v1/1/address/0xabc/transfers_v2/"
+        + "?page-number=1"
+    ]
@@ -0,0 +1,141 @@
+# pylint: disable=protected-access
+# pylint: disable=redefined-outer-name
+import fakeredis
+import pandas as pd
+import pytest
+from celery.exceptions import SoftTimeLimitExceeded
+from fakeredis.aioredis import FakeRedis
+
+from .. import price_stats
+from ..tasks import get_assets
+from ..tasks.redis import retrieve_troublesome_treasuries, store_token_hist_performance
+
+START = "2021-07-13"
+END = "2022-07-13"
+
+
+@pytest.mark.parametrize("treasuries_count", [1, 3, 4, 10])
+def test_treasury_stats_chains_deal_each_treasury_once(
+    monkeypatch: pytest.MonkeyPatch, treasuries_count
+):
+    monkeypatch.setattr(get_assets, "NIGHTLY_STATS_CONCURRENCY", 4)
+    treasuries = [(f"0x{i}", 1) for i in range(treasuries_count)]
+
+    chains = get_assets._make_treasury_stats_chains(treasuries, START, END)
+
+    assert len(chains) == min(treasuries_count, 4)
+    dealt_treasuries = [
+        task.args[-3] for treasury_chain in chains for task in treasury_chain.tasks[:-1]
+    ]
+    assert sorted(dealt_treasuries) == treasuries
+    for treasury_chain in chains:
+        first_task, *next_tasks, store_task = treasury_chain.tasks
+        assert first_task.immutable and first_task.args[0] == []
+        assert all(not task.immutable for task in next_tasks)
+        assert store_task.task == "tasks.store_treasuries_to_retry"
+        # A killed task stores the treasuries of its own chain only.
+        (errback,) = treasury_chain.options["link_error"]
+        assert errback.args == ([task.args[-3] for task in treasury_chain.tasks[:-1]],)
+
+
+@pytest.mark.parametrize(
+    "error", [SoftTimeLimitExceeded(), RuntimeError("mocked error")]
+)
+def test_reload_treasury_stats_adds_failed_treasury_to_retry(
+    monkeypatch: pytest.MonkeyPatch, error
+):
+    def _reload_treasury_stats(*_):
+        raise error
+
+    monkeypatch.setattr(get_assets, "_reload_treasury_stats", _reload_treasury_stats)
+
+    assert get_assets.reload_treasury_stats([("0x1", 1)], ("0x2", 1), START, END) == [
+        ("0x1", 1),
+        ("0x2", 1),
+    ]
+
+
+@pytest.mark.parametrize("stored", [True, False])
+def test_reload_treasury_stats_passes_treasuries_to_retry_on(
+    monkeypatch: pytest.MonkeyPatch, stored
+):
+    monkeypatch.setattr(get_assets, "db", fakeredis.FakeRedis(decode_responses=True))
+    monkeypatch.setattr(get_assets, "_reload_treasury_stats", lambda *_: stored)
+
+    treasuries_to_retry = get_assets.reload_treasury_stats(
+        [("0x1", 1)], ["0x2", 1], START, END
+    )
+
+    assert treasuries_to_retry == [("0x1", 1)] + ([] if stored else [("0x2", 1)])
+
+
+def test_store_treasuries_to_retry_dedupes_chain_results(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    provider = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(get_assets, "db", provider)
+
+    # As deserialized from the chain's JSON result
+    get_assets.store_treasuries_to_retry([["0x1", 1], ["0x2", 1], ["0x1", 1]])
+
+    assert retrieve_troublesome_treasuries(provider) == {("0x1", 1), ("0x2", 1)}
+
+
+def test_reload_treasury_stats_no_longer_retries_stored_treasury(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    provider = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(get_assets, "db", provider)
+    monkeypatch.setattr(get_assets, "_reload_treasury_stats", lambda *_: True)
+    get_assets.store_treasuries_to_retry([("0x1", 1), ("0x2", 1)])
+
+    get_assets.reload_treasury_stats([], ["0x1", 1], START, END)
+
+    assert retrieve_troublesome_treasuries(provider) == {("0x2", 1)}
+
+
+@pytest.mark.parametrize(
+    "error", [SoftTimeLimitExceeded(), RuntimeError("mocked error")]
+)
+def test_reload_tokens_stats_failure_lets_treasuries_run(
+    monkeypatch: pytest.MonkeyPatch, error
+):
+    async def make_treasuries_token_prices(*_):
+        raise error
+
+    monkeypatch.setattr(
+        get_assets, "make_treasuries_token_prices", make_treasuries_token_prices
+    )
+
+    assert get_assets.reload_tokens_stats([("0x1", 1)]) is None
+
+
+@pytest.mark.asyncio
+async def test_retrieve_shared_prices_leaves_out_previous_runs(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(get_assets, "adb_bytes", FakeRedis(server=server))
+    provider = fakeredis.FakeRedis(server=server)
+    for token_address, last_day in [("0xfresh", END), ("0xstale", "2022-07-12")]:
+        prices = pd.Series(
+            [1.0, 2.0, 3.0],
+            index=pd.date_range(
+                end=last_day, periods=3, freq="D", tz="UTC", name="timestamp"
+            ),
+        )
+        store_token_hist_performance(
+            1,
+            token_address,
+            get_assets._encode_hist_performance(
+                price_stats.make_returns_df(prices, "price")
+            ),
+            provider,
+        )
+
+    shared_prices = await get_assets._retrieve_shared_prices(
+        1, ["0xfresh", "0xstale", "0xmissing"], END
+    )
+
+    assert list(shared_prices) == ["0xfresh"]
+    assert list(shared_prices["0xfresh"]["price"]) == [1.0, 2.0, 3.0]
@@ -0,0 +1,58 @@
+import asyncio
+
+import pytest
+
+from ..pagination import paginate
+
+
+def make_fetch_page(last_page_number: int, fail_after_last=False, empty_last=False):
+    fetched_page_numbers = []
+
+    async def fetch_page(page_number: int):
+        fetched_page_numbers.append(page_number)
+        # Later pages answer faster, to check that items are yielded in order.
+        await asyncio.sleep(0.001 * (10 - page_number % 10))
+        if page_number > last_page_number:
+            if fail_after_last:
+                raise KeyError("mocked page past the end")
+            return {"items": [], "pagination": {"has_more": False}}
+        has_more = empty_last or page_number < last_page_number
+        items = [] if empty_last and page_number == last_page_number else [page_number]
+        return {"items": items, "pagination": {"has_more": has_more}}
+
+    return fetch_page, fetched_page_numbers
+
+
+@pytest.mark.asyncio
+async def test_paginate_single_page():
+    fetch_page, fetched_page_numbers = make_fetch_page(0)
+
+    assert [item async for item in paginate(fetch_page, window=4)] == [0]
+    assert fetched_page_numbers == [0]
+
+
+@pytest.mark.asyncio
+async def test_paginate_yields_items_in_order():
+    fetch_page, fetched_page_numbers = make_fetch_page(11, fail_after_last=True)
+
+    assert [item async for item in paginate(fetch_page, window=4)] == [*range(12)]
+    assert fetched_page_numbers[:12] == [*range(12)]
+
+
+@pytest.mark.asyncio
+async def test_paginate_stops_at_empty_page():
+    fetch_page, _ = make_fetch_page(5, empty_last=True)
+
+    assert [item async for item in paginate(fetch_page, window=3)] == [*range(5)]
+
+
+@pytest.mark.asyncio
+async def test_paginate_raises_page_errors():
+    async def fetch_page(page_number: int):
+        if page_number == 2:
+            raise KeyError("mocked bad page")
+        return {"items": [page_number], "pagination": {"has_more": True}}
+
+    with pytest.raises(KeyError):
+        async for _ in paginate(fetch_page, window=4):
+            pass
@@ -1,9 +1,18 @@
 # pylint: disable=unused-argument
 # pylint: disable=redefined-outer-name
+import datetime
+
+import numpy as np
+import pandas as pd
 import pytest
+from dateutil.tz import UTC
 
 from ...treasury import actions
 from ...treasury.models import ERC20, Treasury
+from .. import pd_inter_calc
+from .conftest import covalent_hist_prices_v2_transfers
+
+ABC_ADDRESS = covalent_hist_prices_v2_transfers[0]["contract_address"]
 
 
 @pytest.mark.asyncio
@@ -16,7 +25,7 @@ async def test_single_tranfer_balance_lt_24hrs_after_transfer(
             ERC20(
                 token_name="abc",
                 token_symbol="ABC",
-                token_address="0xabc",
+                token_address=ABC_ADDRESS,
                 balance=1000,
                 balance_usd=285.29906,
             ),
@@ -26,7 +35,7 @@ async def test_single_tranfer_balance_lt_24hrs_after_transfer(
     balances_and_transfers = await actions.make_transfers_balances_for_treasury(
         treasury
     )
-    prices = await actions.make_prices_from_tokens({("ABC", "0xabc")})
+    prices = await actions.make_prices_from_tokens({("ABC", ABC_ADDRESS)})
 
     balances = await actions.make_balances_from_transfers_and_prices(
         balances_and_transfers, prices
@@ -39,3 +48,76 @@ async def test_single_tranfer_balance_lt_24hrs_after_transfer(
         balances.usd_balances["ABC"].iloc[-1]
         == abc_price_for_date_of_last_transfer * abc_current_balance
     )
+
+
+def _make_daily_hist_balance_loop(
+    token_symbol: str, hist_transfer_balance: pd.Series, hist_price: pd.Series
+) -> pd.Series:
+    "Day by day implementation `make_daily_hist_balance` must stay equal to"
+
+    def find_closest_quote(date: datetime.datetime) -> float:
+        if date < hist_price.sort_index().index[0]:
+            return 0
+
+        earlier_date = date
+        while True:
+            try:
+                return hist_price.loc[earlier_date.strftime("%Y-%m-%d")]
+            except KeyError:
+                earlier_date -= datetime.timedelta(days=1)
+                continue
+
+    _today = pd_inter_calc.today(UTC)
+    filled_rows = []
+    filled_datetimes = []
+    rows = list(hist_transfer_balance.to_dict().items())
+    for index, (timestamp, balance) in enumerate(rows):
+        current_date = timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+        if index < len(rows) - 1:
+            next_date = rows[index + 1][0].replace(
+                hour=0, minute=0, second=0, microsecond=0
+            )
+        else:
+            next_date = _today + datetime.timedelta(days=1)
+        while current_date < next_date:
+            filled_rows.append(balance * find_closest_quote(current_date))
+            filled_datetimes.append(current_date)
+            current_date += datetime.timedelta(days=1)
+
+    return pd.Series(
+        filled_rows,
+        index=pd.Index(filled_datetimes, name="timestamp"),
+        name=f"{token_symbol} daily historical balance",
+        dtype="float64",
+    )
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_make_daily_hist_balance_equals_day_by_day_implementation(monkeypatch, seed):
+    monkeypatch.setattr(
+        pd_inter_calc, "today", lambda _: datetime.datetime(2022, 7, 13, tzinfo=UTC)
+    )
+    rng = np.random.default_rng(seed)
+    transfer_times = pd.DatetimeIndex(
+        np.sort(
+            pd.Timestamp("2021-01-01", tz=UTC).value
+            + rng.integers(0, 500 * 86400, size=60) * 10**9
+        ),
+        name="timestamp",
+    ).tz_localize(UTC)
+    hist_transfer_balance = pd.Series(
+        rng.uniform(-10, 1000, size=60), index=transfer_times, dtype="float64"
+    )
+    # Prices start after the first transfers, with missing days and a NaN.
+    price_days = pd.date_range("2021-02-01", "2022-07-13", freq="D", tz=UTC)
+    price_days = price_days[rng.uniform(size=len(price_days)) > 0.2]
+    hist_price = pd.Series(
+        rng.uniform(0.1, 10, size=len(price_days)),
+        index=pd.Index(price_days, name="timestamp"),
+    )
+    hist_price.iloc[3] = np.nan
+
+    pd.testing.assert_series_equal(
+        pd_inter_calc.make_daily_hist_balance("ABC", hist_transfer_balance, hist_price),
+        _make_daily_hist_balance_loop("ABC", hist_transfer_balance, hist_price),
+    )
@@ -0,0 +1,47 @@
+import pandas as pd
+from dateutil.tz import UTC
+
+from ...treasury.models import Prices
+from .. import price_stats
+
+
+def make_returns_df(start: str, prices: list[float]) -> pd.DataFrame:
+    return price_stats.make_returns_df(
+        pd.Series(
+            prices,
+            index=pd.date_range(
+                start, periods=len(prices), freq="D", tz=UTC, name="timestamp"
+            ),
+        ),
+        "price",
+    )
+
+
+def test_returns_matrix_keeps_dates_all_tokens_have():
+    prices = Prices(
+        prices={
+            "ABC": make_returns_df("2022-07-01", [1.0, 2.0, 4.0, 2.0, 1.0]),
+            "DEF": make_returns_df("2022-07-03", [3.0, 6.0, 3.0, 6.0]),
+            "GHI": make_returns_df("2022-08-01", [1.0, 2.0]),
+        }
+    )
+
+    returns_matrix = prices.get_returns_matrix("2022-07-02", "2022-07-10")
+
+    assert list(returns_matrix.columns) == ["ABC", "DEF"]
+    assert list(returns_matrix.index.strftime("%Y-%m-%d")) == [
+        "2022-07-03",
+        "2022-07-04",
+        "2022-07-05",
+    ]
+    assert (
+        returns_matrix.loc["2022-07-04", "ABC"]
+        == prices.prices["ABC"].loc["2022-07-04", "returns"]
+    )
+    assert returns_matrix.index.name == "timestamp"
+    pd.testing.assert_frame_equal(
+        prices.get_returns_matrix("2022-07-02", "2022-07-10"), returns_matrix
+    )
+    assert list(
+        prices.get_returns_matrix("2022-07-02", "2022-07-10", {"DEF"}).columns
+    ) == ["DEF"]
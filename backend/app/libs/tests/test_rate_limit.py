@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import httpx
+import pytest
+
+from .. import rate_limit
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(rate_limit, "backoff_delay", lambda attempt: 0.0)
+
+
+def make_client(responses: list, bucket=None, max_retries=3):
+    requests = []
+
+    def handler(request: httpx.Request):
+        requests.append(request)
+        response = responses[min(len(requests), len(responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    transport = rate_limit.RetryTransport(
+        httpx.MockTransport(handler),
+        bucket or rate_limit.TokenBucket(1000),
+        max_retries=max_retries,
+    )
+    return httpx.AsyncClient(transport=transport), requests
+
+
+@pytest.mark.asyncio
+async def test_retries_unavailable_upstream():
+    client, requests = make_client(
+        [httpx.Response(503), httpx.Response(200, json={"data": 1})]
+    )
+
+    resp = await client.get("https://api.covalenthq.com/v1/")
+
+    assert resp.status_code == 200
+    assert resp.json() == {"data": 1}
+    assert len(requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_retries_timeouts_until_max_retries():
+    client, requests = make_client([httpx.ReadTimeout("mocked timeout")])
+
+    with pytest.raises(httpx.ReadTimeout):
+        await client.get("https://api.covalenthq.com/v1/")
+    assert len(requests) == 4
+
+
+@pytest.mark.asyncio
+async def test_returns_last_response_after_max_retries():
+    client, requests = make_client([httpx.Response(502)], max_retries=1)
+
+    resp = await client.get("https://api.covalenthq.com/v1/")
+
+    assert resp.status_code == 502
+    assert len(requests) == 2
+
+
+@pytest.mark.asyncio
+async def test_rate_limited_response_throttles_bucket():
+    bucket = rate_limit.TokenBucket(1000)
+    client, requests = make_client(
+        [httpx.Response(429, headers={"Retry-After": "0"}), httpx.Response(200)],
+        bucket=bucket,
+    )
+
+    resp = await client.get("https://api.covalenthq.com/v1/")
+
+    assert resp.status_code == 200
+    assert len(requests) == 2
+    assert bucket.rate == pytest.approx(500 + 1000 / 16)
+
+
+def test_token_bucket_recovers_up_to_max_rate():
+    bucket = rate_limit.TokenBucket(16)
+    bucket.throttle()
+    assert bucket.rate == 8
+
+    for _ in range(20):
+        bucket.recover()
+    assert bucket.rate == 16
+
+
+def test_retry_after():
+    assert rate_limit.retry_after(httpx.Response(429)) is None
+    assert rate_limit.retry_after(
+        httpx.Response(429, headers={"Retry-After": "12"})
+    ) == pytest.approx(12)
+
+    date = datetime.now(timezone.utc) + timedelta(seconds=30)
+    delay = rate_limit.retry_after(
+        httpx.Response(429, headers={"Retry-After": format_datetime(date, usegmt=True)})
+    )
+    assert 28 < delay <= 30
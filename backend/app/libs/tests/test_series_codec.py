@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from ..series_codec import SeriesDecodeError, decode_series, encode_series
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_encoded_daily_series_round_trips(compress):
+    index = pd.date_range("2022-07-01", periods=366, freq="D", tz="UTC")
+    prices = np.linspace(1, 2, 366)
+    prices[3] = np.nan
+
+    encoded = encode_series(index, [prices, np.zeros(366)], compress=compress)
+    decoded_index, (decoded_prices, zeros) = decode_series(encoded)
+
+    pd.testing.assert_index_equal(decoded_index, index.rename("timestamp"), exact=False)
+    np.testing.assert_array_equal(decoded_prices, prices)
+    np.testing.assert_array_equal(zeros, np.zeros(366))
+    assert len(encoded) < len(pd.Series(prices, index=index).to_json())
+    if not compress:
+        assert len(encoded) == 10 + 366 * (4 + 8 + 8)
+
+
+def test_encoded_series_keeps_seconds():
+    index = pd.DatetimeIndex(["2022-07-12T22:59:01Z", "2022-07-01T00:00:00Z"])
+
+    decoded_index, (amounts,) = decode_series(
+        encode_series(index, [[1.5, -1.0]], unit="s")
+    )
+
+    assert list(decoded_index) == list(index)
+    assert list(amounts) == [1.5, -1.0]
+
+
+def test_decoding_rejects_other_encodings():
+    encoded = encode_series(pd.DatetimeIndex([], tz="UTC"), [[]])
+
+    with pytest.raises(SeriesDecodeError):
+        decode_series(b'{"2022-07-01": 1.0}')
+    with pytest.raises(SeriesDecodeError):
+        decode_series(encoded[:3] + b"\x02" + encoded[4:])
+    with pytest.raises(SeriesDecodeError):
+        decode_series(
+            encode_series(pd.DatetimeIndex(["2022-07-01"], tz="UTC"), [[1.0]])[:-1]
+        )
+
+
+def test_decoding_rejects_truncated_compressed_payloads():
+    encoded = encode_series(
+        pd.date_range("2022-07-01", periods=366, freq="D", tz="UTC"),
+        [np.zeros(366)],
+    )
+
+    with pytest.raises(SeriesDecodeError):
+        decode_series(encoded[: len(encoded) // 2])
@@ -0,0 +1,78 @@
+import asyncio
+
+import pytest
+
+from ..single_flight import SingleFlight, single_flight
+
+
+@pytest.mark.asyncio
+async def test_single_flight_coalesces_concurrent_calls():
+    calls = []
+
+    @single_flight
+    async def compute(key: str):
+        calls.append(key)
+        await asyncio.sleep(0.01)
+        return {"key": key}
+
+    results = await asyncio.gather(compute("a"), compute("a"), compute("b"))
+
+    assert calls == ["a", "b"]
+    assert results[0] is results[1]
+    assert results[2] == {"key": "b"}
+
+    await compute("a")
+    assert calls == ["a", "b", "a"]
+
+
+@pytest.mark.asyncio
+async def test_single_flight_shares_errors():
+    calls = []
+
+    @single_flight
+    async def compute():
+        calls.append(None)
+        await asyncio.sleep(0.01)
+        raise KeyError("mocked error")
+
+    results = await asyncio.gather(compute(), compute(), return_exceptions=True)
+
+    assert len(calls) == 1
+    assert all(isinstance(result, KeyError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_caller():
+    @single_flight
+    async def compute():
+        await asyncio.sleep(0.01)
+        return 1
+
+    cancelled = asyncio.ensure_future(compute())
+    other = asyncio.ensure_future(compute())
+    await asyncio.sleep(0)
+    cancelled.cancel()
+
+    assert await other == 1
+    with pytest.raises(asyncio.CancelledError):
+        await cancelled
+
+
+@pytest.mark.asyncio
+async def test_do_many_computes_only_keys_not_in_flight():
+    flights = SingleFlight()
+    batches = []
+
+    async def compute(keys: list[str]):
+        batches.append(keys)
+        await asyncio.sleep(0.01)
+        return {key: key.upper() for key in keys}
+
+    first, second = await asyncio.gather(
+        flights.do_many(["a", "b"], compute),
+        flights.do_many(["b", "c", "c"], compute),
+    )
+
+    assert batches == [["a", "b"], ["c"]]
+    assert first == {"a": "A", "b": "B"}
+    assert second == {"b": "B", "c": "C"}
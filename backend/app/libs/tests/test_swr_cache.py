@@ -0,0 +1,89 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from ..swr_cache import (
+    CachePolicy,
+    get_or_refresh,
+    revalidating_inline,
+    wait_background_refreshes,
+)
+
+POLICY = CachePolicy(soft_ttl=timedelta(days=1), hard_ttl=timedelta(days=7))
+
+
+def _make_fetch(values: list[str]):
+    calls = []
+
+    async def fetch() -> str:
+        calls.append(None)
+        await asyncio.sleep(0)
+        return values[len(calls) - 1]
+
+    return fetch, calls
+
+
+@pytest.mark.asyncio
+async def test_get_or_refresh_fetches_missing_entries():
+    provider = FakeRedis(decode_responses=True)
+    fetch, calls = _make_fetch(["v1"])
+
+    assert await get_or_refresh("key", fetch, POLICY, provider) == "v1"
+    assert await get_or_refresh("key", fetch, POLICY, provider) == "v1"
+
+    assert len(calls) == 1
+    assert await provider.exists("key:fresh")
+
+
+@pytest.mark.asyncio
+async def test_get_or_refresh_serves_stale_entries_while_refreshing():
+    provider = FakeRedis(decode_responses=True)
+    await provider.set("key", "v1")
+    fetch, calls = _make_fetch(["v2", "v3"])
+
+    # Only one of concurrent readers refreshes the stale entry.
+    values = await asyncio.gather(
+        get_or_refresh("key", fetch, POLICY, provider),
+        get_or_refresh("key", fetch, POLICY, provider),
+    )
+    await wait_background_refreshes()
+
+    assert values == ["v1", "v1"]
+    assert len(calls) == 1
+    assert await get_or_refresh("key", fetch, POLICY, provider) == "v2"
+    assert not await provider.exists("key:lock")
+
+
+@pytest.mark.asyncio
+async def test_get_or_refresh_revalidating_inline_refreshes_first():
+    provider = FakeRedis(decode_responses=True)
+    await provider.set("key", "v1")
+    fetch, _ = _make_fetch(["v2"])
+
+    value = await revalidating_inline(get_or_refresh)("key", fetch, POLICY, provider)
+
+    assert value == "v2"
+
+
+@pytest.mark.asyncio
+async def test_get_or_refresh_keeps_stale_entries_if_refresh_fails():
+    provider = FakeRedis(decode_responses=True)
+    await provider.set("key", "v1")
+
+    async def fetch() -> str:
+        raise RuntimeError("mocked upstream error")
+
+    assert await get_or_refresh("key", fetch, POLICY, provider) == "v1"
+    await wait_background_refreshes()
+
+    assert await provider.get("key") == "v1"
+    assert not await provider.exists("key:lock")
+
+
+def test_cache_policy_jitters_ttls():
+    ttls = {POLICY.soft_ttl_ms() for _ in range(20)}
+
+    assert len(ttls) > 1
+    assert all(0.9 * 86_400_000 <= ttl <= 1.1 * 86_400_000 for ttl in ttls)
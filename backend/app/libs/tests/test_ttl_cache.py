@@ -0,0 +1,41 @@
+# pylint: disable=redefined-outer-name
+import pytest
+
+from .. import ttl_cache
+from ..ttl_cache import TTLLRUCache
+
+
+@pytest.fixture
+def patch_monotonic(monkeypatch: pytest.MonkeyPatch):
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache, "monotonic", lambda: now[0])
+    return now
+
+
+@pytest.mark.usefixtures("patch_monotonic")
+def test_ttl_lru_cache_evicts_least_recently_used():
+    cache = TTLLRUCache(2)
+    cache.put("ETH", 1, 60_000)
+    cache.put("USDC", 2, 60_000)
+    assert cache.get("ETH") == 1
+
+    cache.put("WETH", 3, 60_000)
+
+    assert cache.get("USDC") is None
+    assert cache.get("ETH") == 1
+    assert cache.get("WETH") == 3
+    assert cache.stats() == {"hits": 3, "misses": 1, "size": 2}
+
+
+def test_ttl_lru_cache_expires_each_value_after_its_ttl(patch_monotonic):
+    cache = TTLLRUCache(2)
+    cache.put("ETH", 1, 1_000)
+    cache.put("USDC", 2, 5_000)
+    cache.put("WETH", 3, 0)
+    patch_monotonic[0] += 2
+
+    assert cache.peek("ETH") is None
+    assert cache.get("ETH") is None
+    assert cache.get("USDC") == 2
+    assert cache.get("WETH") is None
+    assert len(cache) == 1
@@ -0,0 +1,66 @@
+"""In-process LRU cache of data valid for a given time"""
+from collections import OrderedDict
+from time import monotonic
+from typing import Generic, Hashable, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+class TTLLRUCache(Generic[T]):
+    """Keeps the `maxsize` most recently used values, each until it expires
+
+    Values are put with the time they stay valid for, so that they expire
+    along with the Redis entry they were read from. Values are shared: they
+    must not be mutated.
+    """
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        # Values by key, with the monotonic time they expire at
+        self._values: OrderedDict[Hashable, tuple[T, float]] = OrderedDict()
+
+    def _lookup(self, key: Hashable) -> Optional[T]:
+        try:
+            value, expires_at = self._values[key]
+        except KeyError:
+            return None
+        if expires_at <= monotonic():
+            del self._values[key]
+            return None
+        return value
+
+    def get(self, key: Hashable) -> Optional[T]:
+        value = self._lookup(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._values.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable) -> Optional[T]:
+        "Returns the value of `key` without counting nor refreshing it"
+        return self._lookup(key)
+
+    def put(self, key: Hashable, value: T, ttl_ms: int):
+        "Keeps `value` for `ttl_ms` milliseconds at most"
+        if ttl_ms <= 0:
+            self._values.pop(key, None)
+            return
+        self._values[key] = (value, monotonic() + ttl_ms / 1000)
+        self._values.move_to_end(key)
+        while len(self._values) > self.maxsize:
+            self._values.popitem(last=False)
+
+    def clear(self):
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._values)}
+
+    def __len__(self) -> int:
+        return len(self._values)
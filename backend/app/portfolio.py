@@ -0,0 +1,225 @@
+"""Portfolio of a treasury, as served by the API"""
+from dataclasses import asdict, dataclass
+from datetime import timedelta
+from typing import Iterable, Iterator, Literal, Optional, TypeVar, Union
+
+import numpy as np
+import orjson
+import pandas as pd
+from dateutil.relativedelta import relativedelta
+from dateutil.tz import UTC
+from dateutil.utils import today
+
+from .libs.json_encoding import dump_dates, dump_floats, dump_mapping, dumps
+from .treasury import Balances, Prices, TotalBalance, Treasury
+
+T = TypeVar("T")
+
+
+def get_portfolio_end() -> str:
+    "Returns the last day of portfolios, yesterday"
+    return (today(UTC) - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def get_default_portfolio_start() -> str:
+    "Returns the first day of portfolios the frontend asks for by default"
+    return (today(UTC) - relativedelta(years=1)).strftime("%Y-%m-%d")
+
+
+def snake_to_camel_dict_factory(items: Iterable[tuple[str, T]]) -> dict[str, T]:
+    def camel(snake_str):
+        components = snake_str.split("_")
+        return components[0] + "".join(x.title() for x in components[1:])
+
+    return {camel(k): v for k, v in items}
+
+
+@dataclass
+class PortfolioAsset:
+    allocation: float
+    volatility: float
+    metrics: pd.DataFrame  # std_dev and returns by date
+    risk_contribution: Optional[float]
+
+    def to_json(self) -> bytes:
+        metrics = dump_mapping(
+            dump_dates(self.metrics.index, "ms"),
+            [
+                b'{"std_dev":%s,"returns":%s}' % std_dev_and_returns
+                for std_dev_and_returns in zip(
+                    dump_floats(self.metrics["std_dev"].to_numpy(), decimals=10),
+                    dump_floats(self.metrics["returns"].to_numpy(), decimals=10),
+                )
+            ],
+        )
+        return (
+            b'{"allocation":%s,"volatility":%s,"metrics":%s,"riskContribution":%s}'
+            % (
+                dumps(self.allocation),
+                dumps(self.volatility),
+                metrics,
+                dumps(self.risk_contribution),
+            )
+        )
+
+
+@dataclass
+class PortfolioKpis:
+    total_value: float
+    volatility: float
+    return_vs_market: Union[float, Literal["Infinity"]]
+
+
+@dataclass
+class Portfolio:
+    assets: dict[str, PortfolioAsset]
+    kpis: PortfolioKpis
+    data: pd.Series  # total balance by date
+
+    @classmethod
+    def from_treasury_with_assets(
+        cls,
+        treasury: Treasury,
+        prices: Prices,
+        balances: Balances,  # pylint: disable=unused-argument
+        total_balance: TotalBalance,
+        start: str,
+        end: str,
+    ):
+        histprices = {
+            symbol: athp.loc[start:end] for symbol, athp in prices.prices.items()
+        }
+        totalbalance = total_balance.balance.loc[start:end]
+
+        assets = {
+            a.token_symbol: PortfolioAsset(
+                allocation=a.balance_usd / treasury.usd_total,
+                metrics=histprices[a.token_symbol][["std_dev", "returns"]],
+                risk_contribution=a.risk_contribution
+                if hasattr(a, "risk_contribution")
+                else None,
+                volatility=histprices[a.token_symbol]["std_dev"].mean(),
+            )
+            for a in treasury.assets
+        }
+
+        if (start not in totalbalance.index) or (totalbalance.loc[start].balance == 0):
+            market_return = "Infinity"
+        else:
+            eth_series = histprices["ETH"]
+            market_return = (
+                totalbalance.loc[end].balance - totalbalance.loc[start].balance
+            ) / totalbalance.loc[start].balance - (
+                eth_series.loc[end].price - eth_series.loc[start].price
+            ) / eth_series.loc[
+                start
+            ].price
+
+        kpis = PortfolioKpis(
+            total_value=treasury.usd_total,
+            volatility=totalbalance.std_dev.mean(),
+            return_vs_market=market_return,
+        )
+
+        return cls(assets=assets, kpis=kpis, data=totalbalance.balance)
+
+    @classmethod
+    def from_snapshot(cls, snapshot: Union[str, bytes]):
+        "Decodes a portfolio encoded by `to_snapshot`"
+        decoded = orjson.loads(snapshot)
+
+        def make_index(dates: list[int]) -> pd.DatetimeIndex:
+            return pd.DatetimeIndex(
+                np.array(dates, dtype="datetime64[ns]"), name="timestamp"
+            ).tz_localize(UTC)
+
+        def make_floats(values: list) -> np.ndarray:
+            # Nulls are decoded as NaN.
+            return np.array(values, dtype="float64")
+
+        return cls(
+            assets={
+                symbol: PortfolioAsset(
+                    allocation=asset["allocation"],
+                    volatility=asset["volatility"],
+                    metrics=pd.DataFrame(
+                        make_floats([asset["std_dev"], asset["returns"]]).T,
+                        index=make_index(asset["dates"]),
+                        columns=["std_dev", "returns"],
+                    ),
+                    risk_contribution=asset["risk_contribution"],
+                )
+                for symbol, asset in decoded["assets"].items()
+            },
+            kpis=PortfolioKpis(**decoded["kpis"]),
+            data=pd.Series(
+                make_floats(decoded["data"]),
+                index=make_index(decoded["dates"]),
+                name="balance",
+            ),
+        )
+
+    def to_snapshot(self) -> bytes:
+        """Returns the portfolio encoded in full, to be stored
+
+        Unlike responses, metrics are not rounded and dates are kept by asset.
+        """
+        return dumps(
+            {
+                "assets": {
+                    symbol: {
+                        "allocation": asset.allocation,
+                        "volatility": asset.volatility,
+                        "risk_contribution": asset.risk_contribution,
+                        "dates": asset.metrics.index.asi8,
+                        "std_dev": asset.metrics["std_dev"].to_numpy(dtype="float64"),
+                        "returns": asset.metrics["returns"].to_numpy(dtype="float64"),
+                    }
+                    for symbol, asset in self.assets.items()
+                },
+                "kpis": asdict(self.kpis),
+                "dates": self.data.index.asi8,
+                "data": self.data.to_numpy(dtype="float64"),
+            }
+        )
+
+    def iter_json(self) -> Iterator[bytes]:
+        "Yields the JSON response of the portfolio, asset by asset"
+        yield b'{"assets":{'
+        for index, (symbol, asset) in enumerate(self.assets.items()):
+            yield (b"," if index else b"") + dumps(symbol) + b":" + asset.to_json()
+        yield b'},"kpis":' + dumps(
+            asdict(self.kpis, dict_factory=snake_to_camel_dict_factory)
+        )
+        yield b',"data":' + dump_mapping(
+            dump_dates(self.data.index), dump_floats(self.data.to_numpy())
+        ) + b"}"
+
+    def iter_columnar_json(self) -> Iterator[bytes]:
+        """Yields the JSON response of the portfolio, asset by asset, as arrays
+
+        Metrics and data are arrays over one shared `dates` axis, with nulls
+        where they are missing.
+        """
+        dates = self.data.index
+        for asset in self.assets.values():
+            dates = dates.union(asset.metrics.index)
+
+        yield b'{"dates":[' + b",".join(dump_dates(dates)) + b'],"assets":{'
+        for index, (symbol, asset) in enumerate(self.assets.items()):
+            metrics = asset.metrics.reindex(dates).round(10)
+            yield (b"," if index else b"") + dumps(symbol) + b":" + dumps(
+                {
+                    "allocation": asset.allocation,
+                    "volatility": asset.volatility,
+                    "riskContribution": asset.risk_contribution,
+                    "stdDev": metrics["std_dev"].to_numpy(dtype="float64"),
+                    "returns": metrics["returns"].to_numpy(dtype="float64"),
+                }
+            )
+        yield b'},"kpis":' + dumps(
+            asdict(self.kpis, dict_factory=snake_to_camel_dict_factory)
+        )
+        yield b',"data":' + dumps(
+            self.data.reindex(dates).to_numpy(dtype="float64")
+        ) + b"}"
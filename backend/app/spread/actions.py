@@ -1,7 +1,10 @@
+from asyncio import Semaphore, gather
+
 import pandas as pd
 
 from ..treasury import (
     ERC20,
+    UPSTREAM_CONCURRENCY,
     Balances,
     Prices,
     TotalBalance,
@@ -125,12 +128,14 @@ async def build_spread_treasury_with_assets(
     token_symbols_and_addresses_with_spread_token: set[tuple[str, str]] = {
         (asset.token_symbol, asset.token_address) for asset in treasury.assets
     } | {(spread_token_symbol, spread_token_address)}
-    prices = await make_prices_from_tokens(
-        token_symbols_and_addresses_with_spread_token
+    semaphore = Semaphore(UPSTREAM_CONCURRENCY)
+    prices, balances_at_transfers = await gather(
+        make_prices_from_tokens(
+            token_symbols_and_addresses_with_spread_token, semaphore=semaphore
+        ),
+        make_transfers_balances_for_treasury(treasury, semaphore),
     )
 
-    balances_at_transfers = await make_transfers_balances_for_treasury(treasury)
-
     balances = await make_balances_from_transfers_and_prices(
         balances_at_transfers, prices
     )
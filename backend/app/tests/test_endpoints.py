@@ -0,0 +1,196 @@
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+import math
+from dataclasses import asdict
+from json import loads
+
+import httpx
+import numpy as np
+import orjson
+import pandas as pd
+import pytest
+from dateutil.tz import UTC
+from fakeredis.aioredis import FakeRedis
+
+from .. import endpoints
+from ..libs import price_stats
+from ..libs.tasks.redis import store_portfolio_snapshot
+from ..portfolio import Portfolio, get_portfolio_end, snake_to_camel_dict_factory
+from ..treasury.models import ERC20, Prices, TotalBalance, Treasury
+
+
+def make_series(values: list[float]) -> pd.Series:
+    return pd.Series(
+        values,
+        index=pd.date_range(
+            "2022-07-01", periods=len(values), freq="D", tz=UTC, name="timestamp"
+        ),
+        dtype="float64",
+    )
+
+
+def assert_json_close(actual, expected):
+    "Compares floats up to rounding errors"
+    if isinstance(expected, dict):
+        assert list(actual) == list(expected)
+        for key, value in expected.items():
+            assert_json_close(actual[key], value)
+    elif isinstance(expected, float) and math.isnan(expected):
+        assert actual is None
+    elif isinstance(expected, float):
+        assert actual == pytest.approx(expected, rel=1e-12)
+    else:
+        assert actual == expected
+
+
+@pytest.fixture
+def portfolio() -> Portfolio:
+    treasury = Treasury(
+        "0x1",
+        [
+            ERC20("Ether", "ETH", "0xe", balance_usd=300.0, balance=2.0),
+            ERC20("ABC Token", "ABC", "0xabc", balance_usd=100.0, balance=1.0),
+        ],
+    )
+    treasury.assets[0].risk_contribution = 0.75
+    prices = Prices(
+        prices={
+            "ETH": price_stats.make_returns_df(
+                make_series(np.linspace(100, 200, 10)), "price"
+            ),
+            "ABC": price_stats.make_returns_df(
+                make_series([1.0, 2.0, np.nan, 4.0, 2.0, 1.0, 3.0, 2.0, 1.0, 0.5]),
+                "price",
+            ),
+        }
+    )
+    total_balance = TotalBalance(
+        price_stats.make_returns_df(make_series(np.linspace(300, 400, 10)), "balance")
+    )
+    return Portfolio.from_treasury_with_assets(
+        treasury, prices, None, total_balance, "2022-07-02", "2022-07-09"
+    )
+
+
+@pytest.fixture
+def patch_adb(monkeypatch):
+    fake_provider = FakeRedis(decode_responses=True)
+    monkeypatch.setattr(endpoints, "adb", fake_provider)
+    return fake_provider
+
+
+def test_portfolio_json_matches_dict_serialization(portfolio):
+    expected = asdict(
+        Portfolio(
+            assets={
+                symbol: asset.__class__(
+                    allocation=asset.allocation,
+                    volatility=asset.volatility,
+                    metrics=loads(
+                        asset.metrics.to_json(orient="index", date_format="iso")
+                    ),
+                    risk_contribution=asset.risk_contribution,
+                )
+                for symbol, asset in portfolio.assets.items()
+            },
+            kpis=portfolio.kpis,
+            data={
+                timestamp.strftime("%Y-%m-%d"): balance
+                for timestamp, balance in portfolio.data.items()
+            },
+        ),
+        dict_factory=snake_to_camel_dict_factory,
+    )
+
+    assert_json_close(orjson.loads(b"".join(portfolio.iter_json())), expected)
+
+
+def test_portfolio_columnar_json_aligns_assets_on_dates(portfolio):
+    columnar = orjson.loads(b"".join(portfolio.iter_columnar_json()))
+    default = orjson.loads(b"".join(portfolio.iter_json()))
+
+    assert columnar["dates"] == list(default["data"])
+    assert columnar["data"] == list(default["data"].values())
+    assert columnar["kpis"] == default["kpis"]
+    for symbol, asset in default["assets"].items():
+        assert columnar["assets"][symbol]["stdDev"] == [
+            metrics["std_dev"] for metrics in asset["metrics"].values()
+        ]
+        assert columnar["assets"][symbol]["returns"] == [
+            metrics["returns"] for metrics in asset["metrics"].values()
+        ]
+        assert columnar["assets"][symbol]["riskContribution"] == (
+            asset["riskContribution"]
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.usefixtures("patch_adb")
+@pytest.mark.parametrize("response_format", ["default", "columnar"])
+async def test_get_portfolio_negotiates_encoding(
+    monkeypatch, portfolio, response_format
+):
+    monkeypatch.setattr(
+        endpoints.Portfolio,
+        "from_treasury_with_assets",
+        classmethod(lambda *_: portfolio),
+    )
+
+    async def _build_treasury_with_assets(*_):
+        return (None, None, None, None)
+
+    monkeypatch.setattr(
+        endpoints, "build_treasury_with_assets", _build_treasury_with_assets
+    )
+    client = httpx.AsyncClient(app=endpoints.app, base_url="http://whip")
+
+    for encoding in ("gzip", "br"):
+        resp = await client.get(
+            f"/api/portfolio/0x1/2022-07-02?format={response_format}",
+            headers={"Accept-Encoding": encoding},
+        )
+        assert resp.headers["content-encoding"] == encoding
+        assert resp.json() == orjson.loads(
+            b"".join(
+                portfolio.iter_columnar_json()
+                if response_format == "columnar"
+                else portfolio.iter_json()
+            )
+        )
+
+
+def test_portfolio_snapshot_round_trips(portfolio):
+    decoded = Portfolio.from_snapshot(portfolio.to_snapshot())
+
+    assert decoded.kpis == portfolio.kpis
+    pd.testing.assert_series_equal(
+        decoded.data, portfolio.data, check_freq=False, check_names=False
+    )
+    for symbol, asset in portfolio.assets.items():
+        pd.testing.assert_frame_equal(
+            decoded.assets[symbol].metrics,
+            asset.metrics,
+            check_freq=False,
+            check_names=False,
+        )
+    assert b"".join(decoded.iter_json()) == b"".join(portfolio.iter_json())
+
+
+@pytest.mark.asyncio
+async def test_get_portfolio_serves_stored_snapshot(monkeypatch, patch_adb, portfolio):
+    async def _build_treasury_with_assets(*_):
+        raise AssertionError("stored portfolios are not rebuilt")
+
+    monkeypatch.setattr(
+        endpoints, "build_treasury_with_assets", _build_treasury_with_assets
+    )
+    async with patch_adb.pipeline() as pipe:
+        store_portfolio_snapshot(
+            "0xABC", "2022-07-02", get_portfolio_end(), portfolio.to_snapshot(), pipe
+        )
+        await pipe.execute()
+    client = httpx.AsyncClient(app=endpoints.app, base_url="http://whip")
+
+    resp = await client.get("/api/portfolio/0xabc/2022-07-02")
+
+    assert resp.content == b"".join(portfolio.iter_json())
@@ -1,5 +1,7 @@
 from .whitelists import (
-    maybe_populate_whitelist,
-    store_and_get_covalent_pairs_whitelist,
-    store_and_get_tokenlist_whitelist,
+    TokenWhitelist,
+    get_covalent_pairs_whitelist,
+    get_tokenlist_whitelist,
+    rebuild_whitelist,
+    token_whitelist,
 )
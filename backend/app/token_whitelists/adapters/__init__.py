@@ -1,3 +1,8 @@
 from .covalent import get_all_covalent_pairs
-from .redis import retrieve_token_whitelist, store_token_whitelist
+from .redis import (
+    are_tokens_whitelisted,
+    replace_token_whitelist,
+    retrieve_token_whitelist,
+    retrieve_token_whitelist_version,
+)
 from .tokenlists import get_all_tokenlists
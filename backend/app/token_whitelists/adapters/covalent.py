@@ -1,8 +1,10 @@
 import os
-from typing import Any, Generator
+from typing import Any, AsyncGenerator
 
 from httpx import AsyncClient, Timeout
 
+from ...libs.http_client import get_client
+from ...libs.pagination import paginate
 from .utils import get_whitelists_from_apis
 
 COVALENT_KEY = os.getenv("COVALENT_KEY")
@@ -12,37 +14,36 @@ COVALENT_POOLS_URL = "https://api.covalenthq.com/v1/{chain_id}/xy=k/{protocol}/p
 async def get_covalent_pairs(
     client: AsyncClient, url_options: dict[str, Any]
 ) -> dict[str, Any]:
-    async with client:
-        resp = await client.get(
-            COVALENT_POOLS_URL.format(
-                chain_id=url_options["chain_id"], protocol=url_options["protocol"]
-            ),
-            params={
-                "quote-currency": "USD",
-                "format": "JSON",
-                "page-number": url_options["page_number"],
-                "page-size": 250,
-                "key": f"ckey_{COVALENT_KEY}",
-            },
-        )
-        resp.raise_for_status()
-        return resp.json()["data"]
+    resp = await client.get(
+        COVALENT_POOLS_URL.format(
+            chain_id=url_options["chain_id"], protocol=url_options["protocol"]
+        ),
+        params={
+            "quote-currency": "USD",
+            "format": "JSON",
+            "page-number": url_options["page_number"],
+            "page-size": 250,
+            "key": f"ckey_{COVALENT_KEY}",
+        },
+        timeout=Timeout(10.0, read=60.0, connect=90.0),
+    )
+    resp.raise_for_status()
+    return resp.json()["data"]
 
 
 async def covalent_pairs_generator(
     protocol: str, chain_id=1
-) -> Generator[dict[str, Any], None, None]:
-    page_number = 0
-    while True:
-        data = await get_covalent_pairs(
-            AsyncClient(timeout=Timeout(10.0, read=60.0, connect=90.0)),
+) -> AsyncGenerator[dict[str, Any], None]:
+    client = get_client("covalent")
+
+    async def fetch_page(page_number: int) -> dict[str, Any]:
+        return await get_covalent_pairs(
+            client,
             {"chain_id": chain_id, "protocol": protocol, "page_number": page_number},
         )
-        for item in data["items"]:
-            yield item
-        if not data["pagination"]["has_more"]:
-            break
-        page_number += 1
+
+    async for item in paginate(fetch_page):
+        yield item
 
 
 async def get_covalent_pair_list(protocol: str, chain_id=1) -> list[str]:
@@ -1,19 +1,91 @@
 from datetime import timedelta
-from typing import Union
+from typing import Optional
+from uuid import uuid4
 
-import redis
+import redis.asyncio
 
 CHAIN_ID = 1
+WHITELIST_KEY = "whitelist"
+# Incremented on each change, for processes to know when to reload it
+WHITELIST_VERSION_KEY = "whitelist_version"
+BUILD_KEY_TEMPLATE = "whitelist:build:{id}"
+# Addresses the build adds to and removes from the whitelist
+ADDED_KEY_TEMPLATE = "{build_key}:added"
+REMOVED_KEY_TEMPLATE = "{build_key}:removed"
+# Dropped if its build dies before being swapped in
+BUILD_KEY_TTL = timedelta(hours=1)
+# Addresses by SADD command, and SADD commands by pipeline, when building
+WHITELIST_CHUNK_SIZE = 1000
+WHITELIST_CHUNKS_BY_PIPELINE = 10
 
 
-def store_token_whitelist(
-    address: list[str], provider: Union[redis.Redis, redis.client.Pipeline]
-):
-    provider.sadd("whitelist", *address)
-    provider.expire("whitelist", timedelta(days=1))
+async def replace_token_whitelist(
+    addresses: list[str],
+    provider: redis.asyncio.Redis,
+    keep_current: bool = False,
+) -> tuple[int, int]:
+    """Atomically replaces the whitelist with `addresses`
 
+    The new whitelist is built into a temporary key in chunked pipelines, then
+    renamed into place, so readers never see it empty or partially built.
+    With `keep_current`, the current addresses are kept too.
+    Returns the numbers of added and removed addresses. Nothing is replaced if
+    both are 0, or if the new whitelist would be empty.
+    """
+    if not addresses and not keep_current:
+        return 0, 0
+    build_key = BUILD_KEY_TEMPLATE.format(id=uuid4().hex)
+    added_key = ADDED_KEY_TEMPLATE.format(build_key=build_key)
+    removed_key = REMOVED_KEY_TEMPLATE.format(build_key=build_key)
+    chunks = [
+        addresses[i : i + WHITELIST_CHUNK_SIZE]
+        for i in range(0, len(addresses), WHITELIST_CHUNK_SIZE)
+    ]
+    try:
+        for i in range(0, len(chunks), WHITELIST_CHUNKS_BY_PIPELINE):
+            async with provider.pipeline(transaction=False) as pipe:
+                for chunk in chunks[i : i + WHITELIST_CHUNKS_BY_PIPELINE]:
+                    pipe.sadd(build_key, *chunk)
+                pipe.expire(build_key, BUILD_KEY_TTL)
+                await pipe.execute()
+        if keep_current:
+            await provider.sunionstore(build_key, [build_key, WHITELIST_KEY])
 
-def retrieve_token_whitelist(
-    provider: Union[redis.Redis, redis.client.Pipeline]
-) -> list[str]:
-    return provider.smembers("whitelist")
+        # Diffs are stored server-side, only their sizes are sent back.
+        async with provider.pipeline(transaction=False) as pipe:
+            pipe.sdiffstore(added_key, [build_key, WHITELIST_KEY])
+            pipe.sdiffstore(removed_key, [WHITELIST_KEY, build_key])
+            pipe.scard(build_key)
+            added, removed, size = await pipe.execute()
+        if not size or (not added and not removed):
+            return 0, 0
+
+        async with provider.pipeline() as pipe:
+            pipe.rename(build_key, WHITELIST_KEY)
+            pipe.persist(WHITELIST_KEY)
+            pipe.incr(WHITELIST_VERSION_KEY)
+            await pipe.execute()
+        return added, removed
+    finally:
+        await provider.delete(build_key, added_key, removed_key)
+
+
+async def retrieve_token_whitelist(provider: redis.asyncio.Redis) -> set[str]:
+    return await provider.smembers(WHITELIST_KEY)
+
+
+async def retrieve_token_whitelist_version(
+    provider: redis.asyncio.Redis,
+) -> Optional[str]:
+    version = await provider.get(WHITELIST_VERSION_KEY)
+    return version.decode() if isinstance(version, bytes) else version
+
+
+async def are_tokens_whitelisted(
+    addresses: list[str], provider: redis.asyncio.Redis
+) -> list[bool]:
+    if not addresses:
+        return []
+    return [
+        bool(member) for member in await provider.smismember(WHITELIST_KEY, addresses)
+    ]
@@ -1,16 +1,13 @@
 from typing import Any
 
-from httpx import AsyncClient, Timeout
-
+from ...libs.http_client import get_client
 from .utils import get_whitelists_from_apis
 
 
 async def get_raw_tokenlist(tokenlist_url: str) -> list[dict[str, Any]]:
-    timeout = Timeout(10.0, read=30.0, connect=15.0)
-    async with AsyncClient(timeout=timeout) as client:
-        resp = await client.get(tokenlist_url)
-        resp.raise_for_status()
-        return resp.json()["tokens"]
+    resp = await get_client("tokenlists").get(tokenlist_url)
+    resp.raise_for_status()
+    return resp.json()["tokens"]
 
 
 def process_raw_tokenlist(raw_tokenlist: list[dict[str, Any]]):
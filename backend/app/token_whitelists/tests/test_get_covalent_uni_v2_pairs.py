@@ -3,10 +3,9 @@ from json.decoder import JSONDecodeError
 from unittest import mock
 
 import pytest
-from fakeredis import FakeRedis
 from httpx import AsyncClient
 
-from .. import store_and_get_covalent_pairs_whitelist
+from .. import get_covalent_pairs_whitelist
 from ..adapters.covalent import get_covalent_pair_list, get_uniswap_v2_pairs_covalent
 from ..adapters.utils import get_whitelists_from_apis
 from .conftest import (
@@ -52,10 +51,7 @@ async def mock_get_tokenlist(*_, **__):
 @pytest.mark.asyncio
 async def test_get_covalent_pair_list_success(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(AsyncClient, "get", mock_get_tokenlist)
-    mocked_provider = FakeRedis(decode_responses=True)
-
-    await store_and_get_covalent_pairs_whitelist(mocked_provider)
-    assert mocked_provider.smembers("whitelist") == {
+    assert set(await get_covalent_pairs_whitelist()) == {
         "0x6d6f636b5f636f76616c656e745f706169725f31",
         "0x6d6f636b5f636f76616c656e745f706169725f32",
     }
@@ -2,10 +2,9 @@ from json import loads
 from json.decoder import JSONDecodeError
 
 import pytest
-from fakeredis import FakeRedis
 from httpx import AsyncClient
 
-from .. import maybe_populate_whitelist, store_and_get_tokenlist_whitelist, whitelists
+from .. import get_tokenlist_whitelist
 from ..adapters.tokenlists import get_processed_tokenlists
 from .conftest import (
     HTTPStatusError,
@@ -42,10 +41,7 @@ async def mock_get_tokenlist(*_):
 async def test_get_tokenlists_success(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(AsyncClient, "get", mock_get_tokenlist)
 
-    mocked_provider = FakeRedis(decode_responses=True)
-
-    await store_and_get_tokenlist_whitelist(mocked_provider)
-    assert mocked_provider.smembers("whitelist") == {
+    assert set(await get_tokenlist_whitelist()) == {
         "0x6d6f636b5f31",
         "0x6d6f636b5f32",
         "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee",  # Native ETH should always be whitelisted
@@ -99,23 +95,6 @@ async def test_get_tokenlists_bad_resp_json(monkeypatch: pytest.MonkeyPatch, jso
         await get_processed_tokenlists(url)
 
 
-@pytest.mark.asyncio
-async def test_maybe_populate_whitelist_success_preprop(
-    monkeypatch: pytest.MonkeyPatch,
-):
-    monkeypatch.setattr(
-        whitelists,
-        "retrieve_token_whitelist",
-        lambda _: ["0x6d6f636b5f746f6b656e5f31", "0x6d6f636b5f746f6b656e5f32"],
-        raising=True,
-    )
-    mocked_whitelist = await maybe_populate_whitelist("mocked_provider")
-    assert mocked_whitelist == [
-        "0x6d6f636b5f746f6b656e5f31",
-        "0x6d6f636b5f746f6b656e5f32",
-    ]
-
-
 @pytest.mark.asyncio
 async def test_get_tokenlists_resp_err_404(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(AsyncClient, "get", mock_get_tokenlist)
@@ -0,0 +1,109 @@
+from unittest import mock
+
+import pytest
+from fakeredis.aioredis import FakeRedis
+
+from .. import TokenWhitelist, rebuild_whitelist, whitelists
+from ..adapters import redis as redis_adapter
+from ..adapters import replace_token_whitelist
+
+WHITELISTED_ADDRESS = "0x6d6f636b5f746f6b656e5f31"
+SPAM_ADDRESS = "0x6d6f636b5f7370616d"
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("in_process", [True, False])
+async def test_token_whitelist_filters_addresses(in_process):
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist([WHITELISTED_ADDRESS], provider)
+
+    whitelisted = await TokenWhitelist(in_process=in_process).filter(
+        [WHITELISTED_ADDRESS, SPAM_ADDRESS, WHITELISTED_ADDRESS], provider
+    )
+
+    assert whitelisted == frozenset([WHITELISTED_ADDRESS])
+
+
+@pytest.mark.asyncio
+async def test_token_whitelist_reloads_new_versions_only():
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist([WHITELISTED_ADDRESS], provider)
+    whitelist = TokenWhitelist(check_interval=0)
+    await whitelist.filter([SPAM_ADDRESS], provider)
+
+    # Unversioned changes aren't loaded.
+    await provider.sadd("whitelist", SPAM_ADDRESS)
+    assert not await whitelist.filter([SPAM_ADDRESS], provider)
+
+    await replace_token_whitelist([SPAM_ADDRESS], provider)
+    assert await whitelist.filter([SPAM_ADDRESS], provider) == {SPAM_ADDRESS}
+
+
+@pytest.mark.asyncio
+async def test_token_whitelist_checks_version_once_per_interval():
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist([WHITELISTED_ADDRESS], provider)
+    whitelist = TokenWhitelist(check_interval=3600)
+    await whitelist.filter([SPAM_ADDRESS], provider)
+
+    await replace_token_whitelist([SPAM_ADDRESS], provider)
+
+    assert not await whitelist.filter([SPAM_ADDRESS], provider)
+
+
+@pytest.mark.asyncio
+async def test_replace_token_whitelist_swaps_chunked_build(
+    monkeypatch: pytest.MonkeyPatch,
+):
+    monkeypatch.setattr(redis_adapter, "WHITELIST_CHUNK_SIZE", 2)
+    monkeypatch.setattr(redis_adapter, "WHITELIST_CHUNKS_BY_PIPELINE", 2)
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist(["0x1", "0x2"], provider)
+    await provider.expire("whitelist", 60)
+    addresses = [f"0x{i}" for i in range(2, 9)]
+
+    assert await replace_token_whitelist(addresses, provider) == (6, 1)
+    assert await provider.smembers("whitelist") == set(addresses)
+    assert await provider.ttl("whitelist") == -1
+    assert await provider.keys("whitelist:build:*") == []
+    assert await provider.get("whitelist_version") == "2"
+
+
+@pytest.mark.asyncio
+async def test_replace_token_whitelist_leaves_unchanged_whitelist():
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist(["0x1", "0x2"], provider)
+
+    assert await replace_token_whitelist(["0x2", "0x1"], provider) == (0, 0)
+    assert await provider.get("whitelist_version") == "1"
+    assert await provider.keys("whitelist:build:*") == []
+
+
+@pytest.mark.asyncio
+async def test_replace_token_whitelist_never_swaps_in_empty_whitelist():
+    provider = FakeRedis(decode_responses=True)
+
+    assert await replace_token_whitelist([], provider) == (0, 0)
+    assert await replace_token_whitelist([], provider, keep_current=True) == (0, 0)
+    assert not await provider.exists("whitelist")
+    assert await provider.keys("whitelist:build:*") == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("failed_source_whitelist", [None, []])
+async def test_rebuild_whitelist_keeps_addresses_of_failed_sources(
+    monkeypatch: pytest.MonkeyPatch, failed_source_whitelist
+):
+    provider = FakeRedis(decode_responses=True)
+    await replace_token_whitelist([WHITELISTED_ADDRESS], provider)
+    monkeypatch.setattr(
+        whitelists, "get_tokenlist_whitelist", mock.AsyncMock(return_value=["0x1"])
+    )
+    monkeypatch.setattr(
+        whitelists,
+        "get_covalent_pairs_whitelist",
+        mock.AsyncMock(return_value=failed_source_whitelist),
+    )
+
+    assert await rebuild_whitelist(provider) == (1, 0)
+    assert await provider.smembers("whitelist") == {WHITELISTED_ADDRESS, "0x1"}
@@ -1,23 +1,36 @@
+from asyncio import gather
 from json.decoder import JSONDecodeError
-from typing import Union
+from os import getenv
+from time import monotonic
+from typing import Iterable, Optional
 
-import redis
+import redis.asyncio
 from celery.utils.log import get_task_logger
 from httpx import HTTPStatusError, RequestError
 
 from .adapters import (
+    are_tokens_whitelisted,
     get_all_covalent_pairs,
     get_all_tokenlists,
+    replace_token_whitelist,
     retrieve_token_whitelist,
-    store_token_whitelist,
+    retrieve_token_whitelist_version,
+)
+
+# Seconds between checks of the whitelist version by each process
+WHITELIST_CHECK_INTERVAL = float(getenv("WHITELIST_CHECK_INTERVAL", "60"))
+# Whether processes keep a copy of the whitelist, rather than asking Redis
+WHITELIST_IN_PROCESS = getenv("WHITELIST_IN_PROCESS", "true").lower() in (
+    "1",
+    "true",
+    "yes",
 )
 
 
-async def store_and_get_covalent_pairs_whitelist(
-    provider: Union[redis.Redis, redis.client.Pipeline]
-) -> list[str]:
+async def get_covalent_pairs_whitelist() -> Optional[list[str]]:
+    "Returns the Covalent pairs whitelist, or None if it couldn't be received"
     try:
-        latest_whitelist = await get_all_covalent_pairs()
+        return await get_all_covalent_pairs()
     except (HTTPStatusError, RequestError, JSONDecodeError, KeyError) as error:
         logger = get_task_logger(__name__)
         log_args = (
@@ -26,34 +39,108 @@ async def store_and_get_covalent_pairs_whitelist(
             else ("processing pairs", "Covalent API repsonse")
         )
         logger.error("error %s from %s", *log_args, exc_info=error)
-        return []
+        return None
 
-    store_token_whitelist(latest_whitelist, provider)
-    return latest_whitelist
 
-
-async def store_and_get_tokenlist_whitelist(
-    provider: Union[redis.Redis, redis.client.Pipeline]
-) -> list[str]:
+async def get_tokenlist_whitelist() -> Optional[list[str]]:
+    "Returns the token lists whitelist, or None if it couldn't be received"
     try:
-        latest_whitelist = await get_all_tokenlists()
+        return await get_all_tokenlists()
     except (HTTPStatusError, RequestError, JSONDecodeError, KeyError) as error:
         logger = get_task_logger(__name__)
         if error.__class__ in [HTTPStatusError, RequestError]:
             logger.error("error receiving token list from API", exc_info=error)
-            return []
+            return None
         logger.error("error processing token list API repsonse", exc_info=error)
-        return []
+        return None
+
+
+async def rebuild_whitelist(provider: redis.asyncio.Redis) -> tuple[int, int]:
+    """Replaces the stored whitelist with the latest one of all sources
+
+    Addresses of sources which couldn't be received, or were empty, are kept
+    from the stored whitelist, and nothing is replaced if no source could be.
+    Returns the numbers of added and removed addresses.
+    """
+    # An empty source most likely failed too.
+    source_whitelists = [
+        source_whitelist or None
+        for source_whitelist in await gather(
+            get_tokenlist_whitelist(), get_covalent_pairs_whitelist()
+        )
+    ]
+    if all(source_whitelist is None for source_whitelist in source_whitelists):
+        return 0, 0
+    return await replace_token_whitelist(
+        list(
+            dict.fromkeys(
+                address
+                for source_whitelist in source_whitelists
+                for address in source_whitelist or []
+            )
+        ),
+        provider,
+        keep_current=None in source_whitelists,
+    )
+
+
+class TokenWhitelist:
+    """Membership of token addresses in the whitelist stored in Redis
+
+    With `in_process`, a frozen copy of the whitelist is kept, and reloaded
+    once its version changes, checked every `check_interval` seconds.
+    Otherwise, or until the copy is loaded, addresses are looked up in Redis
+    in one batch. The whitelist is only ever rebuilt by `rebuild_whitelist`.
+    """
+
+    def __init__(
+        self,
+        in_process: bool = WHITELIST_IN_PROCESS,
+        check_interval: float = WHITELIST_CHECK_INTERVAL,
+    ):
+        self.in_process = in_process
+        self.check_interval = check_interval
+        self._addresses: Optional[frozenset[str]] = None
+        self._version: Optional[str] = None
+        self._checked_at: Optional[float] = None
+
+    async def _maybe_reload(self, provider: redis.asyncio.Redis):
+        now = monotonic()
+        if (
+            self._checked_at is not None
+            and now < self._checked_at + self.check_interval
+        ):
+            return
+        # Concurrent callers keep using the current copy meanwhile.
+        self._checked_at = now
+        version = await retrieve_token_whitelist_version(provider)
+        if version is None:
+            self._addresses = self._version = None
+        elif version != self._version:
+            self._addresses = frozenset(await retrieve_token_whitelist(provider))
+            self._version = version
+
+    async def filter(
+        self, addresses: Iterable[str], provider: redis.asyncio.Redis
+    ) -> frozenset[str]:
+        "Returns the whitelisted `addresses`"
+        addresses = list(dict.fromkeys(addresses))
+        if self.in_process:
+            await self._maybe_reload(provider)
+            if self._addresses is not None:
+                return frozenset(
+                    address for address in addresses if address in self._addresses
+                )
+        return frozenset(
+            address
+            for address, whitelisted in zip(
+                addresses, await are_tokens_whitelisted(addresses, provider)
+            )
+            if whitelisted
+        )
 
-    store_token_whitelist(latest_whitelist, provider)
-    return latest_whitelist
+    def invalidate(self):
+        self._addresses = self._version = self._checked_at = None
 
 
-async def maybe_populate_whitelist(
-    provider: Union[redis.Redis, redis.client.Pipeline]
-) -> list[Union[str, None]]:
-    latest_whitelist = list(retrieve_token_whitelist(provider))
-    if not latest_whitelist:
-        latest_whitelist.extend(await store_and_get_tokenlist_whitelist(provider))
-        latest_whitelist.extend(await store_and_get_covalent_pairs_whitelist(provider))
-    return latest_whitelist
+token_whitelist = TokenWhitelist()
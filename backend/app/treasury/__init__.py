@@ -1,17 +1,24 @@
 from .actions import (
+    UPSTREAM_CONCURRENCY,
     build_treasury_with_assets,
     make_balances_from_transfers_and_prices,
     make_prices_from_tokens,
     make_total_balance_from_balances,
     make_transfers_balances_for_treasury,
+    make_treasuries_token_prices,
     make_treasury_from_address,
+    make_treasury_with_assets,
     update_treasury_assets_from_whitelist,
     update_treasury_assets_risk_contributions,
 )
 from .adapters import (
     get_treasury_list,
     remove_treasuries_metadata,
+    retrieve_balances_at_transfers,
+    retrieve_portfolio_snapshot,
+    retrieve_token_hist_performances,
     retrieve_treasuries_metadata,
+    retrieve_treasury_fingerprint,
     store_treasuries_metadata,
 )
-from .models import ERC20, Balances, Prices, TotalBalance, Treasury
+from .models import ERC20, Balances, BalancesAtTransfers, Prices, TotalBalance, Treasury
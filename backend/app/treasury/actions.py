@@ -1,25 +1,53 @@
-from functools import reduce
-from typing import Optional
+import os
+from asyncio import Semaphore, gather
+from collections import defaultdict
+from typing import Awaitable, Iterable, Mapping, Optional, TypeVar
 
 import pandas as pd
+from celery.utils.log import get_logger
 
-from .. import db
 from ..libs import pd_inter_calc, price_stats
-from ..libs import series as serieslib
-from ..token_whitelists import maybe_populate_whitelist
+from ..libs.daily_cache import DailyLRUCache
+from ..libs.single_flight import single_flight
+from ..token_whitelists import token_whitelist
 from .adapters import bitquery
 from .adapters.covalent import get_token_transfers, get_treasury
-from .adapters.covalent_pricefeed import get_token_hist_price_covalent
+from .adapters.covalent_pricefeed import (
+    ETH_ADDRESS,
+    get_tokens_hist_price_series_covalent,
+)
 from .models import (
     ERC20,
     Balances,
     BalancesAtTransfers,
+    ColumnarBalances,
+    ColumnarPrices,
     Prices,
     TotalBalance,
     Transfer,
     Treasury,
 )
 
+UPSTREAM_CONCURRENCY = int(os.getenv("UPSTREAM_CONCURRENCY", "8"))
+# Number of balance at transfers series kept in memory.
+BALANCE_SERIES_CACHE_SIZE = int(os.getenv("BALANCE_SERIES_CACHE_SIZE", "1024"))
+
+T = TypeVar("T")
+
+# Transfers are synced once a day: their balance series hold until midnight.
+balance_series_cache: DailyLRUCache[pd.Series] = DailyLRUCache(
+    BALANCE_SERIES_CACHE_SIZE
+)
+
+
+async def _bounded(semaphore: Semaphore, awaitable: Awaitable[T]) -> T:
+    async with semaphore:
+        return await awaitable
+
+
+async def _resolved(value: T) -> T:
+    return value
+
 
 async def make_transfers(treasury_address: str, asset: ERC20) -> list[Transfer]:
     return (
@@ -31,66 +59,194 @@ async def make_transfers(treasury_address: str, asset: ERC20) -> list[Transfer]:
 
 async def make_transfers_and_end_balance_for_treasury(
     treasury: Treasury,
+    semaphore: Optional[Semaphore] = None,
+    assets: Optional[list[ERC20]] = None,
 ) -> dict[str, tuple[list[Transfer], float]]:
-    transfers_and_end_balance: dict[str, tuple[list[Transfer], float]] = {}
+    """Fetches the transfers of all treasury assets concurrently
 
-    for asset in treasury.assets:
-        transfers_for_asset = await make_transfers(treasury.address, asset)
-        if transfers_for_asset:
-            transfers_and_end_balance[asset.token_symbol] = (
-                transfers_for_asset,
-                asset.balance,
+    Only `assets` are fetched if given.
+    Assets whose transfers can't be fetched are left out, and their error is
+    recorded in `treasury.transfer_errors`.
+    """
+    assets = treasury.assets if assets is None else assets
+    semaphore = semaphore or Semaphore(UPSTREAM_CONCURRENCY)
+    results = await gather(
+        *(
+            _bounded(semaphore, make_transfers(treasury.address, asset))
+            for asset in assets
+        ),
+        return_exceptions=True,
+    )
+
+    transfers_and_end_balance: dict[str, tuple[list[Transfer], float]] = {}
+    for asset, result in zip(assets, results):
+        if isinstance(result, Exception):
+            get_logger(__name__).error(
+                "error fetching transfers of %s for %s, skipping",
+                asset.token_symbol,
+                treasury.address,
+                exc_info=result,
             )
+            treasury.transfer_errors[asset.token_symbol] = result
+            continue
+        if result:
+            transfers_and_end_balance[asset.token_symbol] = (result, asset.balance)
 
     return transfers_and_end_balance
 
 
 async def make_transfers_balances_for_treasury(
     treasury: Treasury,
+    semaphore: Optional[Semaphore] = None,
 ) -> BalancesAtTransfers:
-    "Returns series of balances defined at times of assets transfers"
+    """Returns series of balances defined at times of assets transfers
+
+    Series are kept in `balance_series_cache` until midnight, by treasury,
+    asset and end balance.
+    """
+
+    def cache_key(asset: ERC20) -> tuple[str, str, str, float]:
+        return (
+            treasury.address,
+            asset.token_symbol,
+            asset.token_address,
+            asset.balance,
+        )
+
+    cached_balances = {
+        asset.token_symbol: balance_series_cache.get(cache_key(asset))
+        for asset in treasury.assets
+    }
+    missing_assets = [
+        asset
+        for asset in treasury.assets
+        if cached_balances[asset.token_symbol] is None
+    ]
 
     transfers_and_end_balance = await make_transfers_and_end_balance_for_treasury(
-        treasury
+        treasury, semaphore, missing_assets
     )
 
-    return BalancesAtTransfers.from_transfer_and_end_balance_dict(
+    balances_at_transfers = BalancesAtTransfers.from_transfer_and_end_balance_dict(
         transfers_and_end_balance
     )
+    for asset in missing_assets:
+        if asset.token_symbol in balances_at_transfers.balances:
+            balance_series_cache.put(
+                cache_key(asset), balances_at_transfers.balances[asset.token_symbol]
+            )
+    balances_at_transfers.balances.update(
+        (symbol, balance)
+        for symbol, balance in cached_balances.items()
+        if balance is not None
+    )
+    return balances_at_transfers
 
 
 async def make_treasury_from_address(treasury_address: str, chain_id: str) -> Treasury:
-    token_whitelist = await maybe_populate_whitelist(db)
     return await get_treasury(treasury_address, token_whitelist, chain_id)
 
 
+async def make_token_prices(
+    token_addresses: Iterable[str],
+    chain_id: int = 1,
+    semaphore: Optional[Semaphore] = None,
+) -> dict[str, pd.DataFrame]:
+    "Returns the prices and returns of each token it received prices for"
+    hist_prices_by_address = await get_tokens_hist_price_series_covalent(
+        token_addresses,
+        chain_id=chain_id,
+        semaphore=semaphore or Semaphore(UPSTREAM_CONCURRENCY),
+    )
+    return {
+        token_address: price_stats.make_returns_df(token_hist_price, "price")
+        for token_address, token_hist_price in hist_prices_by_address.items()
+        if not token_hist_price.empty
+    }
+
+
 async def make_prices_from_tokens(
-    token_symbols_and_addresses: set[tuple[str, str]], add_eth=True
+    token_symbols_and_addresses: set[tuple[str, str]],
+    add_eth=True,
+    semaphore: Optional[Semaphore] = None,
+    shared_prices: Optional[Mapping[str, pd.DataFrame]] = None,
 ) -> Prices:
     """Returns a Prices object only for successful tokens
 
     Successful tokens are the ones for which the data provider has returned a
     successful result.
+    Prices are fetched in batched requests, at most `UPSTREAM_CONCURRENCY` at a
+    time unless a `semaphore` is given. Tokens in `shared_prices`, by address,
+    use those instead.
     """
     tokens: set[tuple[str, str]] = token_symbols_and_addresses | (
-        {("ETH", "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee")} if add_eth else {}
+        {("ETH", ETH_ADDRESS)} if add_eth else set()
     )
-    maybe_token_hist_prices = {
-        token_symbol: await get_token_hist_price_covalent(token_address, token_symbol)
-        for token_symbol, token_address in tokens
-    }
-    token_prices_series = {
-        token_symbol: serieslib.make_hist_price_series(token_symbol, prices)
-        for token_symbol, prices in maybe_token_hist_prices.items()
-        if prices
+    shared_prices = shared_prices or {}
+    token_prices = {
+        **await make_token_prices(
+            {
+                token_address
+                for _, token_address in tokens
+                if token_address not in shared_prices
+            },
+            semaphore=semaphore,
+        ),
+        **shared_prices,
     }
+    # Per-token frames are dropped once laid out over a shared index.
     return Prices(
-        prices={
-            symbol: price_stats.make_returns_df(token_hist_price, "price")
-            for symbol, token_hist_price in token_prices_series.items()
-        }
+        prices=ColumnarPrices.from_frames(
+            {
+                token_symbol: token_prices[token_address]
+                for token_symbol, token_address in tokens
+                if token_address in token_prices
+            }
+        )
+    )
+
+
+async def make_treasuries_token_prices(
+    treasuries: list[tuple[str, int]]
+) -> dict[tuple[int, str], tuple[str, pd.DataFrame]]:
+    """Returns the symbol, prices and returns of the tokens held by `treasuries`
+
+    Tokens are keyed by chain id and address, and those held by several
+    treasuries are fetched and computed once. Treasuries whose portfolio can't
+    be received are left out.
+    """
+    semaphore = Semaphore(UPSTREAM_CONCURRENCY)
+    maybe_treasuries = await gather(
+        *(
+            _bounded(semaphore, make_treasury_from_address(address, chain_id))
+            for address, chain_id in treasuries
+        ),
+        return_exceptions=True,
     )
 
+    symbols_by_chain: dict[int, dict[str, str]] = defaultdict(dict)
+    for (address, chain_id), treasury in zip(treasuries, maybe_treasuries):
+        if isinstance(treasury, Exception):
+            get_logger(__name__).error(
+                "error receiving the portfolio of %s, leaving its tokens out",
+                address,
+                exc_info=treasury,
+            )
+            continue
+        symbols_by_chain[chain_id].update(
+            (asset.token_address, asset.token_symbol) for asset in treasury.assets
+        )
+        symbols_by_chain[chain_id][ETH_ADDRESS] = "ETH"
+
+    token_prices: dict[tuple[int, str], tuple[str, pd.DataFrame]] = {}
+    for chain_id, symbols in symbols_by_chain.items():
+        chain_token_prices = await make_token_prices(symbols, chain_id, semaphore)
+        token_prices.update(
+            ((chain_id, token_address), (symbols[token_address], prices))
+            for token_address, prices in chain_token_prices.items()
+        )
+    return token_prices
+
 
 async def make_balances_from_transfers_and_prices(
     balances_at_transfers: BalancesAtTransfers,
@@ -111,11 +267,13 @@ async def make_balances_from_transfers_and_prices(
     }
 
     return Balances(
-        usd_balances={
-            symbol: asset_hist_balance
-            for symbol, asset_hist_balance in maybe_asset_hist_balance.items()
-            if asset_hist_balance is not None
-        }
+        usd_balances=ColumnarBalances.from_series(
+            {
+                symbol: asset_hist_balance
+                for symbol, asset_hist_balance in maybe_asset_hist_balance.items()
+                if asset_hist_balance is not None
+            }
+        )
     )
 
 
@@ -129,10 +287,7 @@ def update_treasury_assets_from_whitelist(
 
 
 def make_total_balance_from_balances(balances: Balances) -> TotalBalance:
-    hist_total_balance: pd.Series = reduce(
-        lambda acc, item: acc.add(item, fill_value=0),
-        balances.usd_balances.values(),
-    )
+    hist_total_balance = balances.to_columnar().total()
     return TotalBalance(
         balance=price_stats.make_returns_df(hist_total_balance, "balance")
     )
@@ -144,30 +299,43 @@ def update_treasury_assets_risk_contributions(
     start: str,
     end: str,
 ) -> Treasury:
-    returns_and_balances = {
-        asset.token_symbol: (prices.prices[asset.token_symbol], asset.balance_usd)
-        for asset in treasury.assets
-    }
+    balances = {asset.token_symbol: asset.balance_usd for asset in treasury.assets}
     for symbol, risk_contribution in price_stats.calculate_risk_contributions(
-        returns_and_balances, start, end
+        prices.get_returns_matrix(start, end, balances), balances
     ).items():
         treasury.get_asset(symbol).risk_contribution = risk_contribution
     return treasury
 
 
-async def build_treasury_with_assets(
-    request_params: tuple[tuple[str, int], str, str]
+async def make_treasury_with_assets(
+    request_params: tuple[tuple[str, int], str, str],
+    shared_prices: Optional[Mapping[str, pd.DataFrame]] = None,
+    treasury: Optional[Treasury] = None,
+    balances_at_transfers: Optional[BalancesAtTransfers] = None,
 ) -> tuple[Treasury, Prices, Balances, TotalBalance]:
-    ((treasury_address, chain_id), start, end) = request_params
+    """Makes a treasury with its asset prices and balances
 
-    treasury = await make_treasury_from_address(treasury_address, chain_id)
+    Tokens in `shared_prices`, by address, use those prices. The treasury and
+    its balances at transfers are received if not given.
+    """
+    ((treasury_address, chain_id), start, end) = request_params
 
-    prices = await make_prices_from_tokens(
-        {(asset.token_symbol, asset.token_address) for asset in treasury.assets}
+    if treasury is None:
+        treasury = await make_treasury_from_address(treasury_address, chain_id)
+
+    # Prices and transfers share one bound on in-flight upstream requests.
+    semaphore = Semaphore(UPSTREAM_CONCURRENCY)
+    prices, balances_at_transfers = await gather(
+        make_prices_from_tokens(
+            {(asset.token_symbol, asset.token_address) for asset in treasury.assets},
+            semaphore=semaphore,
+            shared_prices=shared_prices,
+        ),
+        make_transfers_balances_for_treasury(treasury, semaphore)
+        if balances_at_transfers is None
+        else _resolved(balances_at_transfers),
     )
 
-    balances_at_transfers = await make_transfers_balances_for_treasury(treasury)
-
     balances = await make_balances_from_transfers_and_prices(
         balances_at_transfers, prices
     )
@@ -192,3 +360,15 @@ async def build_treasury_with_assets(
         balances,
         total_balance,
     )
+
+
+@single_flight
+async def build_treasury_with_assets(
+    request_params: tuple[tuple[str, int], str, str]
+) -> tuple[Treasury, Prices, Balances, TotalBalance]:
+    """Builds a treasury with its asset prices and balances
+
+    Concurrent calls for the same treasury and dates share one build, so its
+    results must not be mutated.
+    """
+    return await make_treasury_with_assets(request_params)
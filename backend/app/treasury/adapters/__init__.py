@@ -1,7 +1,10 @@
 from .cryptostats import get_treasury_list
 from .redis import (
     remove_treasuries_metadata,
+    retrieve_balances_at_transfers,
+    retrieve_portfolio_snapshot,
+    retrieve_token_hist_performances,
     retrieve_treasuries_metadata,
-    set_data_and_expiry,
+    retrieve_treasury_fingerprint,
     store_treasuries_metadata,
 )
@@ -1,14 +1,18 @@
-import json
 import os
+from datetime import timedelta
 from typing import Any
 
 import dateutil
-from httpx import AsyncClient, Timeout
+import numpy as np
+import pandas as pd
 from pytz import UTC
 
-from ... import db
+from ... import adb_bytes
+from ...libs.http_client import get_client
+from ...libs.series_codec import decode_series, encode_series
+from ...libs.single_flight import single_flight
+from ...libs.swr_cache import CachePolicy, get_or_refresh
 from ..models import Transfer
-from .redis import set_data_and_expiry
 
 BITQUERY_API_KEY = os.environ["BITQUERY_API_KEY"]
 ETH_QUERY_TEMPLATE = """
@@ -29,40 +33,58 @@ query{
 BITQUERY_URL = "https://graphql.bitquery.io/"
 
 
-CACHE_KEY_TEMPLATE = "bitquery_eth_{address}_{date}"
+# Encoded series of ETH transfer amounts
+CACHE_KEY_TEMPLATE = "bitquery_eth_transfers_{address}"
+CACHE_POLICY = CachePolicy(soft_ttl=timedelta(days=1), hard_ttl=timedelta(days=7))
 
 
 async def _get_data(treasury_address: str, end_date: str) -> Any:
-    timeout = Timeout(10.0, read=15.0, connect=30.0)
     query_body = ETH_QUERY_TEMPLATE.replace("$address", treasury_address)
-    async with AsyncClient(
-        headers={"X-API-KEY": BITQUERY_API_KEY}, timeout=timeout
-    ) as client:
-        resp = await client.post(
-            BITQUERY_URL,
-            json={"query": query_body.replace("$end_date", end_date)},
-        )
-        resp.raise_for_status()
-        try:
-            data = resp.json()["data"]
-            return data["ethereum"]["address"][0]["balances"][0]["history"]
-        except TypeError:
-            return []
+    resp = await get_client("bitquery").post(
+        BITQUERY_URL,
+        headers={"X-API-KEY": BITQUERY_API_KEY},
+        json={"query": query_body.replace("$end_date", end_date)},
+    )
+    resp.raise_for_status()
+    try:
+        data = resp.json()["data"]
+        return data["ethereum"]["address"][0]["balances"][0]["history"]
+    except TypeError:
+        return []
 
 
+@single_flight
 async def get_eth_transfers(treasury_address: str) -> list[Transfer]:
-    cache_date: str = dateutil.utils.today(UTC).strftime("%Y-%m-%d")
-    cache_key = CACHE_KEY_TEMPLATE.format(address=treasury_address, date=cache_date)
-    if db.exists(cache_key) > 0:
-        balance_hist_data = json.loads(db.get(cache_key))
-    else:
-        balance_hist_data = await _get_data(treasury_address, cache_date)
-        set_data_and_expiry(cache_key, json.dumps(balance_hist_data), db)
+    async def fetch_transfers() -> bytes:
+        balance_hist_data = await _get_data(
+            treasury_address, dateutil.utils.today(UTC).strftime("%Y-%m-%d")
+        )
+        return encode_series(
+            pd.DatetimeIndex(
+                pd.to_datetime(
+                    [hist_item["timestamp"] for hist_item in balance_hist_data],
+                    utc=True,
+                )
+            ),
+            [
+                np.array(
+                    [hist_item["transferAmount"] for hist_item in balance_hist_data],
+                    dtype="float64",
+                )
+            ],
+            unit="s",
+        )
 
-    return [
-        Transfer(
-            timestamp=dateutil.parser.parse(hist_item["timestamp"]),
-            amount=hist_item["transferAmount"],
+    index, (amounts,) = decode_series(
+        await get_or_refresh(
+            CACHE_KEY_TEMPLATE.format(address=treasury_address),
+            fetch_transfers,
+            CACHE_POLICY,
+            adb_bytes,
         )
-        for hist_item in balance_hist_data
+    )
+
+    return [
+        Transfer(timestamp=timestamp, amount=amount)
+        for timestamp, amount in zip(index.to_pydatetime(), amounts.tolist())
     ]
@@ -1,2 +1,3 @@
 from .portfolio_v2 import get_treasury
+from .transactions_v2 import get_latest_transaction_block
 from .transfers_v2 import get_token_transfers
@@ -1,47 +1,48 @@
 import json
+from datetime import timedelta
 from os import getenv
 from typing import Any, Optional
 
-import dateutil
 from celery.utils.log import get_logger
-from httpx import AsyncClient, HTTPStatusError, Timeout
+from httpx import HTTPStatusError, Timeout
 
-from .... import db
+from .... import adb
+from ....libs.http_client import get_client
+from ....libs.swr_cache import CachePolicy, get_or_refresh
+from ....token_whitelists import TokenWhitelist
 from ...models import ERC20, Treasury
-from .. import set_data_and_expiry
 
-CACHE_KEY_TEMPLATE_PORTFOLIO = "covalent_treasury_{address}_{chain_id}_{date}"
+CACHE_KEY_TEMPLATE_PORTFOLIO = "covalent_treasury_{address}_{chain_id}"
+PORTFOLIO_CACHE_POLICY = CachePolicy(
+    soft_ttl=timedelta(days=1), hard_ttl=timedelta(days=7)
+)
 
 
 async def _get_portfolio_data(
     treasury_address: str, chain_id: Optional[int] = 1
 ) -> dict[str, Any]:
     timeout = Timeout(10.0, read=90.0, connect=120.0)
-    async with AsyncClient(timeout=timeout) as client:
-        url = (
-            f"https://api.covalenthq.com/v1/{chain_id}/address/{treasury_address}/"
-            + f"portfolio_v2/?&key=ckey_{getenv('COVALENT_KEY')}"
-        )
-        resp = await client.get(url)
-        resp.raise_for_status()
-        data = resp.json()["data"]
+    url = (
+        f"https://api.covalenthq.com/v1/{chain_id}/address/{treasury_address}/"
+        + f"portfolio_v2/?&key=ckey_{getenv('COVALENT_KEY')}"
+    )
+    resp = await get_client("covalent").get(url, timeout=timeout)
+    resp.raise_for_status()
+    data = resp.json()["data"]
 
     return data
 
 
 async def get_treasury(
-    treasury_address: str, whitelist: list[str], chain_id: Optional[int] = 1
+    treasury_address: str, whitelist: TokenWhitelist, chain_id: Optional[int] = 1
 ) -> Treasury:
-    cache_date = dateutil.utils.today(dateutil.tz.UTC).strftime("%Y-%m-%d")
     cache_key = CACHE_KEY_TEMPLATE_PORTFOLIO.format(
-        address=treasury_address, chain_id=chain_id, date=cache_date
+        address=treasury_address, chain_id=chain_id
     )
 
-    if db.exists(cache_key) > 0:
-        portfolio_data = json.loads(db.get(cache_key))
-    else:
+    async def fetch_portfolio_data() -> str:
         try:
-            portfolio_data = await _get_portfolio_data(treasury_address, chain_id)
+            return json.dumps(await _get_portfolio_data(treasury_address, chain_id))
         except (
             HTTPStatusError,
             json.decoder.JSONDecodeError,
@@ -61,11 +62,18 @@ async def get_treasury(
             )
             raise
 
-        set_data_and_expiry(cache_key, json.dumps(portfolio_data), db)
+    portfolio_data = json.loads(
+        await get_or_refresh(
+            cache_key, fetch_portfolio_data, PORTFOLIO_CACHE_POLICY, adb
+        )
+    )
 
     # Certain tokens a treasury may hold are noted as spam.
     # To prevent these tokens from corrupting the data,
     # we filter them out via a whitelist provided by tokenlists.org
+    whitelisted_addresses = await whitelist.filter(
+        (item["contract_address"] for item in portfolio_data["items"]), adb
+    )
     assets = [
         ERC20(
             token_name=item["contract_name"],
@@ -77,7 +85,7 @@ async def get_treasury(
         )
         for item in portfolio_data["items"]
         if item["holdings"][0]["close"]["quote"]
-        and item["contract_address"] in whitelist
+        and item["contract_address"] in whitelisted_addresses
         and item["holdings"]
     ]
 
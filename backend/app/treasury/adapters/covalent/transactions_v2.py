@@ -0,0 +1,37 @@
+import os
+from typing import Optional
+
+from httpx import Timeout
+
+from ....libs.http_client import get_client
+
+KEY = os.getenv("COVALENT_KEY")
+TRANSACTIONS_V2_URL_TEMPLATE = (
+    "https://api.covalenthq.com/v1/{chain_id}/address/{treasury_address}"
+    + "/transactions_v2/"
+)
+
+
+async def get_latest_transaction_block(
+    treasury_address: str, chain_id: Optional[int] = 1
+) -> Optional[int]:
+    """Returns the block of the latest transaction of a treasury, if any
+
+    Covalent lists transactions newest first, including those transferring
+    tokens to the treasury, so one item is enough.
+    """
+    resp = await get_client("covalent").get(
+        TRANSACTIONS_V2_URL_TEMPLATE.format(
+            chain_id=chain_id, treasury_address=treasury_address
+        ),
+        params={
+            "key": f"ckey_{KEY}",
+            "page-size": 1,
+            "page-number": 0,
+            "no-logs": "true",
+        },
+        timeout=Timeout(10.0, read=30.0, connect=30.0),
+    )
+    resp.raise_for_status()
+    items = resp.json()["data"]["items"]
+    return items[0]["block_height"] if items else None
@@ -1,17 +1,33 @@
 import json
 import os
-from typing import Any, Generator, Optional
+from datetime import timedelta
+from functools import partial
+from typing import Any, AsyncGenerator, Optional
 
 import dateutil
+import pandas as pd
 from celery.utils.log import get_logger
-from httpx import AsyncClient, HTTPStatusError, Timeout
+from httpx import HTTPStatusError, Timeout
 
-from .... import db
+from .... import adb_bytes
+from ....libs import swr_cache
+from ....libs.http_client import get_client
+from ....libs.pagination import paginate
+from ....libs.series_codec import decode_series, encode_series
+from ....libs.single_flight import single_flight
+from ....libs.swr_cache import CachePolicy
 from ...models import Transfer
-from .. import set_data_and_expiry
 
+# Persistent transfers, as lists of encoded series of amounts, newest first.
 CACHE_KEY_TEMPLATE_TRANSFERS = (
-    "covalent_transfer_items_{treasury_address}_{contract_address}_{chain_id}_{date}"
+    "covalent_transfers_{treasury_address}_{contract_address}_{chain_id}"
+)
+# Hash of high-water marks of the transfer stores above, by store key.
+CACHE_HASH_TRANSFERS_SYNC = "covalent_transfers_sync"
+# Stores are synced once a day, and evicted if nobody looked at them for a
+# month.
+TRANSFERS_CACHE_POLICY = CachePolicy(
+    soft_ttl=timedelta(days=1), hard_ttl=timedelta(days=30)
 )
 
 KEY = os.getenv("COVALENT_KEY")
@@ -20,33 +36,131 @@ TRANSFERS_V2_URL_TEMPLATE = (
 )
 
 
+async def _get_transfer_page(
+    treasury_address: str,
+    contract_address: str,
+    chain_id: int,
+    starting_block: Optional[int],
+    page_number: int,
+) -> dict[str, Any]:
+    params = {
+        "quote-currency": "USD",
+        "format": "JSON",
+        "contract-address": contract_address,
+        "key": f"ckey_{KEY}",
+        "page-number": page_number,
+    }
+    if starting_block is not None:
+        params["starting-block"] = starting_block
+    resp = await get_client("covalent").get(
+        TRANSFERS_V2_URL_TEMPLATE.format(
+            chain_id=chain_id, treasury_address=treasury_address
+        ),
+        params=params,
+        timeout=Timeout(10.0, read=60.0, connect=90.0),
+    )
+    resp.raise_for_status()
+    return resp.json()["data"]
+
+
 async def _get_transfer_items(
-    treasury_address: str, contract_address: str, chain_id: int
-) -> Generator[dict[str, Any], None, None]:
-    page_number = 0
-    while True:
-        async with AsyncClient(
-            timeout=Timeout(10.0, read=60.0, connect=90.0)
-        ) as client:
-            resp = await client.get(
-                TRANSFERS_V2_URL_TEMPLATE.format(
-                    chain_id=chain_id, treasury_address=treasury_address
-                ),
-                params={
-                    "quote-currency": "USD",
-                    "format": "JSON",
-                    "contract-address": contract_address,
-                    "key": f"ckey_{KEY}",
-                    "page-number": page_number,
-                },
-            )
-        resp.raise_for_status()
-        data = resp.json()["data"]
-        for item in data["items"]:
-            yield item
-        if not data["pagination"]["has_more"]:
-            break
-        page_number += 1
+    treasury_address: str,
+    contract_address: str,
+    chain_id: int,
+    starting_block: Optional[int] = None,
+) -> AsyncGenerator[dict[str, Any], None]:
+    async for item in paginate(
+        partial(
+            _get_transfer_page,
+            treasury_address,
+            contract_address,
+            chain_id,
+            starting_block,
+        )
+    ):
+        yield item
+
+
+async def _retrieve_transfers(
+    cache_key: str,
+) -> tuple[Optional[dict[str, Any]], list[Transfer], bool]:
+    "Returns the sync mark of a transfer store, its transfers and if it is fresh"
+    async with adb_bytes.pipeline() as pipe:
+        pipe.hget(CACHE_HASH_TRANSFERS_SYNC, cache_key)
+        pipe.lrange(cache_key, 0, -1)
+        pipe.exists(swr_cache.FRESH_KEY_TEMPLATE.format(key=cache_key))
+        raw_sync_mark, raw_stored_transfers, fresh = await pipe.execute()
+    if raw_sync_mark is None:
+        return None, [], False
+    sync_mark = json.loads(raw_sync_mark)
+    # The store itself may have been evicted: the history must be fetched again.
+    if sync_mark["block_height"] is not None and not raw_stored_transfers:
+        return None, [], False
+    return (
+        sync_mark,
+        [
+            transfer
+            for raw_transfers in raw_stored_transfers
+            for transfer in _decode_transfers(raw_transfers)
+        ],
+        bool(fresh),
+    )
+
+
+def _make_sync_mark(
+    transfer_items: list[dict[str, Any]],
+    previous_sync_mark: Optional[dict[str, Any]],
+) -> dict[str, Any]:
+    if not transfer_items:
+        if previous_sync_mark is None:
+            return {"block_height": None, "tx_hashes": []}
+        return {
+            "block_height": previous_sync_mark["block_height"],
+            "tx_hashes": previous_sync_mark["tx_hashes"],
+        }
+    block_height = max(item["block_height"] for item in transfer_items)
+    tx_hashes = [
+        item["tx_hash"]
+        for item in transfer_items
+        if item["block_height"] == block_height
+    ]
+    if previous_sync_mark and previous_sync_mark["block_height"] == block_height:
+        tx_hashes.extend(previous_sync_mark["tx_hashes"])
+    return {"block_height": block_height, "tx_hashes": tx_hashes}
+
+
+def _encode_transfers(transfers: list[Transfer]) -> bytes:
+    return encode_series(
+        pd.DatetimeIndex([transfer.timestamp for transfer in transfers]),
+        [[transfer.amount for transfer in transfers]],
+        unit="s",
+    )
+
+
+def _decode_transfers(raw_transfers: bytes) -> list[Transfer]:
+    index, (amounts,) = decode_series(raw_transfers)
+    return [
+        Transfer(timestamp=timestamp, amount=amount)
+        for timestamp, amount in zip(index.to_pydatetime(), amounts.tolist())
+    ]
+
+
+async def _store_transfers(
+    cache_key: str,
+    new_transfers: list[Transfer],
+    sync_mark: dict[str, Any],
+    append: bool,
+):
+    async with adb_bytes.pipeline() as pipe:
+        if not append:
+            pipe.delete(cache_key)
+        if new_transfers:
+            pipe.lpush(cache_key, _encode_transfers(new_transfers))
+        pipe.hset(CACHE_HASH_TRANSFERS_SYNC, cache_key, json.dumps(sync_mark))
+        pipe.pexpire(cache_key, TRANSFERS_CACHE_POLICY.hard_ttl_ms())
+        pipe.expire(CACHE_HASH_TRANSFERS_SYNC, TRANSFERS_CACHE_POLICY.hard_ttl)
+        swr_cache.mark_fresh(cache_key, TRANSFERS_CACHE_POLICY, pipe)
+        await pipe.execute()
 
 
 TYPE_SIGN = {"OUT": -1, "IN": 1}
@@ -70,6 +184,85 @@ def _transfers_of_items(transfer_items: list[dict[str, Any]]):
             yield Transfer(timestamp=block_date, amount=amount)
 
 
+async def _fetch_new_transfers(
+    treasury_address: str,
+    contract_address: str,
+    chain_id: int,
+    sync_mark: Optional[dict[str, Any]],
+) -> tuple[list[Transfer], dict[str, Any]]:
+    "Returns the transfers after `sync_mark`, with the sync mark they lead to"
+    try:
+        new_transfer_items = [
+            _
+            async for _ in _get_transfer_items(
+                treasury_address,
+                contract_address,
+                chain_id,
+                starting_block=sync_mark["block_height"] if sync_mark else None,
+            )
+        ]
+    except (
+        HTTPStatusError,
+        json.decoder.JSONDecodeError,
+        KeyError,
+    ) as error:
+        logger = get_logger(__name__)
+        if error.__class__ is HTTPStatusError:
+            logger.error(
+                "unable to receive a Covalent `transfers_v2` API response",
+                exc_info=error,
+            )
+        logger.error(
+            "error processing Covalent `transfers_v2` API response", exc_info=error
+        )
+        raise
+
+    if sync_mark:
+        # The starting block is fetched again, drop the transactions we have.
+        new_transfer_items = [
+            item
+            for item in new_transfer_items
+            if item["block_height"] != sync_mark["block_height"]
+            or item["tx_hash"] not in sync_mark["tx_hashes"]
+        ]
+
+    return (
+        list(_transfers_of_items(new_transfer_items)),
+        _make_sync_mark(new_transfer_items, sync_mark),
+    )
+
+
+async def _sync_transfers(
+    treasury_address: str,
+    contract_address: str,
+    chain_id: int,
+    cache_key: str,
+) -> Optional[list[Transfer]]:
+    """Syncs a transfer store, unless another process is, and returns its transfers
+
+    The sync mark is read again once the store is locked, so that transfers a
+    process synced meanwhile aren't appended twice.
+    """
+    lock_token = await swr_cache.acquire_refresh_lock(cache_key, adb_bytes)
+    if lock_token is None:
+        return None
+    try:
+        sync_mark, stored_transfers, fresh = await _retrieve_transfers(cache_key)
+        if fresh:
+            return stored_transfers
+
+        new_transfers, new_sync_mark = await _fetch_new_transfers(
+            treasury_address, contract_address, chain_id, sync_mark
+        )
+        await _store_transfers(
+            cache_key, new_transfers, new_sync_mark, append=sync_mark is not None
+        )
+        return new_transfers + stored_transfers
+    finally:
+        await swr_cache.release_refresh_lock(cache_key, lock_token, adb_bytes)
+
+
+@single_flight
 async def get_token_transfers(
     treasury_address: str, contract_address: str, chain_id: Optional[int] = 1
 ) -> list[Transfer]:
@@ -84,41 +277,38 @@ async def get_token_transfers(
 
     Thus, the balance for a given treasury can only be calculated for
     the date of transfer from the covalent response.
+
+    Transfers are kept in a persistent store along with the highest block
+    seen. Once a day, only the transfers from that block on are fetched and
+    added to the store, as one encoded series, by one process at a time.
+    Meanwhile, the stale store is served, unless there is none yet.
     """
-    cache_date = dateutil.utils.today(dateutil.tz.UTC).strftime("%Y-%m-%d")
     cache_key = CACHE_KEY_TEMPLATE_TRANSFERS.format(
         treasury_address=treasury_address,
         contract_address=contract_address,
         chain_id=chain_id,
-        date=cache_date,
     )
 
-    if db.exists(cache_key) > 0:
-        transfer_items = json.loads(db.get(cache_key))
-    else:
-        try:
-            transfer_items = [
-                _
-                async for _ in _get_transfer_items(
-                    treasury_address, contract_address, chain_id
-                )
-            ]
-        except (
-            HTTPStatusError,
-            json.decoder.JSONDecodeError,
-            KeyError,
-        ) as error:
-            logger = get_logger(__name__)
-            if error.__class__ is HTTPStatusError:
-                logger.error(
-                    "unable to receive a Covalent `transfers_v2` API response",
-                    exc_info=error,
-                )
-            logger.error(
-                "error processing Covalent `transfers_v2` API response", exc_info=error
+    sync_mark, stored_transfers, fresh = await _retrieve_transfers(cache_key)
+    if fresh:
+        return stored_transfers
+    if sync_mark and not swr_cache.revalidates_inline():
+        swr_cache.refresh_in_background(
+            partial(
+                _sync_transfers, treasury_address, contract_address, chain_id, cache_key
             )
-            raise
-
-        set_data_and_expiry(cache_key, json.dumps(transfer_items), db)
+        )
+        return stored_transfers
 
-    return list(_transfers_of_items(transfer_items))
+    synced_transfers = await _sync_transfers(
+        treasury_address, contract_address, chain_id, cache_key
+    )
+    if synced_transfers is not None:
+        return synced_transfers
+    # Another process is syncing the store: serve it as is, if there is one.
+    if sync_mark:
+        return stored_transfers
+    new_transfers, _ = await _fetch_new_transfers(
+        treasury_address, contract_address, chain_id, None
+    )
+    return new_transfers
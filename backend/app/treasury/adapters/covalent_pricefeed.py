@@ -1,79 +1,186 @@
 # pylint: disable=duplicate-code
 import json
+from asyncio import Semaphore, gather
+from collections import defaultdict
 from datetime import datetime, timedelta
+from functools import partial
 from os import getenv
-from typing import Any, TypeVar
+from typing import Any, Iterable, Optional, TypeVar
 
 import dateutil
+import pandas as pd
 from celery.utils.log import get_logger
-from httpx import AsyncClient, HTTPStatusError, Timeout
+from dateutil.utils import today
+from httpx import AsyncClient, HTTPStatusError, RequestError, Timeout
 
-from ... import db
+from ... import adb_bytes
+from ...libs import swr_cache
+from ...libs.http_client import get_client
+from ...libs.series_codec import SeriesDecodeError, decode_series, encode_series
+from ...libs.single_flight import SingleFlight
+from ...libs.swr_cache import CachePolicy
+from ...libs.ttl_cache import TTLLRUCache
 from ..models import Price
 
 COVALENT_URI = "https://api.covalenthq.com/v1"
-CACHE_HASH_PRICES = "covalent_prices"
-CACHE_KEY_TEMPLATE_PRICES = "{symbol}_{start}_{end}"
+# Persistent daily price histories, as encoded series, by token.
+CACHE_KEY_TEMPLATE_PRICES = "covalent_price_series_{chain_id}_{address}"
+PRICE_HISTORY_DAYS = 366
+# Histories are synced once a day, and evicted if nobody looked at them for
+# a month.
+PRICES_CACHE_POLICY = CachePolicy(
+    soft_ttl=timedelta(days=1), hard_ttl=timedelta(days=30)
+)
+# Number of token addresses sent in one `historical_by_addresses_v2` request.
+PRICES_BATCH_SIZE = int(getenv("COVALENT_PRICES_BATCH_SIZE", "20"))
+# Number of decoded price series of fresh tokens kept in memory.
+PRICE_SERIES_CACHE_SIZE = int(getenv("PRICE_SERIES_CACHE_SIZE", "512"))
+
+ETH_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+WETH_ADDRESS = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
 
 RawPrices = TypeVar("RawPrices", list[dict[str, Any]], None)
 
+# Prices of a token are fetched once for concurrent treasuries holding it.
+_price_flights = SingleFlight()
+# Price series by (chain id, token address), while fresh in Redis
+price_series_cache: TTLLRUCache[pd.Series] = TTLLRUCache(PRICE_SERIES_CACHE_SIZE)
+
 
 async def _get_pricing_data(
-    token_address: str,
+    token_addresses: list[str],
     start_date: datetime,
     end_date: datetime,
     chain_id: int = 1,
-) -> RawPrices:
+) -> dict[str, RawPrices]:
+    "Returns the raw prices of each of `token_addresses` it received prices for"
     start = start_date.strftime("%Y-%m-%d")
     end = end_date.strftime("%Y-%m-%d")
     timeout = Timeout(10.0, read=15.0, connect=30.0)
-    async with AsyncClient(
+
+    # Covalent prices ETH as WETH.
+    requested_addresses: dict[str, list[str]] = defaultdict(list)
+    for token_address in token_addresses:
+        requested_address = (
+            WETH_ADDRESS if token_address == ETH_ADDRESS else token_address
+        )
+        requested_addresses[requested_address.lower()].append(token_address)
+
+    req_url = (
+        COVALENT_URI
+        + f"/pricing/historical_by_addresses_v2/{chain_id}"
+        + f"/USD/{','.join(requested_addresses)}/?quote-currency=USD&format=JSON"
+        + f"&from={start}&to={end}&key=ckey_{getenv('COVALENT_KEY')}"
+    )
+
+    client: AsyncClient = get_client("covalent")
+    resp = await client.get(
+        req_url,
         headers={
             "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
             + "AppleWebKit/537.36 (KHTML, like Gecko) "
             + "Chrome/100.0.4896.127 Safari/537.36 Edg/100.0.1185.50"
         },
-    ) as client:
-        if token_address == "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee":
-            token_address = "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2"
-
-        req_url = (
-            COVALENT_URI
-            + f"/pricing/historical_by_addresses_v2/{chain_id}"
-            + f"/USD/{token_address}/?quote-currency=USD&format=JSON"
-            + f"&from={start}&to={end}&key=ckey_{getenv('COVALENT_KEY')}"
+        timeout=timeout,
+    )
+    resp.raise_for_status()
+    return {
+        token_address: item["prices"]
+        for item in resp.json()["data"]
+        for token_address in requested_addresses.get(
+            item["contract_address"].lower(), []
         )
+    }
 
-        resp = await client.get(req_url, timeout=timeout)
-        resp.raise_for_status()
-        return resp.json()["data"][0]["prices"]
 
+def _make_price_series(token_prices: dict[str, Optional[float]]) -> pd.Series:
+    "Returns the series of daily prices by UTC timestamp"
+    dates = sorted(token_prices)
+    return pd.Series(
+        [token_prices[date] for date in dates],
+        index=pd.DatetimeIndex(pd.to_datetime(dates, utc=True), name="timestamp"),
+        dtype="float64",
+    )
 
-async def get_token_hist_price_covalent(
-    token_address: str, token_symbol: str
-) -> list[Price]:
-    end_date = dateutil.utils.today(dateutil.tz.UTC)
-    start_date = end_date - timedelta(days=366)
 
-    cache_key = CACHE_KEY_TEMPLATE_PRICES.format(
-        symbol=token_symbol,
-        start=start_date.strftime("%Y-%m-%d"),
-        end=end_date.strftime("%Y-%m-%d"),
+def _decode_prices(raw_prices: Optional[bytes]) -> pd.Series:
+    if raw_prices is not None:
+        try:
+            index, (prices,) = decode_series(raw_prices)
+            return pd.Series(prices, index=index)
+        except SeriesDecodeError:
+            get_logger(__name__).exception("error decoding stored prices, dropping")
+    return _make_price_series({})
+
+
+async def _retrieve_price_histories(
+    cache_keys: list[str],
+) -> tuple[list[Optional[pd.Series]], list[int]]:
+    """Returns the stored prices of each key, if any, and how long they are fresh for
+
+    Freshness is in milliseconds, 0 for stale prices.
+    """
+    async with adb_bytes.pipeline() as pipe:
+        for cache_key in cache_keys:
+            pipe.get(cache_key)
+        for cache_key in cache_keys:
+            pipe.pttl(swr_cache.FRESH_KEY_TEMPLATE.format(key=cache_key))
+        results = await pipe.execute()
+    return [
+        _decode_prices(raw_price_history) if raw_price_history is not None else None
+        for raw_price_history in results[: len(cache_keys)]
+    ], [
+        # Missing fresh keys have a PTTL of -2, and ones without expiry of -1.
+        PRICES_CACHE_POLICY.soft_ttl_ms()
+        if fresh_ttl_ms == -1
+        else max(fresh_ttl_ms, 0)
+        for fresh_ttl_ms in results[len(cache_keys) :]
+    ]
+
+
+def _store_prices(cache_key: str, token_prices: pd.Series, provider) -> int:
+    "Queues the storing of `token_prices`, returning how long they are fresh for"
+    return swr_cache.store(
+        cache_key,
+        encode_series(token_prices.index, [token_prices.to_numpy()]),
+        PRICES_CACHE_POLICY,
+        provider,
     )
-    if db.hexists(CACHE_HASH_PRICES, cache_key):
-        hist_price_data = json.loads(db.hget(CACHE_HASH_PRICES, cache_key))
-    else:
+
+
+def _merge_prices(
+    token_prices: pd.Series,
+    new_prices: dict[str, Optional[float]],
+    start: str,
+) -> pd.Series:
+    "Returns `token_prices` updated with `new_prices`, without dates before `start`"
+    merged_prices = pd.concat([token_prices, _make_price_series(new_prices)])
+    merged_prices = merged_prices[
+        ~merged_prices.index.duplicated(keep="last")
+    ].sort_index()
+    return merged_prices.loc[start:]
+
+
+async def _get_batch_pricing_data(
+    token_addresses: list[str],
+    start_date: datetime,
+    end_date: datetime,
+    chain_id: int,
+    semaphore: Semaphore,
+) -> Optional[dict[str, RawPrices]]:
+    async with semaphore:
         try:
-            hist_price_data = await _get_pricing_data(
-                token_address, start_date, end_date
+            return await _get_pricing_data(
+                token_addresses, start_date, end_date, chain_id
             )
         except (
             HTTPStatusError,
+            RequestError,
             json.decoder.JSONDecodeError,
             KeyError,
         ) as error:
             logger = get_logger(__name__)
-            if error.__class__ is HTTPStatusError:
+            if isinstance(error, (HTTPStatusError, RequestError)):
                 msg = (
                     "unable to receive a Covalent"
                     + "`pricing/historical_by_addresses_v2` API response"
@@ -81,27 +188,283 @@ async def get_token_hist_price_covalent(
             else:
                 msg = "error processing Covalent `pricing/historical_by_addresses_v2` API response"
             logger.error(
+                "%s for %s",
                 msg,
+                ",".join(token_addresses),
                 exc_info=error,
             )
-            return []
-        db.hset(CACHE_HASH_PRICES, cache_key, json.dumps(hist_price_data))
-        # Set an expiry flag on this hset name for a day.
-        # It will only set an expire on this name if none exists for it.
-        if db.ttl(CACHE_HASH_PRICES) <= 0:
-            time_to_evict = datetime.now(tz=dateutil.tz.UTC) + timedelta(days=1)
-            time_to_evict_ts = time_to_evict.replace(
-                hour=0, minute=0, second=0, microsecond=0
-            ).timestamp()
-
-            db.expireat(CACHE_HASH_PRICES, int(time_to_evict_ts))
+            return None
+
+
+def _make_batches(
+    stored_prices: dict[str, pd.Series],
+    start_date: datetime,
+) -> list[tuple[datetime, list[str]]]:
+    "Groups tokens to sync by the date to fetch their prices from"
+    # The last stored date is fetched again as its price may have been a
+    # partial day quote.
+    addresses_by_from_date: dict[datetime, list[str]] = defaultdict(list)
+    for token_address, token_prices in stored_prices.items():
+        from_date = (
+            max(token_prices.index[-1].to_pydatetime(), start_date)
+            if not token_prices.empty
+            else start_date
+        )
+        addresses_by_from_date[from_date].append(token_address)
 
     return [
-        Price(
-            timestamp=dateutil.parser.parse(item["date"]).replace(
-                tzinfo=dateutil.tz.UTC
-            ),
-            value=item["price"],
+        (from_date, from_date_addresses[i : i + PRICES_BATCH_SIZE])
+        for from_date, from_date_addresses in addresses_by_from_date.items()
+        for i in range(0, len(from_date_addresses), PRICES_BATCH_SIZE)
+    ]
+
+
+async def _sync_prices(
+    stored_prices: dict[str, pd.Series],
+    chain_id: int,
+    semaphore: Optional[Semaphore],
+) -> dict[str, pd.Series]:
+    """Fetches the prices missing from `stored_prices` and stores them
+
+    Returns the prices of the tokens it synced, which are also kept in
+    `price_series_cache` while fresh. Tokens whose request failed are left out.
+    """
+    end_date = today(dateutil.tz.UTC)
+    start_date = end_date - timedelta(days=PRICE_HISTORY_DAYS)
+    start = start_date.strftime("%Y-%m-%d")
+
+    batches = _make_batches(stored_prices, start_date)
+    # Batches are all sent at once unless a semaphore is given.
+    semaphore = semaphore or Semaphore(max(len(batches), 1))
+    batches_pricing_data = await gather(
+        *(
+            _get_batch_pricing_data(
+                batch_addresses, from_date, end_date, chain_id, semaphore
+            )
+            for from_date, batch_addresses in batches
+        ),
+        return_exceptions=True,
+    )
+
+    synced_prices: dict[str, pd.Series] = {}
+    fresh_ttls_ms: dict[str, int] = {}
+    async with adb_bytes.pipeline() as pipe:
+        for (_, batch_addresses), pricing_data in zip(batches, batches_pricing_data):
+            # A failed batch doesn't prevent the others from being stored.
+            if isinstance(pricing_data, BaseException):
+                if not isinstance(pricing_data, Exception):
+                    raise pricing_data
+                get_logger(__name__).error(
+                    "error syncing Covalent prices for %s",
+                    ",".join(batch_addresses),
+                    exc_info=pricing_data,
+                )
+                continue
+            if pricing_data is None:
+                continue
+            for token_address in batch_addresses:
+                new_prices = {
+                    item["date"]: item["price"]
+                    for item in pricing_data.get(token_address, [])
+                }
+                synced_prices[token_address] = _merge_prices(
+                    stored_prices[token_address], new_prices, start
+                )
+                fresh_ttls_ms[token_address] = _store_prices(
+                    _cache_key(chain_id, token_address),
+                    synced_prices[token_address],
+                    pipe,
+                )
+        await pipe.execute()
+
+    for token_address, fresh_ttl_ms in fresh_ttls_ms.items():
+        price_series_cache.put(
+            (chain_id, token_address), synced_prices[token_address], fresh_ttl_ms
+        )
+
+    return synced_prices
+
+
+async def _sync_stale_prices(stored_prices: dict[str, pd.Series], chain_id: int):
+    "Syncs the stale prices no other process is syncing"
+    cache_keys = {
+        token_address: _cache_key(chain_id, token_address)
+        for token_address in stored_prices
+    }
+    lock_tokens = dict(
+        zip(
+            cache_keys,
+            await swr_cache.acquire_refresh_locks(list(cache_keys.values()), adb_bytes),
         )
-        for item in hist_price_data
+    )
+    try:
+        await _sync_prices(
+            {
+                token_address: token_prices
+                for token_address, token_prices in stored_prices.items()
+                if lock_tokens[token_address] is not None
+            },
+            chain_id,
+            None,
+        )
+    finally:
+        await swr_cache.release_refresh_locks(
+            [
+                (cache_keys[token_address], lock_token)
+                for token_address, lock_token in lock_tokens.items()
+                if lock_token is not None
+            ],
+            adb_bytes,
+        )
+
+
+def _cache_key(chain_id: int, token_address: str) -> str:
+    return CACHE_KEY_TEMPLATE_PRICES.format(chain_id=chain_id, address=token_address)
+
+
+async def _get_tokens_hist_prices(
+    token_addresses: list[str],
+    chain_id: int,
+    semaphore: Optional[Semaphore],
+) -> dict[str, pd.Series]:
+    "Returns the daily prices of each token, as stored series"
+    price_histories, fresh_ttls_ms = await _retrieve_price_histories(
+        [_cache_key(chain_id, token_address) for token_address in token_addresses]
+    )
+    stored_prices = {
+        token_address: (
+            token_prices if token_prices is not None else _make_price_series({})
+        )
+        for token_address, token_prices in zip(token_addresses, price_histories)
+    }
+    fresh_ttls_ms = {
+        token_address: fresh_ttl_ms
+        for token_address, fresh_ttl_ms in zip(token_addresses, fresh_ttls_ms)
+        if fresh_ttl_ms > 0
+    }
+    for token_address, fresh_ttl_ms in fresh_ttls_ms.items():
+        price_series_cache.put(
+            (chain_id, token_address), stored_prices[token_address], fresh_ttl_ms
+        )
+
+    # Stale prices are served while they are synced in the background, unless
+    # there are none yet.
+    stale_prices = {
+        token_address: token_prices
+        for token_address, token_prices, token_history in zip(
+            token_addresses, stored_prices.values(), price_histories
+        )
+        if token_address not in fresh_ttls_ms
+        and token_history is not None
+        and not swr_cache.revalidates_inline()
+    }
+    if stale_prices:
+        swr_cache.refresh_in_background(
+            partial(_sync_stale_prices, stale_prices, chain_id)
+        )
+
+    synced_prices = await _sync_prices(
+        {
+            token_address: token_prices
+            for token_address, token_prices in stored_prices.items()
+            if token_address not in fresh_ttls_ms and token_address not in stale_prices
+        },
+        chain_id,
+        semaphore,
+    )
+    stored_prices.update(synced_prices)
+    return stored_prices
+
+
+async def _get_tokens_hist_series(
+    token_addresses: Iterable[str],
+    chain_id: int,
+    semaphore: Optional[Semaphore],
+) -> dict[str, pd.Series]:
+    """Returns the last `PRICE_HISTORY_DAYS` daily prices of each token as series
+
+    Prices are kept in a persistent per-token history. Once it goes stale,
+    only the prices from the last stored date on are fetched and merged into
+    it, in requests of up to `PRICES_BATCH_SIZE` tokens sharing the same start
+    date. Stale histories are served meanwhile, and synced in the background,
+    unless revalidating inline. If a request fails, its tokens keep their
+    stored prices, if any.
+    Tokens already being fetched by a concurrent call are awaited instead of
+    being fetched again.
+    """
+    token_addresses = list(dict.fromkeys(token_addresses))
+    if not token_addresses:
+        return {}
+
+    async def get_series(
+        keys: list[tuple[int, str]]
+    ) -> dict[tuple[int, str], pd.Series]:
+        series = await _get_tokens_hist_prices(
+            [token_address for _, token_address in keys], chain_id, semaphore
+        )
+        return {
+            (chain_id, address): address_series
+            for address, address_series in series.items()
+        }
+
+    series = await _price_flights.do_many(
+        [(chain_id, token_address) for token_address in token_addresses], get_series
+    )
+    return {
+        token_address: series[(chain_id, token_address)]
+        for token_address in token_addresses
+    }
+
+
+async def get_tokens_hist_prices_covalent(
+    token_addresses: Iterable[str],
+    chain_id: int = 1,
+    semaphore: Optional[Semaphore] = None,
+) -> dict[str, list[Price]]:
+    "Returns the last `PRICE_HISTORY_DAYS` daily prices of each token"
+    return {
+        token_address: [
+            Price(timestamp=timestamp.to_pydatetime(), value=price)
+            for timestamp, price in token_prices.items()
+        ]
+        for token_address, token_prices in (
+            await _get_tokens_hist_series(token_addresses, chain_id, semaphore)
+        ).items()
+    }
+
+
+async def get_token_hist_price_covalent(
+    token_address: str, token_symbol: str, chain_id: int = 1
+) -> list[Price]:
+    "Returns the last `PRICE_HISTORY_DAYS` daily prices of a token"
+    # pylint: disable=unused-argument
+    return (await get_tokens_hist_prices_covalent([token_address], chain_id))[
+        token_address
+    ]
+
+
+async def get_tokens_hist_price_series_covalent(
+    token_addresses: Iterable[str],
+    chain_id: int = 1,
+    semaphore: Optional[Semaphore] = None,
+) -> dict[str, pd.Series]:
+    """Returns the last `PRICE_HISTORY_DAYS` daily prices of each token as series
+
+    Series of fresh tokens are kept in `price_series_cache`, so that hot
+    tokens are neither read from Redis nor decoded again until their Redis
+    history goes stale.
+    """
+    series = {
+        token_address: price_series_cache.get((chain_id, token_address))
+        for token_address in dict.fromkeys(token_addresses)
+    }
+    missing_addresses = [
+        token_address for token_address, prices in series.items() if prices is None
     ]
+    if missing_addresses:
+        # Fresh and synced series are also put in `price_series_cache` as they
+        # are read or stored.
+        series.update(
+            await _get_tokens_hist_series(missing_addresses, chain_id, semaphore)
+        )
+    return series
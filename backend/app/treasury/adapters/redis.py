@@ -1,11 +1,15 @@
 import json
-from datetime import datetime, timedelta
-from typing import Union
+from typing import Any, Optional, Union
 
 import redis
-from dateutil.tz import UTC
+import redis.asyncio
 
 CHAIN_ID = 1
+PORTFOLIO_KEY_TEMPLATE = "portfolio_{address}_{start}_{end}"
+TOKEN_HIST_PERFORMANCE_KEY_TEMPLATE = "{chain_id}_{address}"
+TREASURY_FINGERPRINT_KEY_TEMPLATE = "{chain_id}_{address}"
+# Hash of encoded series of token balances at transfers, by symbol
+BALANCES_AT_TRANSFERS_KEY_TEMPLATE = "balances_at_transfers_{chain_id}_{address}"
 
 
 def store_treasuries_metadata(
@@ -36,16 +40,55 @@ def retrieve_hist_prices(
     provider.hget("asset_hist_performance", symbol)
 
 
-def set_data_and_expiry(
-    cache_key: str,
-    data_to_set: str,
-    provider: Union[redis.Redis, redis.client.Pipeline],
-):
-    provider.set(cache_key, data_to_set)
-    if provider.ttl(cache_key) <= 0:
-        time_to_evict = datetime.now(tz=UTC) + timedelta(days=1)
-        time_to_evict_ts = time_to_evict.replace(
-            hour=0, minute=0, second=0, microsecond=0
-        ).timestamp()
-
-    provider.expireat(cache_key, int(time_to_evict_ts))
+async def retrieve_token_hist_performances(
+    chain_id: int, token_addresses: list[str], provider: redis.asyncio.Redis
+) -> list[Optional[bytes]]:
+    "Returns the hist performance of each token stored by the nightly job, if any"
+    if not token_addresses:
+        return []
+    return await provider.hmget(
+        "token_hist_performance",
+        [
+            TOKEN_HIST_PERFORMANCE_KEY_TEMPLATE.format(
+                chain_id=chain_id, address=token_address
+            )
+            for token_address in token_addresses
+        ],
+    )
+
+
+async def retrieve_treasury_fingerprint(
+    address: str, chain_id: int, provider: redis.asyncio.Redis
+) -> Optional[dict[str, Any]]:
+    "Returns what the treasury looked like when the nightly job last built it"
+    raw_fingerprint = await provider.hget(
+        "treasury_fingerprints",
+        TREASURY_FINGERPRINT_KEY_TEMPLATE.format(
+            chain_id=chain_id, address=address.lower()
+        ),
+    )
+    return json.loads(raw_fingerprint) if raw_fingerprint is not None else None
+
+
+async def retrieve_balances_at_transfers(
+    address: str, chain_id: int, provider: redis.asyncio.Redis
+) -> dict[str, bytes]:
+    "Returns the encoded balances at transfers of each asset, by symbol"
+    return {
+        symbol.decode() if isinstance(symbol, bytes) else symbol: balances
+        for symbol, balances in (
+            await provider.hgetall(
+                BALANCES_AT_TRANSFERS_KEY_TEMPLATE.format(
+                    chain_id=chain_id, address=address.lower()
+                )
+            )
+        ).items()
+    }
+
+
+async def retrieve_portfolio_snapshot(
+    address: str, start: str, end: str, provider: redis.asyncio.Redis
+) -> Optional[str]:
+    return await provider.get(
+        PORTFOLIO_KEY_TEMPLATE.format(address=address.lower(), start=start, end=end),
+    )
@@ -1,6 +1,11 @@
 import datetime
+import hashlib
+import json
+from collections.abc import Mapping
 from dataclasses import dataclass, field
+from typing import Iterable, Iterator, Optional
 
+import numpy as np
 import pandas as pd
 
 
@@ -69,6 +74,9 @@ class ERC20:
 class Treasury:
     address: str
     assets: list[ERC20]
+    transfer_errors: dict[str, Exception] = field(
+        default_factory=dict, repr=False, compare=False
+    )
 
     def get_asset(self, symbol: str):
         return next(asset for asset in self.assets if asset.token_symbol == symbol)
@@ -77,22 +85,231 @@ class Treasury:
     def usd_total(self) -> float:
         return sum(asset.balance_usd for asset in self.assets)
 
+    @property
+    def holdings_hash(self) -> str:
+        "Returns a hash of the balance of each asset"
+        holdings = sorted(
+            (asset.token_address, asset.token_symbol, asset.balance)
+            for asset in self.assets
+        )
+        return hashlib.sha256(json.dumps(holdings).encode()).hexdigest()
+
+
+def _union_index(indexes: list[pd.DatetimeIndex]) -> pd.DatetimeIndex:
+    "Returns the sorted union of tz-aware `indexes`"
+    return pd.DatetimeIndex(
+        np.unique(
+            np.concatenate(
+                [index.asi8 for index in indexes] or [np.array([], dtype="int64")]
+            )
+        ),
+        tz=indexes[0].tz if indexes else datetime.timezone.utc,
+        name="timestamp",
+    )
+
+
+class _Columnar:
+    """Series of tokens as date × token float64 arrays over one shared index
+
+    `present` tells which dates each token has a value for, as opposed to
+    missing values of dates it has.
+    """
+
+    fields: tuple[str, ...]
+
+    def __init__(
+        self,
+        index: pd.DatetimeIndex,
+        symbols: list[str],
+        values: dict[str, np.ndarray],
+        present: np.ndarray,
+    ):
+        self.index = index
+        self.columns = {symbol: column for column, symbol in enumerate(symbols)}
+        self.values = values
+        self.present = present
+
+    @classmethod
+    def _from_arrays(
+        cls, arrays: Mapping[str, tuple[pd.DatetimeIndex, dict[str, np.ndarray]]]
+    ):
+        "Builds from the index and field values of each token"
+        index = _union_index([token_index for token_index, _ in arrays.values()])
+        shape = (len(index), len(arrays))
+        present = np.zeros(shape, dtype=bool)
+        values = {name: np.full(shape, np.nan) for name in cls.fields}
+        for column, (token_index, token_values) in enumerate(arrays.values()):
+            rows = np.searchsorted(index.asi8, token_index.asi8)
+            present[rows, column] = True
+            for name in cls.fields:
+                values[name][rows, column] = token_values[name]
+        return cls(index, list(arrays), values, present)
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.columns)
+
+    def __len__(self) -> int:
+        return len(self.columns)
+
+    def get_field(self, name: str) -> pd.DataFrame:
+        "Returns a date × token frame of field `name`, NaN where missing"
+        return pd.DataFrame(
+            self.values[name], index=self.index, columns=list(self.columns)
+        )
+
+
+class ColumnarPrices(_Columnar, Mapping):
+    "Token prices, returns and std_dev, also mapping symbols to DataFrames"
+
+    fields = ("price", "returns", "std_dev")
+
+    @classmethod
+    def from_frames(cls, frames: Mapping[str, pd.DataFrame]) -> "ColumnarPrices":
+        return cls._from_arrays(
+            {
+                symbol: (
+                    frame.index,
+                    {
+                        name: frame[name].to_numpy(dtype="float64")
+                        for name in cls.fields
+                    },
+                )
+                for symbol, frame in frames.items()
+            }
+        )
+
+    def __getitem__(self, symbol: str) -> pd.DataFrame:
+        column = self.columns[symbol]
+        rows = self.present[:, column]
+        return pd.DataFrame(
+            {name: self.values[name][rows, column] for name in self.fields},
+            index=self.index[rows],
+        )
+
+    def get_returns_window(
+        self, start: str, end: str
+    ) -> tuple[pd.DataFrame, pd.DataFrame]:
+        """Returns the date × token returns between `start` and `end`
+
+        Returned with the date × token frame of which dates each token has.
+        """
+        rows = self.index.slice_indexer(start, end)
+        index = self.index[rows]
+        symbols = list(self.columns)
+        return (
+            pd.DataFrame(self.values["returns"][rows], index=index, columns=symbols),
+            pd.DataFrame(self.present[rows], index=index, columns=symbols),
+        )
+
+    def get_returns_matrix(
+        self, start: str, end: str, symbols: Iterable[str]
+    ) -> pd.DataFrame:
+        """Create a matrix containing the returns for each asset
+
+        Rows are the dates between `start` and `end` all assets have returns
+        for. Assets without any are left out.
+        """
+        return select_returns_matrix(*self.get_returns_window(start, end), symbols)
+
+
+def select_returns_matrix(
+    returns: pd.DataFrame, present: pd.DataFrame, symbols: Iterable[str]
+) -> pd.DataFrame:
+    "Returns the aligned returns of `symbols`, from a returns window"
+    symbols = [symbol for symbol in symbols if present[symbol].any()]
+    aligned_rows = present.loc[:, symbols].all(axis=1)
+    return returns.loc[aligned_rows, symbols]
+
+
+class ColumnarBalances(_Columnar, Mapping):
+    "Token USD balances, also mapping symbols to Series"
+
+    fields = ("usd_balance",)
+
+    @classmethod
+    def from_series(cls, series: Mapping[str, pd.Series]) -> "ColumnarBalances":
+        return cls._from_arrays(
+            {
+                symbol: (
+                    token_series.index,
+                    {"usd_balance": token_series.to_numpy(dtype="float64")},
+                )
+                for symbol, token_series in series.items()
+            }
+        )
+
+    def __getitem__(self, symbol: str) -> pd.Series:
+        column = self.columns[symbol]
+        rows = self.present[:, column]
+        return pd.Series(
+            self.values["usd_balance"][rows, column],
+            index=self.index[rows],
+            name=f"{symbol} daily historical balance",
+        )
+
+    def total(self) -> pd.Series:
+        "Sums balances by date, ignoring missing ones unless all are"
+        usd_balance = self.values["usd_balance"]
+        return pd.Series(
+            np.where(
+                np.isnan(usd_balance).all(axis=1),
+                np.nan,
+                np.nansum(usd_balance, axis=1),
+            ),
+            index=self.index,
+            dtype="float64",
+        )
+
 
 @dataclass
 class Prices:
-    prices: dict[str, pd.DataFrame]
+    prices: Mapping[str, pd.DataFrame]
+    _returns_windows: dict[tuple[str, str], tuple[pd.DataFrame, pd.DataFrame]] = field(
+        default_factory=dict, init=False, repr=False, compare=False
+    )
 
     def get_existing_token_symbols(self) -> set[str]:
         return {*self.prices.keys()}
 
+    def to_columnar(self) -> ColumnarPrices:
+        "Returns the prices as arrays over a shared index, their usual store"
+        if isinstance(self.prices, ColumnarPrices):
+            return self.prices
+        return ColumnarPrices.from_frames(self.prices)
+
+    def get_returns_matrix(
+        self, start: str, end: str, symbols: Optional[Iterable[str]] = None
+    ) -> pd.DataFrame:
+        """Returns the aligned returns of `symbols` or of all tokens
+
+        The returns of all tokens are sliced once per window, and the columns
+        of each call selected from them.
+        """
+        if symbols is not None:
+            symbols = set(symbols)
+        if (start, end) not in self._returns_windows:
+            self._returns_windows[(start, end)] = self.to_columnar().get_returns_window(
+                start, end
+            )
+        return select_returns_matrix(
+            *self._returns_windows[(start, end)],
+            [symbol for symbol in self.prices if symbols is None or symbol in symbols],
+        )
+
 
 @dataclass
 class Balances:
-    usd_balances: dict[str, pd.Series]
+    usd_balances: Mapping[str, pd.Series]
 
     def get_existing_token_symbols(self) -> set[str]:
         return {*self.usd_balances.keys()}
 
+    def to_columnar(self) -> ColumnarBalances:
+        "Returns the balances as arrays over a shared index, their usual store"
+        if isinstance(self.usd_balances, ColumnarBalances):
+            return self.usd_balances
+        return ColumnarBalances.from_series(self.usd_balances)
+
     def copy(self):
         return Balances(
             usd_balances={
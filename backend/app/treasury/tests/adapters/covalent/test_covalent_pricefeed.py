@@ -1,13 +1,22 @@
 # pylint: disable=protected-access
-from json import loads
+# pylint: disable=redefined-outer-name
+# pylint: disable=unused-argument
+from datetime import datetime
 
+import numpy as np
+import pandas as pd
+import pytest
 from dateutil.parser import parse
 from dateutil.tz import UTC
-from fakeredis import FakeRedis
+from fakeredis.aioredis import FakeRedis
 from pytest import MonkeyPatch, mark
 
+from .....libs import ttl_cache
+from .....libs.series_codec import decode_series, encode_series
+from .....libs.swr_cache import revalidating_inline, wait_background_refreshes
+from .....libs.ttl_cache import TTLLRUCache
 from ....adapters import covalent_pricefeed
-from .conftest import covalent_hist_prices_v2_transfers, mocked_datetime
+from .conftest import covalent_hist_prices_v2_transfers
 
 
 class FakeCovalentResponse:
@@ -26,16 +35,31 @@ async def _get_fake_covalent_resp(*_, **__):
     return FakeCovalentResponse()
 
 
-@mark.asyncio
-async def test_get_coin_hist_price_redis(monkeypatch: MonkeyPatch):
-    fake_provider = FakeRedis()
+OWL_ADDRESS = covalent_hist_prices_v2_transfers[0]["contract_address"]
+
+
+@pytest.fixture
+def fake_provider(monkeypatch: MonkeyPatch):
+    _fake_provider = FakeRedis()
     monkeypatch.setattr(
         covalent_pricefeed,
-        "db",
-        fake_provider,
+        "adb_bytes",
+        _fake_provider,
         raising=True,
     )
+    monkeypatch.setattr(
+        covalent_pricefeed,
+        "today",
+        lambda _: datetime(2022, 7, 13, tzinfo=UTC),
+    )
+    monkeypatch.setattr(covalent_pricefeed, "price_series_cache", TTLLRUCache(8))
+    return _fake_provider
+
 
+@mark.asyncio
+async def test_get_coin_hist_price_redis(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
     monkeypatch.setattr(
         covalent_pricefeed.AsyncClient,
         "get",
@@ -43,33 +67,24 @@ async def test_get_coin_hist_price_redis(monkeypatch: MonkeyPatch):
         raising=True,
     )
 
-    fake_cache_key_template = "{symbol}_{start}_{end}"
-    symbol = "FakeUSDC"
-    fake_cache_key = fake_cache_key_template.format(
-        symbol=symbol,
-        start=mocked_datetime(-366, use_today=True).strftime("%Y-%m-%d"),
-        end=mocked_datetime(use_today=True).strftime("%Y-%m-%d"),
-    )
-
-    await covalent_pricefeed.get_token_hist_price_covalent("", symbol)
+    await covalent_pricefeed.get_token_hist_price_covalent(OWL_ADDRESS, "OWL")
 
+    cache_key = f"covalent_price_series_1_{OWL_ADDRESS}"
+    index, (prices,) = decode_series(await fake_provider.get(cache_key))
+    assert dict(zip(index.strftime("%Y-%m-%d"), prices)) == {
+        item["date"]: item["price"]
+        for item in covalent_hist_prices_v2_transfers[0]["prices"]
+    }
+    assert await fake_provider.exists(f"{cache_key}:fresh")
     assert (
-        loads(fake_provider.hget("covalent_prices", fake_cache_key))
-        == covalent_hist_prices_v2_transfers[0]["prices"]
+        0
+        < await fake_provider.ttl(f"{cache_key}:fresh")
+        < await fake_provider.ttl(cache_key)
     )
-    assert fake_provider.ttl("covalent_prices") in range(0, 86401)
 
 
 @mark.asyncio
-async def test_get_coin_hist_price(monkeypatch: MonkeyPatch):
-    fake_provider = FakeRedis()
-    monkeypatch.setattr(
-        covalent_pricefeed,
-        "db",
-        fake_provider,
-        raising=True,
-    )
-
+async def test_get_coin_hist_price(monkeypatch: MonkeyPatch, fake_provider: FakeRedis):
     monkeypatch.setattr(
         covalent_pricefeed.AsyncClient,
         "get",
@@ -78,7 +93,7 @@ async def test_get_coin_hist_price(monkeypatch: MonkeyPatch):
     )
 
     sanitized_prices = await covalent_pricefeed.get_token_hist_price_covalent(
-        "", "FakeUSDC"
+        OWL_ADDRESS, "OWL"
     )
 
     assert sanitized_prices == [
@@ -86,5 +101,198 @@ async def test_get_coin_hist_price(monkeypatch: MonkeyPatch):
             timestamp=parse(item["date"]).replace(tzinfo=UTC),
             value=item["price"],
         )
-        for item in covalent_hist_prices_v2_transfers[0]["prices"]
+        for item in reversed(covalent_hist_prices_v2_transfers[0]["prices"])
     ]
+
+
+@mark.asyncio
+async def test_get_coin_hist_price_fetches_missing_days(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    cache_key = "covalent_price_series_1_0xabc"
+    # Stale: no fresh marker
+    await fake_provider.set(
+        cache_key,
+        encode_series(
+            pd.DatetimeIndex(["2021-07-01", "2022-07-10", "2022-07-11"], tz=UTC),
+            [np.array([1.0, 0.1, 0.1])],
+        ),
+    )
+    requested_ranges = []
+
+    async def _get_pricing_data(token_addresses, start_date, end_date, *__):
+        requested_ranges.append(
+            (start_date.strftime("%Y-%m-%d"), end_date.strftime("%Y-%m-%d"))
+        )
+        return {
+            token_address: [
+                {"date": "2022-07-11", "price": 0.2},
+                {"date": "2022-07-12", "price": 0.3},
+                {"date": "2022-07-13", "price": 0.4},
+            ]
+            for token_address in token_addresses
+        }
+
+    monkeypatch.setattr(covalent_pricefeed, "_get_pricing_data", _get_pricing_data)
+
+    stale_prices = await covalent_pricefeed.get_token_hist_price_covalent(
+        "0xabc", "ABC"
+    )
+    await wait_background_refreshes()
+    # Synced in the background: served fresh from the store.
+    prices = await covalent_pricefeed.get_token_hist_price_covalent("0xabc", "ABC")
+
+    assert [price.value for price in stale_prices] == [1.0, 0.1, 0.1]
+    assert requested_ranges == [("2022-07-11", "2022-07-13")]
+    assert [price.value for price in prices] == [0.1, 0.2, 0.3, 0.4]
+    index, _ = decode_series(await fake_provider.get(cache_key))
+    assert "2021-07-01" not in index.strftime("%Y-%m-%d")
+
+
+@mark.asyncio
+async def test_get_coin_hist_price_revalidating_inline_syncs_stale_prices(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    await fake_provider.set(
+        "covalent_price_series_1_0xabc",
+        encode_series(pd.DatetimeIndex(["2022-07-11"], tz=UTC), [np.array([0.1])]),
+    )
+
+    async def _get_pricing_data(token_addresses, *_):
+        return {
+            token_address: [{"date": "2022-07-12", "price": 0.2}]
+            for token_address in token_addresses
+        }
+
+    monkeypatch.setattr(covalent_pricefeed, "_get_pricing_data", _get_pricing_data)
+
+    prices = await revalidating_inline(
+        covalent_pricefeed.get_token_hist_price_covalent
+    )("0xabc", "ABC")
+
+    assert [price.value for price in prices] == [0.1, 0.2]
+
+
+@mark.asyncio
+async def test_get_tokens_hist_prices_batches(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    monkeypatch.setattr(covalent_pricefeed, "PRICES_BATCH_SIZE", 2)
+    requested_urls = []
+
+    async def _get_covalent_resp(_, url, **__):
+        requested_urls.append(url)
+        addresses = url.split("/USD/")[1].split("/")[0].split(",")
+        response = FakeCovalentResponse()
+        response.resp_json = {
+            "data": [
+                {
+                    "contract_address": address,
+                    "prices": [{"date": "2022-07-13", "price": float(i)}],
+                }
+                for i, address in enumerate(addresses)
+                if address != "0xunknown"
+            ]
+        }
+        return response
+
+    monkeypatch.setattr(covalent_pricefeed.AsyncClient, "get", _get_covalent_resp)
+
+    prices = await covalent_pricefeed.get_tokens_hist_prices_covalent(
+        ["0xa", "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee", "0xunknown"]
+    )
+
+    assert len(requested_urls) == 2
+    assert "0xc02aaa39b223fe8d0a0e5c4f27ead9083c756cc2" in requested_urls[0]
+    assert prices["0xa"][0].value == 0.0
+    assert prices["0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"][0].value == 1.0
+    assert not prices["0xunknown"]
+
+    # Tokens unknown to Covalent are not requested again on the same day.
+    await covalent_pricefeed.get_tokens_hist_prices_covalent(["0xunknown"])
+    assert len(requested_urls) == 2
+
+
+@mark.asyncio
+async def test_get_tokens_hist_price_series_caches_synced_tokens(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    async def _get_pricing_data(token_addresses, *_):
+        if "0xfailed" in token_addresses:
+            raise covalent_pricefeed.RequestError("mocked request error")
+        return {
+            token_address: [
+                {"date": "2022-07-12", "price": 1.0},
+                {"date": "2022-07-13", "price": 2.0},
+            ]
+            for token_address in token_addresses
+        }
+
+    monkeypatch.setattr(covalent_pricefeed, "_get_pricing_data", _get_pricing_data)
+    monkeypatch.setattr(covalent_pricefeed, "PRICES_BATCH_SIZE", 1)
+
+    series = await covalent_pricefeed.get_tokens_hist_price_series_covalent(
+        ["0xabc", "0xfailed"]
+    )
+    # Synced series are served as cached, without a round-trip through Price.
+    assert series["0xabc"] is covalent_pricefeed.price_series_cache.peek((1, "0xabc"))
+    await fake_provider.flushall()
+    cached_series = await covalent_pricefeed.get_tokens_hist_price_series_covalent(
+        ["0xabc"]
+    )
+
+    assert list(series["0xabc"]) == [1.0, 2.0]
+    assert str(series["0xabc"].index[0]) == "2022-07-12 00:00:00+00:00"
+    assert series["0xfailed"].empty
+    assert cached_series["0xabc"] is series["0xabc"]
+    assert covalent_pricefeed.price_series_cache.stats() == {
+        "hits": 1,
+        "misses": 2,
+        "size": 1,
+    }
+
+
+@mark.asyncio
+async def test_get_tokens_hist_price_series_caches_until_stale(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    now = [1000.0]
+    monkeypatch.setattr(ttl_cache, "monotonic", lambda: now[0])
+    cache_key = "covalent_price_series_1_0xabc"
+    await fake_provider.set(
+        cache_key,
+        encode_series(pd.DatetimeIndex(["2022-07-13"], tz=UTC), [np.array([1.0])]),
+    )
+    await fake_provider.set(f"{cache_key}:fresh", 1, px=60_000)
+
+    await covalent_pricefeed.get_tokens_hist_price_series_covalent(["0xabc"])
+    now[0] += 30
+
+    assert covalent_pricefeed.price_series_cache.peek((1, "0xabc")) is not None
+    now[0] += 60
+    assert covalent_pricefeed.price_series_cache.peek((1, "0xabc")) is None
+
+
+@mark.asyncio
+async def test_get_tokens_hist_prices_isolates_failed_batches(
+    monkeypatch: MonkeyPatch, fake_provider: FakeRedis
+):
+    async def _get_pricing_data(token_addresses, *_):
+        if "0xbroken" in token_addresses:
+            raise ValueError("mocked unexpected error")
+        return {
+            token_address: [{"date": "2022-07-13", "price": 1.0}]
+            for token_address in token_addresses
+        }
+
+    monkeypatch.setattr(covalent_pricefeed, "_get_pricing_data", _get_pricing_data)
+    monkeypatch.setattr(covalent_pricefeed, "PRICES_BATCH_SIZE", 1)
+
+    prices = await covalent_pricefeed.get_tokens_hist_prices_covalent(
+        ["0xabc", "0xbroken", "0xdef"]
+    )
+
+    assert prices["0xabc"][0].value == 1.0
+    assert prices["0xdef"][0].value == 1.0
+    assert not prices["0xbroken"]
+    assert not await fake_provider.exists("covalent_price_series_1_0xbroken")
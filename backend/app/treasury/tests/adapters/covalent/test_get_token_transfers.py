@@ -1,21 +1,19 @@
 # pylint: disable=protected-access
 # pylint: disable=unused-argument
 # pylint: disable=redefined-outer-name
+from asyncio import gather, sleep
 from copy import deepcopy
 from json import loads
 
 import pytest
 from dateutil.parser import parse
-from fakeredis import FakeRedis
+from fakeredis import FakeServer
+from fakeredis.aioredis import FakeRedis
 from httpx import AsyncClient
 
+from .....libs.swr_cache import revalidating_inline, wait_background_refreshes
 from ....adapters.covalent import transfers_v2
-from .conftest import (
-    MockResponse,
-    covalent_transfers_v2_transfers,
-    mocked_datetime,
-    return_mocked_resp,
-)
+from .conftest import MockResponse, covalent_transfers_v2_transfers, return_mocked_resp
 
 
 @pytest.fixture
@@ -65,7 +63,7 @@ def patch_resp_corrupt(monkeypatch):
 def patch_db(monkeypatch):
     fake_provider = FakeRedis()
     monkeypatch.setattr(
-        "backend.app.treasury.adapters.covalent.transfers_v2.db", fake_provider
+        "backend.app.treasury.adapters.covalent.transfers_v2.adb_bytes", fake_provider
     )
 
 
@@ -94,24 +92,135 @@ async def test_successful_output(patch_resp, patch_db):
 
 @pytest.mark.asyncio
 async def test_successful_cache(patch_resp, patch_db):
-    await transfers_v2.get_token_transfers("0xa", "0xb", 1)
+    transfers = await transfers_v2.get_token_transfers("0xa", "0xb", 1)
 
-    fake_cache_key_head = "covalent_transfer_items_"
-    fake_cache_key_tail = "{treasury_address}_{contract_address}_{chain_id}_{date}"
+    fake_cache_key_head = "covalent_transfers_"
+    fake_cache_key_tail = "{treasury_address}_{contract_address}_{chain_id}"
     fake_cache_key = fake_cache_key_head + fake_cache_key_tail
     fake_cache_key = fake_cache_key.format(
         treasury_address="0xa",
         contract_address="0xb",
         chain_id=1,
-        date=mocked_datetime(use_today=True).strftime("%Y-%m-%d"),
     )
 
+    assert [
+        transfers_v2._decode_transfers(raw_transfers)
+        for raw_transfers in await transfers_v2.adb_bytes.lrange(fake_cache_key, 0, -1)
+    ] == [transfers]
+    assert loads(
+        await transfers_v2.adb_bytes.hget("covalent_transfers_sync", fake_cache_key)
+    ) == {
+        "block_height": covalent_transfers_v2_transfers[0]["block_height"],
+        "tx_hashes": [covalent_transfers_v2_transfers[0]["tx_hash"]],
+    }
+    policy = transfers_v2.TRANSFERS_CACHE_POLICY
     assert (
-        loads(transfers_v2.db.get(fake_cache_key))
-        # pylint: disable=unsubscriptable-object
-        == MockResponse().json()["data"]["items"]
+        0
+        < await transfers_v2.adb_bytes.pttl(f"{fake_cache_key}:fresh")
+        <= (policy.soft_ttl.total_seconds() * 1000 * (1 + policy.jitter))
+    )
+
+
+@pytest.mark.asyncio
+async def test_incremental_sync(monkeypatch, patch_db):
+    old_items, new_item = covalent_transfers_v2_transfers[1:], {
+        **covalent_transfers_v2_transfers[0],
+        "block_height": covalent_transfers_v2_transfers[1]["block_height"] + 1,
+    }
+    requested_params = []
+
+    async def _get_transfer_resp(*_, params, **__):
+        requested_params.append(params)
+        response = MockResponse()
+        items = (
+            [new_item, covalent_transfers_v2_transfers[1]]
+            if "starting-block" in params
+            else old_items
+        )
+        response.json = lambda *_: {
+            "data": {
+                "items": items,
+                "pagination": {"has_more": False},
+            }
+        }
+        return response
+
+    monkeypatch.setattr(AsyncClient, "get", _get_transfer_resp)
+
+    await transfers_v2.get_token_transfers("0xa", "0xb", 1)
+    # Fresh: served from the store.
+    await transfers_v2.get_token_transfers("0xa", "0xb", 1)
+    assert len(requested_params) == 1
+
+    cache_key = "covalent_transfers_0xa_0xb_1"
+    await transfers_v2.adb_bytes.delete(f"{cache_key}:fresh")
+
+    # Stale: served from the store while it is synced.
+    assert await transfers_v2.get_token_transfers("0xa", "0xb", 1) == list(
+        transfers_v2._transfers_of_items(old_items)
+    )
+    await wait_background_refreshes()
+    transfers = await transfers_v2.get_token_transfers("0xa", "0xb", 1)
+
+    assert requested_params[-1]["starting-block"] == old_items[0]["block_height"]
+    assert len(transfers) == 2
+    # One series of transfers by sync, newest first
+    assert [
+        len(transfers_v2._decode_transfers(raw_transfers))
+        for raw_transfers in await transfers_v2.adb_bytes.lrange(cache_key, 0, -1)
+    ] == [1, 1]
+    assert transfers == list(transfers_v2._transfers_of_items([new_item] + old_items))
+
+
+@pytest.mark.asyncio
+async def test_concurrent_syncs_append_once(monkeypatch):
+    server = FakeServer()
+    monkeypatch.setattr(transfers_v2, "adb_bytes", FakeRedis(server=server))
+    old_items, new_item = covalent_transfers_v2_transfers[1:], {
+        **covalent_transfers_v2_transfers[0],
+        "block_height": covalent_transfers_v2_transfers[1]["block_height"] + 1,
+    }
+    requested_params = []
+
+    async def _get_transfer_resp(*_, params, **__):
+        requested_params.append(params)
+        # Lets the other sync run meanwhile
+        await sleep(0)
+        response = MockResponse()
+        items = (
+            [new_item, covalent_transfers_v2_transfers[1]]
+            if "starting-block" in params
+            else old_items
+        )
+        response.json = lambda *_: {
+            "data": {"items": items, "pagination": {"has_more": False}}
+        }
+        return response
+
+    monkeypatch.setattr(AsyncClient, "get", _get_transfer_resp)
+    await transfers_v2.get_token_transfers("0xa", "0xb", 1)
+    cache_key = "covalent_transfers_0xa_0xb_1"
+    await transfers_v2.adb_bytes.delete(f"{cache_key}:fresh")
+
+    # As two batch processes would, without coalescing them
+    get_token_transfers = revalidating_inline(
+        transfers_v2.get_token_transfers.__wrapped__
+    )
+    transfers = await gather(
+        get_token_transfers("0xa", "0xb", 1), get_token_transfers("0xa", "0xb", 1)
+    )
+
+    assert len(requested_params) == 2
+    assert sorted(map(len, transfers)) == [1, 2]
+    # A sync which got the lock late doesn't append what was synced meanwhile.
+    assert await transfers_v2._sync_transfers("0xa", "0xb", 1, cache_key) == max(
+        transfers, key=len
     )
-    assert transfers_v2.db.ttl(fake_cache_key) in range(0, 86401)
+    assert len(requested_params) == 2
+    assert [
+        len(transfers_v2._decode_transfers(raw_transfers))
+        for raw_transfers in await FakeRedis(server=server).lrange(cache_key, 0, -1)
+    ] == [1, 1]
 
 
 @pytest.mark.asyncio
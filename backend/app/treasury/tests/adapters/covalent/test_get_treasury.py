@@ -2,9 +2,11 @@
 # pylint: disable=unused-argument
 # pylint: disable=redefined-outer-name
 import pytest
-from fakeredis import FakeRedis
+from fakeredis.aioredis import FakeRedis
 from httpx import AsyncClient
 
+from .....token_whitelists import TokenWhitelist
+from .....token_whitelists.adapters import replace_token_whitelist
 from ....adapters.covalent import portfolio_v2
 from ....models import ERC20, Treasury
 from .conftest import (
@@ -35,16 +37,21 @@ def patch_resp(monkeypatch):
 
 @pytest.fixture
 def patch_db(monkeypatch):
-    fake_provider = FakeRedis()
+    fake_provider = FakeRedis(decode_responses=True)
     monkeypatch.setattr(
-        "backend.app.treasury.adapters.covalent.portfolio_v2.db", fake_provider
+        "backend.app.treasury.adapters.covalent.portfolio_v2.adb", fake_provider
     )
+    return fake_provider
 
 
 @pytest.mark.asyncio
-async def test_get_treasury_success(patch_resp, patch_db):
+@pytest.mark.parametrize("in_process", [True, False])
+async def test_get_treasury_success(patch_resp, patch_db, in_process):
+    await replace_token_whitelist(
+        ["0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"], patch_db
+    )
     treasury = await portfolio_v2.get_treasury(
-        "", ["0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"], 1
+        "", TokenWhitelist(in_process=in_process), 1
     )
 
     asset = ERC20(
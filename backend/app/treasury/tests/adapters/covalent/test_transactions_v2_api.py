@@ -0,0 +1,16 @@
+import pytest
+from httpx import AsyncClient
+
+from ....adapters.covalent import get_latest_transaction_block
+from .conftest import MockResponse, return_mocked_resp
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "items,block_height", [([{"block_height": 15000000}], 15000000), ([], None)]
+)
+async def test_get_latest_transaction_block(monkeypatch, items, block_height):
+    monkeypatch.setattr(AsyncClient, "get", return_mocked_resp)
+    monkeypatch.setattr(MockResponse, "json", lambda *_: {"data": {"items": items}})
+
+    assert await get_latest_transaction_block("", 1) == block_height
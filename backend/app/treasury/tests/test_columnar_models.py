@@ -0,0 +1,110 @@
+from functools import reduce
+
+import numpy as np
+import pandas as pd
+import pytest
+from dateutil.tz import UTC
+
+from ...libs import price_stats
+from ..models import Balances, ColumnarPrices, Prices
+
+
+def make_series(start: str, values: list[float]) -> pd.Series:
+    return pd.Series(
+        values,
+        index=pd.date_range(
+            start, periods=len(values), freq="D", tz=UTC, name="timestamp"
+        ),
+        dtype="float64",
+    )
+
+
+def make_prices() -> Prices:
+    return Prices(
+        prices={
+            "ABC": price_stats.make_returns_df(
+                make_series("2022-07-01", [1.0, 2.0, 4.0, 2.0, 1.0]), "price"
+            ),
+            "DEF": price_stats.make_returns_df(
+                make_series("2022-07-03", [3.0, np.nan, 3.0, 6.0]), "price"
+            ),
+            "GHI": price_stats.make_returns_df(
+                make_series("2022-08-01", [1.0, 2.0]), "price"
+            ),
+        }
+    )
+
+
+def test_columnar_prices_map_symbols_to_frames():
+    prices = make_prices()
+    columnar_prices = ColumnarPrices.from_frames(prices.prices)
+
+    assert list(columnar_prices) == ["ABC", "DEF", "GHI"]
+    for symbol, frame in prices.prices.items():
+        pd.testing.assert_frame_equal(columnar_prices[symbol], frame, check_freq=False)
+    assert columnar_prices.get_field("price").shape == (len(columnar_prices.index), 3)
+
+
+@pytest.mark.parametrize("columnar", [False, True])
+def test_returns_matrix_keeps_dates_all_tokens_have(
+    monkeypatch: pytest.MonkeyPatch, columnar
+):
+    windows = []
+    get_returns_window = ColumnarPrices.get_returns_window
+
+    def _get_returns_window(self, start, end):
+        windows.append((start, end))
+        return get_returns_window(self, start, end)
+
+    monkeypatch.setattr(ColumnarPrices, "get_returns_window", _get_returns_window)
+    prices = make_prices()
+    if columnar:
+        prices = Prices(prices=ColumnarPrices.from_frames(prices.prices))
+
+    returns_matrix = prices.get_returns_matrix("2022-07-02", "2022-07-10")
+
+    assert list(returns_matrix.columns) == ["ABC", "DEF"]
+    assert list(returns_matrix.index.strftime("%Y-%m-%d")) == [
+        "2022-07-03",
+        "2022-07-04",
+        "2022-07-05",
+    ]
+    assert (
+        returns_matrix.loc["2022-07-05", "ABC"]
+        == prices.prices["ABC"].loc["2022-07-05", "returns"]
+    )
+    assert (
+        returns_matrix.loc["2022-07-05", "DEF"]
+        == prices.prices["DEF"].loc["2022-07-05", "returns"]
+    )
+    assert returns_matrix.index.name == "timestamp"
+    def_returns_matrix = prices.get_returns_matrix("2022-07-02", "2022-07-10", {"DEF"})
+    assert list(def_returns_matrix.columns) == ["DEF"]
+    # Rows are aligned on the selected tokens only.
+    assert list(def_returns_matrix.index.strftime("%Y-%m-%d")) == [
+        "2022-07-03",
+        "2022-07-04",
+        "2022-07-05",
+        "2022-07-06",
+    ]
+    # The window is sliced once for all column sets.
+    assert windows == [("2022-07-02", "2022-07-10")]
+
+
+def test_total_balance_equals_sum_of_aligned_series():
+    balances = Balances(
+        usd_balances={
+            "ABC": make_series("2022-07-01", [1.0, np.nan, 4.0, 2.0]),
+            "DEF": make_series("2022-07-03", [3.0, np.nan, 3.0]),
+            "GHI": make_series("2022-07-08", [1.0, 2.0]),
+        }
+    )
+
+    pd.testing.assert_series_equal(
+        balances.to_columnar().total(),
+        reduce(
+            lambda acc, item: acc.add(item, fill_value=0),
+            balances.usd_balances.values(),
+        ),
+        check_freq=False,
+    )
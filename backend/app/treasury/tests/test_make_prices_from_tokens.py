@@ -0,0 +1,156 @@
+# pylint: disable=unused-argument
+# pylint: disable=redefined-outer-name
+import asyncio
+import datetime
+
+import pandas as pd
+import pytest
+from fakeredis.aioredis import FakeRedis
+from pytz import UTC
+
+from ...libs.series import make_hist_price_series
+from ...libs.ttl_cache import TTLLRUCache
+from .. import actions
+from ..adapters import covalent_pricefeed
+from ..models import ERC20, Price, Treasury
+
+
+@pytest.fixture
+def patch_get_tokens_hist_price_series_covalent(monkeypatch: pytest.MonkeyPatch):
+    requested_addresses = []
+
+    async def _implem(token_addresses, **_):
+        requested_addresses.extend(token_addresses)
+        return {
+            token_address: make_hist_price_series(
+                token_address,
+                []
+                if token_address == "0xempty"
+                else [
+                    Price(
+                        timestamp=datetime.datetime(2022, 1, day, tzinfo=UTC),
+                        value=float(day),
+                    )
+                    for day in range(1, 4)
+                ],
+            )
+            for token_address in token_addresses
+            if token_address != "0xfailed"
+        }
+
+    monkeypatch.setattr(actions, "get_tokens_hist_price_series_covalent", _implem)
+    return requested_addresses
+
+
+@pytest.mark.asyncio
+async def test_make_prices_from_tokens_skips_failed_tokens(
+    patch_get_tokens_hist_price_series_covalent,
+):
+    prices = await actions.make_prices_from_tokens(
+        {("ABC", "0xabc"), ("FAILED", "0xfailed"), ("EMPTY", "0xempty")}
+    )
+
+    assert prices.get_existing_token_symbols() == {"ABC", "ETH"}
+    assert sorted(patch_get_tokens_hist_price_series_covalent) == [
+        "0xabc",
+        "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee",
+        "0xempty",
+        "0xfailed",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_make_prices_from_tokens_uses_shared_prices(
+    patch_get_tokens_hist_price_series_covalent,
+):
+    shared_prices = await actions.make_token_prices(["0xabc"])
+    patch_get_tokens_hist_price_series_covalent.clear()
+
+    prices = await actions.make_prices_from_tokens(
+        {("ABC", "0xabc"), ("DEF", "0xdef")}, shared_prices=shared_prices
+    )
+
+    pd.testing.assert_frame_equal(
+        prices.prices["ABC"], shared_prices["0xabc"], check_freq=False
+    )
+    assert prices.get_existing_token_symbols() == {"ABC", "DEF", "ETH"}
+    assert sorted(patch_get_tokens_hist_price_series_covalent) == [
+        "0xdef",
+        "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_make_treasuries_token_prices_computes_shared_tokens_once(
+    monkeypatch: pytest.MonkeyPatch,
+    patch_get_tokens_hist_price_series_covalent,
+):
+    async def make_treasury_from_address(address, _):
+        if address == "0xfailed":
+            raise RuntimeError("mocked portfolio error")
+        return Treasury(
+            address,
+            [
+                ERC20("Abc", "ABC", "0xabc", 1.0, 1.0),
+                ERC20(address, address.upper(), address, 1.0, 1.0),
+            ],
+        )
+
+    monkeypatch.setattr(
+        actions, "make_treasury_from_address", make_treasury_from_address
+    )
+
+    token_prices = await actions.make_treasuries_token_prices(
+        [("0xt1", 1), ("0xt2", 1), ("0xfailed", 1)]
+    )
+
+    assert sorted(patch_get_tokens_hist_price_series_covalent) == [
+        "0xabc",
+        "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee",
+        "0xt1",
+        "0xt2",
+    ]
+    assert {key: symbol for key, (symbol, _) in token_prices.items()} == {
+        (1, "0xabc"): "ABC",
+        (1, "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"): "ETH",
+        (1, "0xt1"): "0XT1",
+        (1, "0xt2"): "0XT2",
+    }
+
+
+@pytest.fixture
+def patch_get_pricing_data(monkeypatch: pytest.MonkeyPatch):
+    calls = {"running": 0, "max_running": 0}
+
+    async def _get_pricing_data(token_addresses, *_):
+        calls["running"] += 1
+        calls["max_running"] = max(calls["max_running"], calls["running"])
+        await asyncio.sleep(0.01)
+        calls["running"] -= 1
+        return {
+            token_address: [{"date": "2022-07-13", "price": 1.0}]
+            for token_address in token_addresses
+        }
+
+    monkeypatch.setattr(covalent_pricefeed, "adb_bytes", FakeRedis())
+    monkeypatch.setattr(covalent_pricefeed, "price_series_cache", TTLLRUCache(16))
+    monkeypatch.setattr(covalent_pricefeed, "_get_pricing_data", _get_pricing_data)
+    monkeypatch.setattr(covalent_pricefeed, "PRICES_BATCH_SIZE", 1)
+    monkeypatch.setattr(
+        covalent_pricefeed,
+        "today",
+        lambda _: datetime.datetime(2022, 7, 13, tzinfo=UTC),
+    )
+    return calls
+
+
+@pytest.mark.asyncio
+async def test_make_prices_from_tokens_bounded_concurrency(patch_get_pricing_data):
+    prices = await actions.make_prices_from_tokens(
+        {(f"T{i}", f"0x{i}") for i in range(10)},
+        add_eth=False,
+        semaphore=asyncio.Semaphore(3),
+    )
+
+    assert prices.get_existing_token_symbols() == {f"T{i}" for i in range(10)}
+    assert patch_get_pricing_data["max_running"] == 3
@@ -6,10 +6,19 @@ from unittest.mock import Mock
 
 import pytest
 import pytest_asyncio
+from httpx import ReadTimeout
 from pytz import UTC
 
+from ...libs.daily_cache import DailyLRUCache
 from .. import actions
-from ..models import ERC20, Transfer, Treasury
+from ..models import ERC20, BalancesAtTransfers, Transfer, Treasury
+
+
+@pytest.fixture(autouse=True)
+def patch_balance_series_cache(monkeypatch: pytest.MonkeyPatch):
+    _balance_series_cache = DailyLRUCache(8)
+    monkeypatch.setattr(actions, "balance_series_cache", _balance_series_cache)
+    return _balance_series_cache
 
 
 @pytest_asyncio.fixture
@@ -34,7 +43,7 @@ def patch_balances_at_transfers_constructor(monkeypatch: pytest.MonkeyPatch):
     monkeypatch.setattr(
         actions.BalancesAtTransfers,
         "from_transfer_and_end_balance_dict",
-        Mock(return_value="balances_at_transfers_mock"),
+        Mock(return_value=BalancesAtTransfers(balances={})),
     )
     mocked_constructor: Mock = (
         actions.BalancesAtTransfers.from_transfer_and_end_balance_dict
@@ -69,7 +78,7 @@ async def test_make_transfers_for_treasury(
 
     balances_at_transfers = await actions.make_transfers_balances_for_treasury(treasury)
 
-    assert balances_at_transfers == "balances_at_transfers_mock"
+    assert balances_at_transfers == BalancesAtTransfers(balances={})
     assert patch_balances_at_transfers_constructor.call_args[0][0] == (
         {
             "ABC": (
@@ -100,3 +109,101 @@ async def test_make_transfers_for_treasury(
             ),
         }
     )
+
+
+@pytest.mark.asyncio
+async def test_make_transfers_for_treasury_collects_asset_errors(
+    monkeypatch: pytest.MonkeyPatch, patch_balances_at_transfers_constructor
+):
+    async def _implem(_, contract_address: str):
+        if contract_address == "0xdef":
+            raise ReadTimeout("mocked read timeout")
+        return [
+            Transfer(
+                timestamp=datetime.datetime(year=2022, month=1, day=1, tzinfo=UTC),
+                amount=1,
+            )
+        ]
+
+    monkeypatch.setattr(actions, "get_token_transfers", _implem)
+
+    treasury = Treasury(
+        address="0x0",
+        assets=[
+            ERC20(
+                token_name="abc",
+                token_symbol="ABC",
+                token_address="0xabc",
+                balance=1000,
+                balance_usd=2,
+            ),
+            ERC20(
+                token_name="def",
+                token_symbol="DEF",
+                token_address="0xdef",
+                balance=333,
+                balance_usd=3,
+            ),
+        ],
+    )
+
+    await actions.make_transfers_balances_for_treasury(treasury)
+
+    assert {*patch_balances_at_transfers_constructor.call_args[0][0].keys()} == {"ABC"}
+    assert {*treasury.transfer_errors.keys()} == {"DEF"}
+    assert isinstance(treasury.transfer_errors["DEF"], ReadTimeout)
+
+
+@pytest.mark.asyncio
+async def test_make_transfers_for_treasury_caches_balance_series(
+    monkeypatch: pytest.MonkeyPatch, patch_balance_series_cache
+):
+    requested_addresses = []
+
+    async def _implem(_, contract_address: str):
+        requested_addresses.append(contract_address)
+        return [
+            Transfer(
+                timestamp=datetime.datetime(year=2022, month=1, day=1, tzinfo=UTC),
+                amount=1,
+            )
+        ]
+
+    monkeypatch.setattr(actions, "get_token_transfers", _implem)
+
+    def make_treasury(def_balance: float) -> Treasury:
+        return Treasury(
+            address="0x0",
+            assets=[
+                ERC20(
+                    token_name="abc",
+                    token_symbol="ABC",
+                    token_address="0xabc",
+                    balance=1000,
+                    balance_usd=2,
+                ),
+                ERC20(
+                    token_name="def",
+                    token_symbol="DEF",
+                    token_address="0xdef",
+                    balance=def_balance,
+                    balance_usd=3,
+                ),
+            ],
+        )
+
+    balances_at_transfers = await actions.make_transfers_balances_for_treasury(
+        make_treasury(333)
+    )
+    # The DEF balance changed: only its series is made again.
+    cached_balances_at_transfers = await actions.make_transfers_balances_for_treasury(
+        make_treasury(334)
+    )
+
+    assert requested_addresses == ["0xabc", "0xdef", "0xdef"]
+    assert (
+        cached_balances_at_transfers.balances["ABC"]
+        is balances_at_transfers.balances["ABC"]
+    )
+    assert list(cached_balances_at_transfers.balances["DEF"]) == [334]
+    assert patch_balance_series_cache.stats() == {"hits": 1, "misses": 3, "size": 3}
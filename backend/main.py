@@ -3,9 +3,16 @@ from fastapi import FastAPI
 from fastapi.responses import HTMLResponse
 from fastapi.staticfiles import StaticFiles
 
+from app import adb, adb_bytes
 from app.endpoints import app as endpoints_app
+from app.libs.http_client import close_clients, open_clients
 
 app = FastAPI()
+# Events of mounted sub-applications are not run, so register them here too.
+app.add_event_handler("startup", open_clients)
+app.add_event_handler("shutdown", close_clients)
+app.add_event_handler("shutdown", adb.close)
+app.add_event_handler("shutdown", adb_bytes.close)
 
 
 @app.get("/", name="home", description="get home HTML")
@@ -0,0 +1,391 @@
+# pylint: disable=import-error
+"""Local stand-in for the Covalent, Bitquery and tokenlists upstreams
+
+The backend sends its upstream requests here when `UPSTREAM_SIMULATOR_URL` is
+set, as `/<upstream host>/<upstream path>`. Responses are synthetic, recorded
+from the real upstreams, or replayed from a recording.
+"""
+import asyncio
+import hashlib
+import json
+import random
+import re
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Any, Optional
+
+import httpx
+from clize import parameters, run
+from fastapi import FastAPI, Request, Response
+
+ETH_ADDRESS = "0xeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeeee"
+DAY_BLOCKS = 6500
+TOKENLIST_HOSTS = {
+    "raw.githubusercontent.com",
+    "tokens.coingecko.com",
+    "api.coinmarketcap.com",
+}
+
+
+@dataclass
+class Config:  # pylint: disable=too-many-instance-attributes
+    mode: str = "synthetic"
+    recordings: Path = Path("recordings")
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    throttle_rate: float = 0.0
+    assets: int = 20
+    pages: int = 3
+    page_size: int = 100
+    pools: int = 1000
+    seed: int = 0
+
+
+config = Config()
+app = FastAPI()
+
+
+def _rng(*parts: Any) -> random.Random:
+    "Returns a generator seeded by `parts`, so that responses are repeatable"
+    digest = hashlib.sha256(repr((config.seed, *parts)).encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+def _address(*parts: Any) -> str:
+    return "0x" + hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def _tokens() -> list[tuple[str, str]]:
+    "Returns the (symbol, address) of the synthetic tokens, ETH first"
+    return [("ETH", ETH_ADDRESS)] + [
+        (f"TKN{i}", _address("token", i)) for i in range(config.assets - 1)
+    ]
+
+
+def _today() -> datetime:
+    return datetime.utcnow().replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _paginated(items: list[Any], page_number: int, page_size: int) -> dict[str, Any]:
+    page = items[page_number * page_size : (page_number + 1) * page_size]
+    return {
+        "items": page,
+        "pagination": {
+            "has_more": (page_number + 1) * page_size < len(items),
+            "page_number": page_number,
+            "page_size": page_size,
+            "total_count": len(items),
+        },
+    }
+
+
+def portfolio_v2(treasury_address: str, params: dict[str, str]) -> dict[str, Any]:
+    # pylint: disable=unused-argument
+    rng = _rng("portfolio", treasury_address)
+    return {
+        "data": {
+            "address": treasury_address,
+            "items": [
+                {
+                    "contract_name": symbol,
+                    "contract_ticker_symbol": symbol,
+                    "contract_address": address,
+                    "contract_decimals": 18,
+                    "holdings": [
+                        {
+                            "close": {
+                                "balance": str(rng.randrange(10**18, 10**24)),
+                                "quote": rng.uniform(1e3, 1e7),
+                            }
+                        }
+                    ],
+                }
+                for symbol, address in _tokens()
+            ],
+        }
+    }
+
+
+def _head_block() -> int:
+    return 15_000_000 + (_today() - datetime(2022, 7, 1)).days * DAY_BLOCKS
+
+
+def _transfer_block_heights(rng: random.Random, head_block: int) -> list[int]:
+    "Returns the blocks of the transfers of a token, newest first like Covalent"
+    return sorted(
+        (
+            head_block - rng.randrange(365 * DAY_BLOCKS)
+            for _ in range(config.pages * config.page_size)
+        ),
+        reverse=True,
+    )
+
+
+def transactions_v2(treasury_address: str, params: dict[str, str]) -> dict[str, Any]:
+    "Returns the latest transaction of a treasury, the one of its latest transfer"
+    head_block = _head_block()
+    latest_block_height = max(
+        _transfer_block_heights(
+            _rng("transfers", treasury_address, address), head_block
+        )[0]
+        for _, address in _tokens()
+    )
+    items = [
+        {
+            "block_signed_at": (
+                _today()
+                - timedelta(days=(head_block - latest_block_height) / DAY_BLOCKS)
+            ).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "block_height": latest_block_height,
+            "tx_hash": _address("tx", treasury_address, latest_block_height),
+            "successful": True,
+        }
+    ]
+    return {
+        "data": _paginated(
+            items,
+            int(params.get("page-number", 0)),
+            int(params.get("page-size", 100)),
+        )
+    }
+
+
+def transfers_v2(treasury_address: str, params: dict[str, str]) -> dict[str, Any]:
+    contract_address = params["contract-address"]
+    rng = _rng("transfers", treasury_address, contract_address)
+    symbol = dict((address, symbol) for symbol, address in _tokens()).get(
+        contract_address, "TKN"
+    )
+    head_block = _head_block()
+    block_heights = _transfer_block_heights(rng, head_block)
+    starting_block = int(params.get("starting-block", 0))
+    items = [
+        {
+            "block_signed_at": (
+                _today() - timedelta(days=(head_block - block_height) / DAY_BLOCKS)
+            ).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "block_height": block_height,
+            "tx_hash": _address("tx", treasury_address, contract_address, i),
+            "transfers": [
+                {
+                    "delta": str(rng.randrange(10**15, 10**21)),
+                    "contract_decimals": 18,
+                    "contract_name": symbol,
+                    "contract_ticker_symbol": symbol,
+                    "contract_address": contract_address,
+                    "transfer_type": rng.choice(["IN", "IN", "OUT"]),
+                }
+            ],
+        }
+        for i, block_height in enumerate(block_heights)
+        if block_height >= starting_block
+    ]
+    return {
+        "data": _paginated(items, int(params.get("page-number", 0)), config.page_size)
+    }
+
+
+def historical_by_addresses(addresses: str, params: dict[str, str]) -> dict[str, Any]:
+    start = datetime.strptime(params["from"], "%Y-%m-%d")
+    end = datetime.strptime(params["to"], "%Y-%m-%d")
+    data = []
+    for address in addresses.split(","):
+        rng = _rng("prices", address)
+        # A random walk anchored a year back, so that overlapping ranges agree.
+        day = _today() - timedelta(days=400)
+        price = rng.uniform(0.01, 3000)
+        prices = []
+        while day <= end:
+            if day >= start:
+                prices.append({"date": day.strftime("%Y-%m-%d"), "price": price})
+            price *= rng.lognormvariate(0, 0.04)
+            day += timedelta(days=1)
+        data.append({"contract_address": address, "prices": prices[::-1]})
+    return {"data": data}
+
+
+def pools(protocol: str, params: dict[str, str]) -> dict[str, Any]:
+    items = [
+        {"exchange": _address("pool", protocol, i)} for i in range(config.pools)
+    ] + [{"exchange": address} for _, address in _tokens()]
+    return {
+        "data": _paginated(
+            items,
+            int(params.get("page-number", 0)),
+            int(params.get("page-size", 100)),
+        )
+    }
+
+
+def bitquery(query: str) -> dict[str, Any]:
+    match = re.search(r'address\(address: {is: "(0x[0-9a-fA-F]+)"}\)', query)
+    treasury_address = match.group(1) if match else ""
+    rng = _rng("bitquery", treasury_address)
+    value = 0.0
+    history = []
+    for days in sorted(
+        (rng.uniform(0, 365) for _ in range(config.page_size)), reverse=True
+    ):
+        amount = rng.uniform(-value, 100.0)
+        value += amount
+        history.append(
+            {
+                "transferAmount": amount,
+                "value": value,
+                "timestamp": (_today() - timedelta(days=days)).strftime(
+                    "%Y-%m-%dT%H:%M:%SZ"
+                ),
+            }
+        )
+    return {"data": {"ethereum": {"address": [{"balances": [{"history": history}]}]}}}
+
+
+def tokenlist() -> dict[str, Any]:
+    return {
+        "tokens": [
+            {"chainId": 1, "address": address, "symbol": symbol, "decimals": 18}
+            for symbol, address in _tokens()
+        ]
+    }
+
+
+def synthetic(host: str, path: str, params: dict[str, str], body: bytes) -> Any:
+    if host in TOKENLIST_HOSTS:
+        return tokenlist()
+    if host == "graphql.bitquery.io":
+        return bitquery(json.loads(body or b"{}").get("query", ""))
+    routes = [
+        (r"v1/\d+/address/(\w+)/portfolio_v2/?", portfolio_v2),
+        (r"v1/\d+/address/(\w+)/transfers_v2/?", transfers_v2),
+        (r"v1/\d+/address/(\w+)/transactions_v2/?", transactions_v2),
+        (
+            r"v1/pricing/historical_by_addresses_v2/\d+/USD/([\w,]+)/?",
+            historical_by_addresses,
+        ),
+        (r"v1/\d+/xy=k/(\w+)/pools/?", pools),
+    ]
+    for pattern, route in routes:
+        match = re.fullmatch(pattern, path)
+        if match:
+            return route(match.group(1), params)
+    return None
+
+
+def _recording_path(method: str, host: str, path: str, params: dict, body: bytes):
+    # API keys are left out, so that recordings are shareable.
+    params = sorted((k, v) for k, v in params.items() if k != "key")
+    digest = hashlib.sha256(
+        json.dumps([method, host, path, params, body.decode()]).encode()
+    ).hexdigest()
+    return config.recordings / host / f"{digest}.json"
+
+
+async def _record(
+    request: Request, host: str, path: str, body: bytes, recording_path: Path
+) -> Response:
+    async with httpx.AsyncClient(timeout=120.0) as client:
+        resp = await client.request(
+            request.method,
+            f"https://{host}/{path}",
+            params=request.query_params.multi_items(),
+            content=body,
+            headers={
+                key: value
+                for key, value in request.headers.items()
+                if key.lower() in ("content-type", "x-api-key", "user-agent")
+            },
+        )
+    if resp.status_code == 200:
+        recording_path.parent.mkdir(parents=True, exist_ok=True)
+        recording_path.write_text(resp.text)
+    return Response(
+        resp.content,
+        status_code=resp.status_code,
+        media_type=resp.headers.get("content-type"),
+    )
+
+
+def _error_response() -> Optional[Response]:
+    if random.random() < config.throttle_rate:
+        return Response(status_code=429, headers={"Retry-After": "1"})
+    if random.random() < config.error_rate:
+        return Response(status_code=503)
+    return None
+
+
+@app.api_route("/{host}/{path:path}", methods=["GET", "POST"])
+async def simulate(host: str, path: str, request: Request) -> Response:
+    await asyncio.sleep(
+        max(0.0, config.latency + random.uniform(-config.jitter, config.jitter))
+    )
+    error_response = _error_response()
+    if error_response is not None:
+        return error_response
+
+    params = dict(request.query_params)
+    body = await request.body()
+    recording_path = _recording_path(request.method, host, path, params, body)
+    if config.mode == "record":
+        return await _record(request, host, path, body, recording_path)
+    if config.mode == "replay":
+        if not recording_path.exists():
+            return Response(status_code=404)
+        return Response(recording_path.read_text(), media_type="application/json")
+
+    data = synthetic(host, path, params, body)
+    if data is None:
+        return Response(status_code=404)
+    return Response(json.dumps(data), media_type="application/json")
+
+
+def serve(
+    *,
+    mode: parameters.one_of("synthetic", "record", "replay") = config.mode,
+    recordings: Path = config.recordings,
+    latency: float = config.latency,
+    jitter: float = config.jitter,
+    error_rate: float = config.error_rate,
+    throttle_rate: float = config.throttle_rate,
+    assets: int = config.assets,
+    pages: int = config.pages,
+    page_size: int = config.page_size,
+    pools: int = config.pools,  # pylint: disable=redefined-outer-name
+    seed: int = config.seed,
+    port: int = 8010,
+):  # pylint: disable=too-many-arguments
+    """Runs the upstream simulator
+
+    :param mode: synthetic, record or replay
+    :param recordings: folder where responses are recorded to and replayed from
+    :param latency: added to every response, in seconds
+    :param jitter: latency varies by up to this many seconds either way
+    :param error_rate: fraction of requests answered with a 503
+    :param throttle_rate: fraction of requests answered with a 429
+    :param assets: tokens per treasury
+    :param pages: transfers pages per token
+    :param page_size: items per transfers page
+    :param pools: whitelisted pairs
+    :param seed: synthetic responses are repeatable for a given seed
+    :param port: port to listen on
+    """
+    config.mode = mode
+    config.recordings = recordings
+    config.latency = latency
+    config.jitter = jitter
+    config.error_rate = error_rate
+    config.throttle_rate = throttle_rate
+    config.assets = assets
+    config.pages = pages
+    config.page_size = page_size
+    config.pools = pools
+    config.seed = seed
+
+    import uvicorn  # pylint: disable=import-outside-toplevel
+
+    uvicorn.run(app, host="0.0.0.0", port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    run(serve)